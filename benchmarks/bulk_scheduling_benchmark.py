@@ -0,0 +1,118 @@
+"""
+Benchmark: bulk appointment scheduling vs one request at a time
+
+Seeds a scratch database with a provider roster, then schedules the same
+mixed-urgency request stream with AppointmentService.schedule_appointments
+and, on a sample, with repeated schedule_appointment calls.
+
+Usage:
+    python benchmarks/bulk_scheduling_benchmark.py --requests 10000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+
+from src.database.models import Base, Patient, Provider, ProviderAvailability, Appointment
+from src.services.appointment_service import AppointmentService
+from src.services.provider_calendar import CalendarIndex
+
+SPECIALTIES = ['Family Medicine', 'Cardiology', 'Dermatology', 'Orthopedics']
+URGENCIES = ['critical', 'urgent', 'routine', 'routine', 'non-urgent']
+
+
+def seed(engine, providers: int, patients: int):
+    rng = random.Random(0)
+    with engine.begin() as conn:
+        conn.execute(insert(Patient), [
+            {'id': i, 'ohip_number': f'{i:010d}AA', 'first_name': 'P',
+             'last_name': str(i), 'date_of_birth': datetime(1980, 1, 1)}
+            for i in range(1, patients + 1)
+        ])
+        conn.execute(insert(Provider), [
+            {'id': i, 'name': f'Dr. {i}', 'license_number': f'L-{i}',
+             'specialty': rng.choice(SPECIALTIES), 'address': f'{i} Main St',
+             'rating': round(rng.uniform(3.5, 5.0), 1),
+             'average_wait_time_days': rng.choice([0.5, 1, 2, 5, 10]),
+             'accepts_new_patients': True}
+            for i in range(1, providers + 1)
+        ])
+        conn.execute(insert(ProviderAvailability), [
+            {'provider_id': p, 'day_of_week': d, 'start_time': '09:00',
+             'end_time': '17:00', 'is_available': True}
+            for p in range(1, providers + 1) for d in range(7)
+        ])
+
+
+def make_requests(count: int, patients: int):
+    rng = random.Random(1)
+    return [
+        {
+            'patient_id': rng.randint(1, patients),
+            'service_type': 'vaccination',
+            'urgency': rng.choice(URGENCIES),
+            'preferences': rng.choice([{}, {'specialty': rng.choice(SPECIALTIES)}])
+        }
+        for _ in range(count)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--requests', type=int, default=10000)
+    parser.add_argument('--providers', type=int, default=500)
+    parser.add_argument('--sequential-sample', type=int, default=500,
+                        help='Requests to time through schedule_appointment')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as scratch:
+        patients = max(1, args.requests // 2)
+        requests = make_requests(args.requests, patients)
+
+        # Bulk path
+        engine = create_engine(f'sqlite:///{os.path.join(scratch, "bulk.db")}')
+        Base.metadata.create_all(engine)
+        seed(engine, args.providers, patients)
+        session = sessionmaker(bind=engine)()
+
+        start = time.perf_counter()
+        results = AppointmentService(session).schedule_appointments(requests)
+        bulk_elapsed = time.perf_counter() - start
+        booked = sum(1 for r in results if r['success'])
+        session.close()
+        engine.dispose()
+
+        print(f"schedule_appointments: {args.requests} requests, {booked} booked "
+              f"in {bulk_elapsed:.2f}s ({args.requests / bulk_elapsed:,.0f} req/s)")
+
+        # One-at-a-time path on a sample, with a warm shared calendar index
+        sample = requests[:args.sequential_sample]
+        engine = create_engine(f'sqlite:///{os.path.join(scratch, "sequential.db")}')
+        Base.metadata.create_all(engine)
+        seed(engine, args.providers, patients)
+        session = sessionmaker(bind=engine)()
+        service = AppointmentService(session, calendar_index=CalendarIndex())
+
+        start = time.perf_counter()
+        for req in sample:
+            service.schedule_appointment(**req)
+        sequential_elapsed = time.perf_counter() - start
+        session.close()
+        engine.dispose()
+
+        rate = len(sample) / sequential_elapsed
+        print(f"schedule_appointment:  {len(sample)} requests in {sequential_elapsed:.2f}s "
+              f"({rate:,.0f} req/s, ~{args.requests / rate:.1f}s for {args.requests})")
+        print(f"speedup: {args.requests / bulk_elapsed / rate:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
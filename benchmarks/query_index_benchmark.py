@@ -0,0 +1,216 @@
+"""
+Benchmark: hot service queries before and after the model indexes
+
+Seeds a scratch database without secondary indexes, prints the query plan
+and timing of each hot query used by the services, applies the index
+migration and repeats.
+
+Usage:
+    python benchmarks/query_index_benchmark.py --appointments 300000
+    python benchmarks/query_index_benchmark.py --database-url postgresql://...
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from sqlalchemy import create_engine, insert, text
+
+from src.database.models import (
+    Base, Patient, Provider, ProviderAvailability, Appointment,
+    Transportation, CareJourney, TriageSession
+)
+from src.database.migrations import apply_migrations
+
+NOW = datetime(2024, 6, 1, 12, 0)
+
+# (name, SQL, parameters) for the predicates the services filter on
+HOT_QUERIES = [
+    (
+        'slot search (AppointmentService)',
+        "SELECT * FROM appointments WHERE provider_id = :provider_id "
+        "AND scheduled_datetime >= :start AND scheduled_datetime <= :end "
+        "AND status IN ('scheduled', 'confirmed')",
+        {'provider_id': 7, 'start': NOW, 'end': NOW + timedelta(days=14)}
+    ),
+    (
+        'missed appointments (CareMonitoringService)',
+        "SELECT * FROM appointments WHERE patient_id = :patient_id "
+        "AND status = 'scheduled' AND scheduled_datetime < :now",
+        {'patient_id': 42, 'now': NOW}
+    ),
+    (
+        'last completed appointment (CareMonitoringService)',
+        "SELECT * FROM appointments WHERE patient_id = :patient_id "
+        "AND status = 'completed' ORDER BY scheduled_datetime DESC LIMIT 1",
+        {'patient_id': 42}
+    ),
+    (
+        'recent appointments (metrics)',
+        "SELECT count(*) FROM appointments WHERE created_at >= :since",
+        {'since': NOW - timedelta(days=1)}
+    ),
+    (
+        'ride lookup (TransportationService)',
+        "SELECT * FROM transportation WHERE ride_id = :ride_id",
+        {'ride_id': 'ride-123'}
+    ),
+    (
+        'active journeys (CareMonitoringService)',
+        "SELECT * FROM care_journeys WHERE patient_id = :patient_id AND status = 'active'",
+        {'patient_id': 42}
+    ),
+    (
+        'provider availability (AppointmentService)',
+        "SELECT * FROM provider_availability WHERE provider_id = :provider_id "
+        "AND is_available = 1",
+        {'provider_id': 7}
+    ),
+    (
+        'triage history',
+        "SELECT * FROM triage_sessions WHERE patient_id = :patient_id",
+        {'patient_id': 42}
+    ),
+]
+
+
+def seed(engine, appointments: int):
+    """Insert synthetic rows in bulk"""
+    rng = random.Random(0)
+    patients = max(1, appointments // 10)
+    providers = max(10, appointments // 1000)
+
+    with engine.begin() as conn:
+        conn.execute(insert(Patient), [
+            {'id': i, 'ohip_number': f'{i:010d}AA', 'first_name': 'P',
+             'last_name': str(i), 'date_of_birth': datetime(1980, 1, 1)}
+            for i in range(1, patients + 1)
+        ])
+        conn.execute(insert(Provider), [
+            {'id': i, 'name': f'Provider {i}', 'license_number': f'L-{i}'}
+            for i in range(1, providers + 1)
+        ])
+        conn.execute(insert(ProviderAvailability), [
+            {'provider_id': p, 'day_of_week': d, 'start_time': '09:00',
+             'end_time': '17:00', 'is_available': True}
+            for p in range(1, providers + 1) for d in range(5)
+        ])
+
+        statuses = ['scheduled', 'confirmed', 'completed', 'cancelled']
+        # One appointment per provider slot, as the slot reservation index requires
+        booked = set()
+        batch = []
+        for i in range(1, appointments + 1):
+            created = NOW - timedelta(minutes=rng.randint(0, 60 * 24 * 365))
+            provider_id = rng.randint(1, providers)
+            scheduled = created + timedelta(hours=rng.randint(1, 24 * 30))
+            while (provider_id, scheduled) in booked:
+                scheduled += timedelta(minutes=30)
+            booked.add((provider_id, scheduled))
+            batch.append({
+                'id': i,
+                'patient_id': rng.randint(1, patients),
+                'provider_id': provider_id,
+                'scheduled_datetime': scheduled,
+                'status': rng.choice(statuses),
+                'created_at': created
+            })
+            if len(batch) == 10000:
+                conn.execute(insert(Appointment), batch)
+                batch = []
+        if batch:
+            conn.execute(insert(Appointment), batch)
+
+        conn.execute(insert(Transportation), [
+            {'appointment_id': i, 'ride_id': f'ride-{i}'}
+            for i in range(1, appointments + 1, 2)
+        ])
+        conn.execute(insert(CareJourney), [
+            {'patient_id': rng.randint(1, patients), 'status': rng.choice(['active', 'completed'])}
+            for _ in range(patients)
+        ])
+        conn.execute(insert(TriageSession), [
+            {'patient_id': rng.randint(1, patients), 'symptoms': ['cough']}
+            for _ in range(patients * 2)
+        ])
+
+
+def explain(conn, sql: str, params: dict) -> str:
+    """Return the database's query plan as a single string"""
+    if conn.dialect.name == 'sqlite':
+        rows = conn.execute(text('EXPLAIN QUERY PLAN ' + sql), params).fetchall()
+        return '; '.join(row[-1] for row in rows)
+    rows = conn.execute(text('EXPLAIN ' + sql), params).fetchall()
+    return '; '.join(row[0].strip() for row in rows)
+
+
+def time_query(conn, sql: str, params: dict, repeat: int) -> float:
+    """Median execution time in milliseconds"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        conn.execute(text(sql), params).fetchall()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return timings[len(timings) // 2]
+
+
+def run(engine, label: str, repeat: int) -> dict:
+    print(f"\n== {label} ==")
+    results = {}
+    with engine.connect() as conn:
+        for name, sql, params in HOT_QUERIES:
+            plan = explain(conn, sql, params)
+            elapsed = time_query(conn, sql, params, repeat)
+            results[name] = elapsed
+            print(f"{name:<50} {elapsed:9.3f} ms  | {plan}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--appointments', type=int, default=200000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--database-url', help='Scratch database (default: temporary SQLite file)')
+    args = parser.parse_args()
+
+    scratch_dir = None
+    database_url = args.database_url
+    if not database_url:
+        scratch_dir = tempfile.TemporaryDirectory()
+        database_url = f'sqlite:///{os.path.join(scratch_dir.name, "bench.db")}'
+
+    engine = create_engine(database_url)
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.drop(engine)
+
+    print(f"Seeding {args.appointments} appointments...")
+    seed(engine, args.appointments)
+
+    before = run(engine, 'before indexes', args.repeat)
+    apply_migrations(engine)
+    with engine.begin() as conn:
+        if conn.dialect.name == 'sqlite':
+            conn.execute(text('ANALYZE'))
+    after = run(engine, 'after indexes', args.repeat)
+
+    print("\n== speedup ==")
+    for name, _, _ in HOT_QUERIES:
+        speedup = before[name] / after[name] if after[name] else float('inf')
+        print(f"{name:<50} {before[name]:9.3f} -> {after[name]:9.3f} ms  ({speedup:.1f}x)")
+
+    engine.dispose()
+    if scratch_dir:
+        scratch_dir.cleanup()
+
+
+if __name__ == '__main__':
+    main()
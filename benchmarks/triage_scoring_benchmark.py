@@ -0,0 +1,70 @@
+"""
+Benchmark: rule-by-rule vs vectorized NumPy triage scoring
+
+Scores one batch of random symptom reports with the 'rules' and 'numpy'
+backends, checks that both return the same scores and prints the
+throughput of the scoring step (assess_many adds response formatting,
+which is the same for both backends).
+
+Usage:
+    python benchmarks/triage_scoring_benchmark.py --requests 100000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.ai.triage_engine import SymptomTriageEngine
+
+
+def make_requests(count: int, seed: int):
+    """Random reports drawn from the engine vocabularies plus unknown text"""
+    rng = random.Random(seed)
+    engine = SymptomTriageEngine()
+    vocabulary = sorted(
+        engine.CRITICAL_SYMPTOMS | engine.URGENT_SYMPTOMS | engine.ROUTINE_SYMPTOMS
+    ) + ['itchy elbow', 'sharp pain in my lower back', 'feeling off']
+    durations = [None, '3 hours', '2 days', 'a week', '3 weeks', '6 months']
+    severities = [None, 'mild', 'moderate', 'severe']
+    return [
+        {
+            'symptoms': rng.sample(vocabulary, rng.randint(1, 4)),
+            'duration': rng.choice(durations),
+            'severity': rng.choice(severities),
+            'patient_age': rng.choice([None, 1, 30, 45, 70, 85])
+        }
+        for _ in range(count)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--requests', type=int, default=100000)
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    requests = make_requests(args.requests, args.seed)
+
+    symptom_lists = [[s.lower().strip() for s in req['symptoms']] for req in requests]
+    durations = [req['duration'] for req in requests]
+    severities = [req['severity'] for req in requests]
+    ages = [req['patient_age'] for req in requests]
+
+    results, timings = {}, {}
+    for backend in ('rules', 'numpy'):
+        engine = SymptomTriageEngine(backend=backend)
+        start = time.perf_counter()
+        results[backend] = engine._score_batch(symptom_lists, durations, severities, ages)
+        elapsed = timings[backend] = time.perf_counter() - start
+        print(f"{backend:<6} {args.requests} scores in {elapsed:.3f}s "
+              f"({args.requests / elapsed:,.0f}/s)")
+
+    assert results['rules'] == results['numpy'], 'backends disagree'
+    print(f"speedup: {timings['rules'] / timings['numpy']:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
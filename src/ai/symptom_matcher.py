@@ -0,0 +1,94 @@
+"""
+Multi-pattern symptom matcher for the triage engine
+
+Builds an Aho-Corasick automaton over the tiered symptom vocabularies so
+each symptom description is classified in a single pass over its text,
+independent of how many phrases the vocabularies contain.
+"""
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Sequence
+
+
+class SymptomMatcher:
+    """
+    Aho-Corasick automaton tagging every phrase with a severity tier
+
+    Tiers are ordered by priority: tier 0 wins over tier 1, which wins over
+    tier 2 and so on. ``match`` returns the highest-priority tier of any
+    phrase occurring as a substring of the text, or None when nothing matches.
+    """
+
+    def __init__(self, tiers: Sequence[Iterable[str]]):
+        # Parallel arrays indexed by automaton state; state 0 is the root
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._tier: List[Optional[int]] = [None]
+
+        for tier, phrases in enumerate(tiers):
+            for phrase in phrases:
+                if phrase:
+                    self._add_phrase(phrase, tier)
+
+        self._build_failure_links()
+
+    def _add_phrase(self, phrase: str, tier: int):
+        """Insert a phrase into the trie, keeping the best tier per state"""
+        state = 0
+        for char in phrase:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._tier.append(None)
+                self._goto[state][char] = next_state
+            state = next_state
+
+        current = self._tier[state]
+        if current is None or tier < current:
+            self._tier[state] = tier
+
+    def _build_failure_links(self):
+        """Compute failure links breadth-first and fold suffix tiers in"""
+        queue = deque(self._goto[0].values())
+
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[next_state] = self._goto[fallback].get(char, 0)
+
+                # A state also matches every phrase that is a suffix of it
+                inherited = self._tier[self._fail[next_state]]
+                own = self._tier[next_state]
+                if inherited is not None and (own is None or inherited < own):
+                    self._tier[next_state] = inherited
+
+    def match(self, text: str) -> Optional[int]:
+        """Return the highest-priority tier matched anywhere in text"""
+        goto = self._goto
+        fail = self._fail
+        tiers = self._tier
+
+        best = None
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+
+            tier = tiers[state]
+            if tier is not None and (best is None or tier < best):
+                best = tier
+                if best == 0:
+                    break
+
+        return best
+
+    def __len__(self) -> int:
+        """Number of automaton states"""
+        return len(self._goto)
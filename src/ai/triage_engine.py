@@ -1,8 +1,11 @@
 """
 AI-powered symptom triage engine for OHIPFORWARD
 """
+import copy
 import re
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Tuple
+
+from src.ai.symptom_matcher import SymptomMatcher
 
 
 class SymptomTriageEngine:
@@ -42,8 +45,41 @@ class SymptomTriageEngine:
         'months': 0.7
     }
     
-    def __init__(self):
-        self.confidence_threshold = 0.75
+    # Available scoring backends
+    BACKENDS = ('rules', 'numpy', 'model')
+    
+    def __init__(self, cache=None, backend: str = 'rules', model=None,
+                 confidence_threshold: float = 0.75):
+        """
+        Args:
+            cache: Optional LRUCache memoizing assessments by normalized input
+            backend: 'rules' for per-patient branching, 'numpy' for
+                vectorized batch scoring with identical results, 'model'
+                for a trained classifier with rule fallback
+            model: LazyTriageModel used by the 'model' backend
+            confidence_threshold: Minimum model confidence before falling
+                back to the rule tiers
+        """
+        if backend not in self.BACKENDS:
+            raise ValueError(f'Unknown triage backend: {backend}')
+        if backend == 'model' and model is None:
+            raise ValueError('The model backend requires a trained model')
+        
+        self.confidence_threshold = confidence_threshold
+        self.cache = cache
+        self.backend = backend
+        self.model = model
+        # Automaton over all vocabularies; tier 0=critical, 1=urgent, 2=routine
+        self._matcher = SymptomMatcher((
+            self.CRITICAL_SYMPTOMS,
+            self.URGENT_SYMPTOMS,
+            self.ROUTINE_SYMPTOMS
+        ))
+        
+        self._vectorized = None
+        if backend == 'numpy':
+            from src.ai.vectorized_scoring import VectorizedTriageScorer
+            self._vectorized = VectorizedTriageScorer(self)
         
     def assess_symptoms(self, symptoms: List[str], duration: str = None, 
                        severity: str = None, patient_age: int = None) -> Dict:
@@ -59,9 +95,132 @@ class SymptomTriageEngine:
         Returns:
             Dictionary with assessment results
         """
+        return self.assess_many([{
+            'symptoms': symptoms,
+            'duration': duration,
+            'severity': severity,
+            'patient_age': patient_age
+        }])[0]
+    
+    def assess_many(self, requests: List[Dict]) -> List[Dict]:
+        """
+        Assess a batch of symptom reports
+        
+        Args:
+            requests: List of dicts with the keyword arguments of
+                assess_symptoms (symptoms, duration, severity, patient_age)
+            
+        Returns:
+            List of assessments in the same order as the requests
+        """
         # Normalize symptoms to lowercase
-        normalized_symptoms = [s.lower().strip() for s in symptoms]
+        normalized = [
+            [s.lower().strip() for s in req['symptoms']] for req in requests
+        ]
+        results = [None] * len(requests)
+        
+        # Serve repeated inputs from the cache when one is configured
+        cache_keys = [None] * len(requests)
+        if self.cache is not None:
+            for i, req in enumerate(requests):
+                cache_keys[i] = self._cache_key(
+                    normalized[i], req.get('duration'), req.get('severity'),
+                    req.get('patient_age')
+                )
+                results[i] = self.cache.get(cache_keys[i])
+        
+        # Score everything the cache could not answer in one backend call
+        pending = [i for i, result in enumerate(results) if result is None]
+        if pending:
+            scores = self._score_batch(
+                [normalized[i] for i in pending],
+                [requests[i].get('duration') for i in pending],
+                [requests[i].get('severity') for i in pending],
+                [requests[i].get('patient_age') for i in pending]
+            )
+            for i, (urgency, confidence) in zip(pending, scores):
+                results[i] = (
+                    urgency,
+                    confidence,
+                    self._get_recommended_action(urgency),
+                    self._get_next_steps(urgency, normalized[i])
+                )
+                if cache_keys[i] is not None:
+                    self.cache.set(cache_keys[i], results[i])
+        
+        assessments = []
+        for req, (urgency, confidence, recommended_action, next_steps) in zip(requests, results):
+            assessments.append({
+                'urgency': urgency,
+                'confidence': confidence,
+                'recommendedAction': recommended_action,
+                'nextSteps': copy.deepcopy(next_steps),
+                'assessment': {
+                    'symptoms': req['symptoms'],
+                    'duration': req.get('duration'),
+                    'severity': req.get('severity')
+                }
+            })
+        
+        return assessments
+    
+    def _score_batch(self, symptom_lists: List[List[str]], durations: List[str],
+                     severities: List[str], ages: List[int]) -> List[Tuple[str, float]]:
+        """Score normalized inputs with the configured backend"""
+        if self._vectorized is not None:
+            urgencies, confidences = self._vectorized.score(
+                symptom_lists, durations, severities, ages
+            )
+            return list(zip(urgencies, confidences))
+        
+        if self.backend == 'model':
+            return self._score_model(symptom_lists, durations, severities, ages)
+        
+        return [
+            self._score_rules(symptoms, duration, severity, age)
+            for symptoms, duration, severity, age
+            in zip(symptom_lists, durations, severities, ages)
+        ]
+    
+    def _score_model(self, symptom_lists: List[List[str]], durations: List[str],
+                     severities: List[str], ages: List[int]) -> List[Tuple[str, float]]:
+        """
+        Score with the trained classifier, falling back to the rule tiers
+        
+        Historical sessions do not record age, so the age adjustment is
+        applied on top of confident model predictions. A symptom the rules
+        mark critical stays critical whatever the model predicts.
+        """
+        from src.ai.triage_model import model_features
+        
+        texts = [
+            model_features(self, symptoms, duration, severity)
+            for symptoms, duration, severity in zip(symptom_lists, durations, severities)
+        ]
+        labels, probabilities = self.model.predict(texts)
+        
+        scores = []
+        for i, (urgency, confidence) in enumerate(zip(labels, probabilities)):
+            if confidence < self.confidence_threshold:
+                scores.append(self._score_rules(
+                    symptom_lists[i], durations[i], severities[i], ages[i]
+                ))
+                continue
+            
+            if urgency != 'critical':
+                rule_urgency, rule_confidence = self._determine_urgency(symptom_lists[i])
+                if rule_urgency == 'critical':
+                    urgency, confidence = rule_urgency, rule_confidence
+            
+            if ages[i]:
+                urgency, confidence = self._adjust_for_age(urgency, confidence, ages[i])
+            scores.append((urgency, confidence))
         
+        return scores
+    
+    def _score_rules(self, normalized_symptoms: List[str], duration: str,
+                     severity: str, patient_age: int) -> Tuple[str, float]:
+        """Run the rule pipeline on normalized symptoms"""
         # Determine base urgency from symptoms
         urgency, confidence = self._determine_urgency(normalized_symptoms)
         
@@ -83,21 +242,23 @@ class SymptomTriageEngine:
                 urgency, confidence, patient_age
             )
         
-        # Generate recommendations
-        recommended_action = self._get_recommended_action(urgency)
-        next_steps = self._get_next_steps(urgency, normalized_symptoms)
-        
-        return {
-            'urgency': urgency,
-            'confidence': confidence,
-            'recommendedAction': recommended_action,
-            'nextSteps': next_steps,
-            'assessment': {
-                'symptoms': symptoms,
-                'duration': duration,
-                'severity': severity
-            }
-        }
+        return urgency, confidence
+    
+    def _cache_key(self, normalized_symptoms: List[str], duration: str,
+                   severity: str, patient_age: int) -> Tuple:
+        """
+        Build the canonical cache key for an assessment
+        
+        Only the parts of the input the rules actually read are kept: symptom
+        order is irrelevant (duplicates still count), duration reduces to its
+        time unit, severity to its level and age to its risk band.
+        """
+        return (
+            tuple(sorted(normalized_symptoms)),
+            self._parse_duration(duration) if duration else None,
+            self._severity_level(severity) if severity else None,
+            self._is_high_risk_age(patient_age) if patient_age else None
+        )
     
     def _determine_urgency(self, symptoms: List[str]) -> Tuple[str, float]:
         """Determine urgency level based on symptoms"""
@@ -106,14 +267,13 @@ class SymptomTriageEngine:
         routine_count = 0
         
         for symptom in symptoms:
-            # Check for critical symptoms
-            if any(critical in symptom for critical in self.CRITICAL_SYMPTOMS):
+            # Single pass over the text; the most severe matching tier wins
+            tier = self._matcher.match(symptom)
+            if tier == 0:
                 critical_count += 1
-            # Check for urgent symptoms
-            elif any(urgent in symptom for urgent in self.URGENT_SYMPTOMS):
+            elif tier == 1:
                 urgent_count += 1
-            # Check for routine symptoms
-            elif any(routine in symptom for routine in self.ROUTINE_SYMPTOMS):
+            elif tier == 2:
                 routine_count += 1
         
         # Determine urgency and confidence
@@ -132,20 +292,14 @@ class SymptomTriageEngine:
     def _adjust_for_duration(self, urgency: str, confidence: float, 
                             duration: str) -> Tuple[str, float]:
         """Adjust urgency based on symptom duration"""
-        duration_lower = duration.lower()
-        
-        # Extract time unit
-        factor = 1.0
-        for unit, unit_factor in self.DURATION_FACTORS.items():
-            if unit in duration_lower:
-                factor = unit_factor
-                break
+        unit, chronic = self._parse_duration(duration)
+        factor = self.DURATION_FACTORS.get(unit, 1.0)
         
         # Adjust confidence
         adjusted_confidence = min(0.99, confidence * factor)
         
         # Very long-standing symptoms might need escalation
-        if 'month' in duration_lower or 'months' in duration_lower:
+        if chronic:
             if urgency == 'routine':
                 # Chronic symptoms warrant at least urgent care
                 urgency = 'urgent'
@@ -153,30 +307,54 @@ class SymptomTriageEngine:
         
         return urgency, adjusted_confidence
     
+    def _parse_duration(self, duration: str) -> Tuple[Optional[str], bool]:
+        """Extract the time unit and whether symptoms are chronic (months)"""
+        duration_lower = duration.lower()
+        
+        # First matching unit in DURATION_FACTORS order wins
+        matched_unit = None
+        for unit in self.DURATION_FACTORS:
+            if unit in duration_lower:
+                matched_unit = unit
+                break
+        
+        return matched_unit, 'month' in duration_lower
+    
     def _adjust_for_severity(self, urgency: str, confidence: float,
                             severity: str) -> Tuple[str, float]:
         """Adjust urgency based on patient-reported severity"""
-        severity_lower = severity.lower()
+        level = self._severity_level(severity)
         
-        if 'severe' in severity_lower or 'unbearable' in severity_lower:
+        if level == 'severe':
             if urgency == 'routine':
                 urgency = 'urgent'
             elif urgency == 'urgent':
                 urgency = 'critical'
             confidence = min(0.95, confidence + 0.10)
-        elif 'moderate' in severity_lower:
+        elif level == 'moderate':
             confidence = min(0.90, confidence + 0.05)
-        elif 'mild' in severity_lower:
+        elif level == 'mild':
             if urgency == 'urgent':
                 confidence *= 0.90
         
         return urgency, confidence
     
+    def _severity_level(self, severity: str) -> Optional[str]:
+        """Map patient-reported severity text to severe, moderate or mild"""
+        severity_lower = severity.lower()
+        
+        if 'severe' in severity_lower or 'unbearable' in severity_lower:
+            return 'severe'
+        elif 'moderate' in severity_lower:
+            return 'moderate'
+        elif 'mild' in severity_lower:
+            return 'mild'
+        return None
+    
     def _adjust_for_age(self, urgency: str, confidence: float,
                        age: int) -> Tuple[str, float]:
         """Adjust urgency based on patient age"""
-        # Elderly (65+) or very young (< 2) may need higher urgency
-        if age >= 65 or age < 2:
+        if self._is_high_risk_age(age):
             if urgency == 'routine':
                 urgency = 'urgent'
                 confidence = min(0.85, confidence)
@@ -185,6 +363,10 @@ class SymptomTriageEngine:
         
         return urgency, confidence
     
+    def _is_high_risk_age(self, age: int) -> bool:
+        """Elderly (65+) or very young (< 2) may need higher urgency"""
+        return age >= 65 or age < 2
+    
     def _get_recommended_action(self, urgency: str) -> str:
         """Get recommended action based on urgency level"""
         actions = {
@@ -0,0 +1,169 @@
+"""
+Trained triage classifier for OHIPFORWARD
+
+A TF-IDF + logistic regression model trained offline from historical
+TriageSession rows. Models are serialized with joblib and loaded lazily
+(memory-mapped) on first prediction so API workers do not pay the load cost
+at import time.
+
+Usage:
+    python -m src.ai.triage_model --output models/symptom_triage/triage_model.joblib
+"""
+import argparse
+import os
+import sys
+import threading
+from typing import List, Optional, Sequence, Tuple
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+MODEL_FILENAME = 'triage_model.joblib'
+
+
+def model_features(engine, normalized_symptoms: Sequence[str],
+                   duration: Optional[str], severity: Optional[str]) -> str:
+    """
+    Build the model input text from canonical triage inputs
+
+    Uses the same canonical form as the engine's cache key (sorted symptoms,
+    duration unit, severity level) so cached and model results agree.
+    """
+    tokens = [' ; '.join(sorted(normalized_symptoms))]
+
+    if duration:
+        unit, chronic = engine._parse_duration(duration)
+        tokens.append(f'duration_{unit or "unknown"}')
+        if chronic:
+            tokens.append('duration_chronic')
+
+    if severity:
+        tokens.append(f'severity_{engine._severity_level(severity) or "unknown"}')
+
+    return ' '.join(tokens)
+
+
+def load_training_data(db_session, engine) -> Tuple[List[str], List[str]]:
+    """Read labelled (features, urgency) pairs from TriageSession rows"""
+    from src.database.models import TriageSession
+
+    rows = db_session.query(
+        TriageSession.symptoms,
+        TriageSession.duration,
+        TriageSession.severity,
+        TriageSession.urgency_level
+    ).filter(
+        TriageSession.urgency_level.isnot(None)
+    ).yield_per(1000)
+
+    texts = []
+    labels = []
+    for symptoms, duration, severity, urgency in rows:
+        normalized = [s.lower().strip() for s in symptoms or []]
+        texts.append(model_features(engine, normalized, duration, severity))
+        labels.append(urgency)
+
+    return texts, labels
+
+
+def train_triage_model(texts: List[str], labels: List[str]):
+    """Fit a TF-IDF + logistic regression pipeline"""
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.pipeline import Pipeline
+
+    model = Pipeline([
+        ('tfidf', TfidfVectorizer(ngram_range=(1, 2), token_pattern=r'[a-z_]+')),
+        ('classifier', LogisticRegression(max_iter=1000))
+    ])
+    model.fit(texts, labels)
+    return model
+
+
+def save_triage_model(model, path: str):
+    """Serialize a model uncompressed so it can be memory-mapped on load"""
+    import joblib
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    joblib.dump(model, path)
+
+
+class LazyTriageModel:
+    """
+    Triage classifier loaded from disk on first use
+    """
+
+    def __init__(self, path: str, mmap_mode: Optional[str] = 'r'):
+        self.path = path
+        self.mmap_mode = mmap_mode
+        self._model = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self._model is not None
+
+    def _get_model(self):
+        """Load the model once, even with concurrent first requests"""
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    import joblib
+                    self._model = joblib.load(self.path, mmap_mode=self.mmap_mode)
+        return self._model
+
+    def predict(self, texts: List[str]) -> Tuple[List[str], List[float]]:
+        """
+        Predict urgency labels
+
+        Returns:
+            Tuple of (labels, probability of each predicted label)
+        """
+        model = self._get_model()
+        probabilities = model.predict_proba(texts)
+        best = probabilities.argmax(axis=1)
+        labels = model.classes_[best].tolist()
+        confidences = probabilities[range(len(texts)), best].tolist()
+        return labels, confidences
+
+
+def main():
+    """Train a triage model from the TriageSession table"""
+    from dotenv import load_dotenv
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+
+    from src.ai.triage_engine import SymptomTriageEngine
+
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description='Train the triage classifier')
+    parser.add_argument(
+        '--database-url',
+        default=os.getenv('DATABASE_URL', 'sqlite:///ohipforward.db')
+    )
+    parser.add_argument(
+        '--output',
+        default=os.path.join(os.getenv('AI_MODEL_PATH', 'models/symptom_triage'), MODEL_FILENAME)
+    )
+    args = parser.parse_args()
+
+    Session = sessionmaker(bind=create_engine(args.database_url))
+    session = Session()
+    texts, labels = load_training_data(session, SymptomTriageEngine())
+    session.close()
+
+    if len(set(labels)) < 2:
+        print("Need triage sessions with at least two urgency levels to train.")
+        sys.exit(1)
+
+    print(f"Training on {len(texts)} triage sessions...")
+    model = train_triage_model(texts, labels)
+    save_triage_model(model, args.output)
+    print(f"Model saved to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
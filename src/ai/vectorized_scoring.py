@@ -0,0 +1,192 @@
+"""
+Vectorized NumPy scoring backend for the symptom triage engine
+
+Scores a batch of N patients with array operations that mirror the rule
+pipeline in SymptomTriageEngine step for step, so urgency and confidence
+values are identical to the rule path.
+
+Text inputs (symptoms, durations, severities) and ages are reduced to their
+distinct values with np.unique; the engine's matcher and parsers run once per
+distinct value and the results are broadcast back through the inverse index,
+so Python-level work grows with the vocabulary seen, not the batch size.
+"""
+from itertools import chain
+from typing import Callable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+# Urgency codes; lower is more urgent, matching the symptom matcher tiers
+CRITICAL, URGENT, ROUTINE = 0, 1, 2
+URGENCY_LEVELS = np.array(['critical', 'urgent', 'routine'])
+
+# Severity codes produced from SymptomTriageEngine._severity_level
+NO_SEVERITY, SEVERE, MODERATE, MILD = 0, 1, 2, 3
+SEVERITY_CODES = {None: NO_SEVERITY, 'severe': SEVERE, 'moderate': MODERATE, 'mild': MILD}
+
+
+def _per_distinct(values: np.ndarray, fn: Callable, dtype) -> np.ndarray:
+    """Evaluate fn once per distinct value and map the results back to every row"""
+    distinct, inverse = np.unique(values, return_inverse=True)
+    results = np.array([fn(value) for value in distinct.tolist()], dtype=dtype)
+    return results[inverse.reshape(-1)]
+
+
+def _text_array(values: Sequence[Optional[str]]) -> np.ndarray:
+    """Strings as a NumPy string array, with None as the empty string"""
+    array = np.asarray(values, dtype=object)
+    array[np.equal(array, None)] = ''
+    return array.astype(str)
+
+
+class VectorizedTriageScorer:
+    """
+    Batch triage scorer operating on arrays instead of per-patient branching
+    """
+
+    def __init__(self, engine):
+        """
+        Args:
+            engine: SymptomTriageEngine providing vocabularies and parsers
+        """
+        self.engine = engine
+
+        # Index 0 is "no recognised unit" with a neutral factor
+        units = list(engine.DURATION_FACTORS)
+        self._unit_index = {unit: i + 1 for i, unit in enumerate(units)}
+        self._duration_factors = np.array(
+            [1.0] + [engine.DURATION_FACTORS[unit] for unit in units]
+        )
+
+    def score(self, symptom_lists: Sequence[List[str]],
+              durations: Sequence[Optional[str]],
+              severities: Sequence[Optional[str]],
+              ages: Sequence[Optional[int]]) -> Tuple[List[str], List[float]]:
+        """
+        Score a batch of normalized symptom lists
+
+        Args:
+            symptom_lists: Normalized (lower-cased, stripped) symptoms per patient
+            durations: Duration text per patient (or None)
+            severities: Reported severity per patient (or None)
+            ages: Patient age per patient (or None)
+
+        Returns:
+            Tuple of (urgency levels, confidences) in input order
+        """
+        counts = self._tier_counts(symptom_lists)
+        urgency, confidence = self._base_urgency(counts)
+        urgency, confidence = self._apply_duration(urgency, confidence, durations)
+        urgency, confidence = self._apply_severity(urgency, confidence, severities)
+        urgency, confidence = self._apply_age(urgency, confidence, ages)
+
+        return URGENCY_LEVELS[urgency].tolist(), confidence.tolist()
+
+    def _tier_counts(self, symptom_lists: Sequence[List[str]]) -> np.ndarray:
+        """Build an N x 3 matrix of critical/urgent/routine symptom counts"""
+        n = len(symptom_lists)
+        lengths = np.fromiter(map(len, symptom_lists), dtype=np.int64, count=n)
+        rows = np.repeat(np.arange(n, dtype=np.int64), lengths)
+        symptoms = _text_array(list(chain.from_iterable(symptom_lists)))
+
+        # One matcher pass per distinct symptom; -1 marks no match
+        def tier(symptom):
+            matched = self.engine._matcher.match(symptom)
+            return -1 if matched is None else matched
+
+        tiers = _per_distinct(symptoms, tier, np.int64)
+
+        matched = tiers >= 0
+        counts = np.bincount(rows[matched] * 3 + tiers[matched], minlength=n * 3)
+        return counts.reshape(n, 3)
+
+    def _base_urgency(self, counts: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Vectorized SymptomTriageEngine._determine_urgency"""
+        critical = counts[:, CRITICAL] > 0
+        urgent = ~critical & (counts[:, URGENT] > 0)
+        routine = ~critical & ~urgent
+
+        urgency = np.where(critical, CRITICAL, np.where(urgent, URGENT, ROUTINE))
+        confidence = np.select(
+            [critical, urgent, routine & (counts[:, ROUTINE] > 0)],
+            [
+                0.95,
+                np.minimum(0.90, 0.70 + counts[:, URGENT] * 0.10),
+                np.minimum(0.85, 0.65 + counts[:, ROUTINE] * 0.10)
+            ],
+            default=0.60
+        )
+        return urgency, confidence
+
+    def _apply_duration(self, urgency: np.ndarray, confidence: np.ndarray,
+                        durations: Sequence[Optional[str]]) -> Tuple[np.ndarray, np.ndarray]:
+        """Vectorized SymptomTriageEngine._adjust_for_duration"""
+        texts = _text_array(durations)
+        # Empty and missing durations skip the adjustment, as in the rule path
+        present = texts != ''
+
+        def parse(duration):
+            unit, is_chronic = self.engine._parse_duration(duration)
+            return self._unit_index.get(unit, 0), is_chronic
+
+        parsed = _per_distinct(texts, parse, np.int64).reshape(-1, 2)
+        unit_index = parsed[:, 0]
+        chronic = parsed[:, 1].astype(bool)
+
+        adjusted = np.minimum(0.99, confidence * self._duration_factors[unit_index])
+        confidence = np.where(present, adjusted, confidence)
+
+        # Chronic symptoms warrant at least urgent care
+        escalate = present & chronic & (urgency == ROUTINE)
+        urgency = np.where(escalate, URGENT, urgency)
+        confidence = np.where(escalate, 0.75, confidence)
+        return urgency, confidence
+
+    def _apply_severity(self, urgency: np.ndarray, confidence: np.ndarray,
+                        severities: Sequence[Optional[str]]) -> Tuple[np.ndarray, np.ndarray]:
+        """Vectorized SymptomTriageEngine._adjust_for_severity"""
+        level = _per_distinct(
+            _text_array(severities),
+            lambda severity: SEVERITY_CODES[self.engine._severity_level(severity)] if severity else NO_SEVERITY,
+            np.int64
+        )
+
+        severe = level == SEVERE
+        moderate = level == MODERATE
+        mild_urgent = (level == MILD) & (urgency == URGENT)
+
+        confidence = np.select(
+            [severe, moderate, mild_urgent],
+            [
+                np.minimum(0.95, confidence + 0.10),
+                np.minimum(0.90, confidence + 0.05),
+                confidence * 0.90
+            ],
+            default=confidence
+        )
+        # Severe reports escalate routine -> urgent and urgent -> critical
+        urgency = np.where(severe & (urgency > CRITICAL), urgency - 1, urgency)
+        return urgency, confidence
+
+    def _apply_age(self, urgency: np.ndarray, confidence: np.ndarray,
+                   ages: Sequence[Optional[int]]) -> Tuple[np.ndarray, np.ndarray]:
+        """Vectorized SymptomTriageEngine._adjust_for_age"""
+        # Missing or zero ages skip the adjustment, as in the rule path
+        values = np.asarray(ages, dtype=object)
+        values[np.equal(values, None)] = 0
+        high_risk = _per_distinct(
+            values.astype(np.float64),
+            lambda age: bool(age) and self.engine._is_high_risk_age(age),
+            bool
+        )
+
+        routine = high_risk & (urgency == ROUTINE)
+        other = high_risk & (urgency != ROUTINE)
+
+        confidence = np.select(
+            [routine, other],
+            [np.minimum(0.85, confidence), np.minimum(0.95, confidence + 0.05)],
+            default=confidence
+        )
+        urgency = np.where(routine, URGENT, urgency)
+        return urgency, confidence
@@ -0,0 +1,164 @@
+"""
+In-process caching utilities for OHIPFORWARD
+"""
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+
+class LRUCache:
+    """
+    Thread-safe bounded LRU cache with optional per-entry time-to-live
+
+    Entries beyond ``maxsize`` evict the least recently used key. Expired
+    entries are dropped lazily when they are next read.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None):
+        if maxsize <= 0:
+            raise ValueError('maxsize must be positive')
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Return the cached value for key, or default on a miss"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at is None or expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key: Hashable, value: Any):
+        """Store a value, evicting the least recently used entry if full"""
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key: Hashable):
+        """Remove a key if present"""
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """Remove all entries"""
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict:
+        """Return size and hit/miss counters"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class RedisCache:
+    """
+    Cache shared between processes, stored in Redis
+
+    Has the same interface as LRUCache, for string keys and JSON-serializable
+    values. Size and eviction are left to the Redis server's maxmemory
+    policy. Errors reaching Redis are counted and treated as misses, so an
+    outage degrades to uncached reads.
+    """
+
+    def __init__(self, client, prefix: str = 'ohipforward:', ttl: Optional[float] = None):
+        """
+        Args:
+            client: redis.Redis client (or any object with get/set/delete/scan_iter)
+            prefix: Namespace prepended to every key
+            ttl: Seconds before entries expire (None keeps them until evicted)
+        """
+        self.client = client
+        self.prefix = prefix
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_url(cls, url: str, **kwargs) -> 'RedisCache':
+        """Connect to Redis at url (requires the redis package)"""
+        import redis
+
+        return cls(redis.Redis.from_url(url), **kwargs)
+
+    def _count(self, counter: str):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """Return the cached value for key, or default on a miss"""
+        try:
+            raw = self.client.get(self.prefix + key)
+        except Exception:
+            self._count('errors')
+            raw = None
+
+        if raw is None:
+            self._count('misses')
+            return default
+        self._count('hits')
+        return json.loads(raw)
+
+    def set(self, key: str, value: Any):
+        """Store a value with the configured time-to-live"""
+        try:
+            self.client.set(self.prefix + key, json.dumps(value),
+                            ex=int(max(1, self.ttl)) if self.ttl else None)
+        except Exception:
+            self._count('errors')
+
+    def delete(self, key: str):
+        """Remove a key if present"""
+        try:
+            self.client.delete(self.prefix + key)
+        except Exception:
+            self._count('errors')
+
+    def clear(self):
+        """Remove all entries under the prefix"""
+        try:
+            for key in self.client.scan_iter(match=self.prefix + '*'):
+                self.client.delete(key)
+        except Exception:
+            self._count('errors')
+
+    def stats(self) -> Dict:
+        """Return hit/miss counters for this process"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'backend': 'redis',
+                'hits': self.hits,
+                'misses': self.misses,
+                'errors': self.errors,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0
+            }
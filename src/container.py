@@ -0,0 +1,192 @@
+"""
+Application service container
+
+Built once per process at startup: reads the configuration from the
+environment, creates the per-process caches, indexes, outbound HTTP
+clients and ride dispatcher, and the service objects the API routes share.
+Services are bound to the scoped_session registry rather than a session,
+so every call runs on the session of the current request (thread).
+"""
+import os
+from typing import Mapping
+
+from sqlalchemy.orm import scoped_session
+
+from src.ai.triage_engine import SymptomTriageEngine
+from src.ai.triage_model import LazyTriageModel, MODEL_FILENAME
+from src.cache import LRUCache, RedisCache
+from src.database.events import track_provider_changes
+from src.services.appointment_service import AppointmentService
+from src.services.care_monitoring_service import CareMonitoringService
+from src.services.http_client import close_http_clients, get_http_client
+from src.services.provider_cache import ProviderCache
+from src.services.provider_calendar import CalendarIndex
+from src.services.provider_geo_index import ProviderGeoIndex
+from src.services.provider_service import ProviderService
+from src.services.ride_dispatcher import RideDispatcher
+from src.services.transportation_service import TransportationService
+from src.services.uber_health_client import UberHealthClient
+
+
+class AppConfig:
+    """Settings read from the environment once at startup"""
+
+    def __init__(self, environ: Mapping[str, str] = None):
+        env = os.environ if environ is None else environ
+
+        self.secret_key = env.get('SECRET_KEY', 'dev-secret-key')
+        # Pool tuning via DB_POOL_* is read by create_db_engine
+        self.database_url = env.get('DATABASE_URL', 'sqlite:///ohipforward.db')
+
+        # TRIAGE_CACHE_SIZE=0 disables memoization
+        self.triage_cache_size = int(env.get('TRIAGE_CACHE_SIZE', 10000))
+        self.triage_cache_ttl = float(env.get('TRIAGE_CACHE_TTL_SECONDS', 3600))
+        self.triage_backend = env.get('TRIAGE_BACKEND', 'rules')
+        self.triage_model_path = os.path.join(env.get('AI_MODEL_PATH', 'models/symptom_triage'),
+                                              MODEL_FILENAME)
+        self.confidence_threshold = float(env.get('CONFIDENCE_THRESHOLD', 0.75))
+
+        self.max_triage_batch_size = int(env.get('MAX_TRIAGE_BATCH_SIZE', 1000))
+        self.max_appointment_batch_size = int(env.get('MAX_APPOINTMENT_BATCH_SIZE', 10000))
+        self.max_transportation_batch_size = int(env.get('MAX_TRANSPORTATION_BATCH_SIZE', 1000))
+        self.max_ride_event_batch_size = int(env.get('MAX_RIDE_EVENT_BATCH_SIZE', 1000))
+
+        # Metrics are served from snapshots; older ones are rolled up on request
+        self.metrics_snapshot_max_age = float(env.get('METRICS_SNAPSHOT_MAX_AGE_SECONDS', 300))
+
+        # CACHE_REDIS_URL shares the provider cache between processes,
+        # PROVIDER_CACHE_SIZE=0 disables it
+        self.provider_cache_size = int(env.get('PROVIDER_CACHE_SIZE', 10000))
+        self.provider_cache_ttl = float(env.get('PROVIDER_CACHE_TTL_SECONDS', 300))
+        self.cache_redis_url = env.get('CACHE_REDIS_URL')
+
+        self.http_pool_size = int(env.get('HTTP_POOL_SIZE', 10))
+        self.http_max_concurrency_per_host = int(env.get('HTTP_MAX_CONCURRENCY_PER_HOST', 10))
+        self.http_circuit_failure_threshold = int(env.get('HTTP_CIRCUIT_FAILURE_THRESHOLD', 5))
+        self.http_circuit_reset_seconds = float(env.get('HTTP_CIRCUIT_RESET_SECONDS', 30))
+
+        # Background ride booking against UBER_HEALTH_API_URL; without it
+        # (or with ENABLE_UBER_HEALTH=false) rides are booked within the request
+        self.uber_health_enabled = env.get('ENABLE_UBER_HEALTH', 'true').lower() == 'true'
+        self.uber_health_api_url = env.get('UBER_HEALTH_API_URL')
+        self.uber_health_api_key = env.get('UBER_HEALTH_API_KEY')
+        self.ride_booking_timeout = float(env.get('RIDE_BOOKING_TIMEOUT_SECONDS', 10))
+        self.ride_booking_workers = int(env.get('RIDE_BOOKING_WORKERS', 4))
+        self.ride_booking_max_attempts = int(env.get('RIDE_BOOKING_MAX_ATTEMPTS', 3))
+        self.ride_booking_backoff = float(env.get('RIDE_BOOKING_BACKOFF_SECONDS', 0.5))
+        # Rides pending this long are re-queued, e.g. after a restart
+        self.ride_booking_recovery_grace = float(env.get('RIDE_BOOKING_RECOVERY_GRACE_SECONDS', 300))
+        self.ride_booking_recovery_interval = float(env.get('RIDE_BOOKING_RECOVERY_INTERVAL_SECONDS', 60))
+
+        # Provider status webhooks must carry a valid X-Uber-Signature (hex
+        # HMAC-SHA256 of the body); without a secret the webhook is closed
+        self.uber_health_webhook_secret = env.get('UBER_HEALTH_WEBHOOK_SECRET')
+
+
+class ServiceContainer:
+    """
+    Shared services and per-process state of the API
+
+    Args:
+        config: Application settings
+        session: Scoped session registry; services resolve it to the
+            current request's session on each call
+    """
+
+    def __init__(self, config: AppConfig, session: scoped_session):
+        self.config = config
+        self.session = session
+
+        triage_backend = config.triage_backend
+        if triage_backend == 'model' and not os.path.exists(config.triage_model_path):
+            print(f"Triage model not found at {config.triage_model_path}, using rule backend")
+            triage_backend = 'rules'
+
+        # The model is only read from disk on the first assessment
+        self.triage_engine = SymptomTriageEngine(
+            cache=(LRUCache(config.triage_cache_size, config.triage_cache_ttl)
+                   if config.triage_cache_size > 0 else None),
+            backend=triage_backend,
+            model=LazyTriageModel(config.triage_model_path) if triage_backend == 'model' else None,
+            confidence_threshold=config.confidence_threshold
+        )
+
+        # Provider calendars and locations shared by all requests
+        self.calendar_index = CalendarIndex()
+        self.geo_index = ProviderGeoIndex()
+
+        # Provider changes committed by other processes sharing the cache
+        # show up as a new generation; the location index then resyncs
+        if config.cache_redis_url:
+            self.provider_cache = ProviderCache(
+                RedisCache.from_url(config.cache_redis_url, ttl=config.provider_cache_ttl),
+                on_new_generation=self.expire_indexes)
+        elif config.provider_cache_size > 0:
+            self.provider_cache = ProviderCache(
+                LRUCache(config.provider_cache_size, config.provider_cache_ttl),
+                on_new_generation=self.expire_indexes)
+        else:
+            self.provider_cache = ProviderCache()
+
+        # Outbound calls share one pooled client per integration
+        self.uber_health_http = get_http_client(
+            'uber_health',
+            pool_size=config.http_pool_size,
+            max_concurrency=config.http_max_concurrency_per_host,
+            failure_threshold=config.http_circuit_failure_threshold,
+            reset_timeout=config.http_circuit_reset_seconds
+        )
+
+        if config.uber_health_api_url and config.uber_health_enabled:
+            self.ride_dispatcher = RideDispatcher(
+                session.session_factory,
+                UberHealthClient(
+                    config.uber_health_api_url,
+                    api_key=config.uber_health_api_key,
+                    timeout=config.ride_booking_timeout,
+                    session=self.uber_health_http
+                ),
+                max_workers=config.ride_booking_workers,
+                max_attempts=config.ride_booking_max_attempts,
+                backoff_seconds=config.ride_booking_backoff
+            )
+            self.ride_dispatcher.start_recovery(
+                interval_seconds=config.ride_booking_recovery_interval,
+                grace_seconds=config.ride_booking_recovery_grace
+            )
+        else:
+            self.ride_dispatcher = None
+
+        self.appointments = AppointmentService(
+            session, calendar_index=self.calendar_index, geo_index=self.geo_index)
+        self.providers = ProviderService(
+            session, geo_index=self.geo_index)
+        self.transportation = TransportationService(
+            session, dispatcher=self.ride_dispatcher,
+            enabled=config.uber_health_enabled, api_key=config.uber_health_api_key)
+        self.care = CareMonitoringService(session)
+
+        track_provider_changes(session.session_factory, self.on_providers_changed,
+                               on_deleted=self.on_providers_deleted)
+
+    def on_providers_changed(self, provider_ids):
+        """Drop cached state for providers changed by a committed transaction"""
+        self.provider_cache.invalidate(provider_ids)
+        for provider_id in provider_ids:
+            self.calendar_index.invalidate(provider_id)
+        self.expire_indexes()
+
+    def on_providers_deleted(self, provider_ids):
+        """Drop providers deleted by a committed transaction from the location index"""
+        for provider_id in provider_ids:
+            self.geo_index.remove(provider_id)
+
+    def expire_indexes(self):
+        """Make the provider location index resync on next use"""
+        self.geo_index.expire()
+
+    def shutdown(self):
+        """Finish background bookings and close outbound connections"""
+        if self.ride_dispatcher is not None:
+            self.ride_dispatcher.shutdown()
+        close_http_clients()
@@ -0,0 +1,76 @@
+"""
+Session event hooks for keeping in-process caches consistent
+
+Changes made through the ORM are collected on flush and reported once the
+transaction commits, so caches never drop entries for work that is rolled
+back. Bulk UPDATE/DELETE statements bypass the ORM unit of work and must
+invalidate explicitly.
+"""
+from itertools import chain
+from typing import Callable, Optional, Set
+
+from sqlalchemy import event, inspect
+
+from src.database.models import Provider, ProviderAvailability
+
+_PENDING_KEY = 'changed_provider_ids'
+_DELETED_KEY = 'deleted_provider_ids'
+
+
+def _changed_provider_ids(session) -> Set[int]:
+    """Providers touched by the objects in the current flush"""
+    changed = set()
+    for obj in chain(session.new, session.dirty, session.deleted):
+        if isinstance(obj, Provider):
+            if obj.id is not None:
+                changed.add(obj.id)
+        elif isinstance(obj, ProviderAvailability):
+            # Include the previous provider when a slot is reassigned
+            history = inspect(obj).attrs.provider_id.history
+            changed.update(pid for pid in chain(history.added, history.unchanged, history.deleted)
+                           if pid is not None)
+    return changed
+
+
+def _deleted_provider_ids(session) -> Set[int]:
+    """Providers whose rows the current flush deleted"""
+    return {obj.id for obj in session.deleted
+            if isinstance(obj, Provider) and obj.id is not None}
+
+
+def track_provider_changes(session_factory, callback: Callable[[Set[int]], None],
+                           on_deleted: Optional[Callable[[Set[int]], None]] = None):
+    """
+    Call callback(provider_ids) after each commit that changed providers
+
+    A provider counts as changed when its row or any of its availability
+    rows was inserted, updated or deleted.
+
+    Args:
+        session_factory: sessionmaker (or Session class) to listen on
+        callback: Receives the set of changed provider IDs
+        on_deleted: Receives the IDs of deleted providers first, so
+            in-process indexes can drop them without rescanning the table
+    """
+    @event.listens_for(session_factory, 'after_flush')
+    def collect(session, flush_context):
+        changed = _changed_provider_ids(session)
+        if changed:
+            session.info.setdefault(_PENDING_KEY, set()).update(changed)
+        deleted = _deleted_provider_ids(session)
+        if deleted:
+            session.info.setdefault(_DELETED_KEY, set()).update(deleted)
+
+    @event.listens_for(session_factory, 'after_commit')
+    def publish(session):
+        changed = session.info.pop(_PENDING_KEY, None)
+        deleted = session.info.pop(_DELETED_KEY, None)
+        if deleted and on_deleted is not None:
+            on_deleted(deleted)
+        if changed:
+            callback(changed)
+
+    @event.listens_for(session_factory, 'after_rollback')
+    def discard(session):
+        session.info.pop(_PENDING_KEY, None)
+        session.info.pop(_DELETED_KEY, None)
@@ -1,13 +1,14 @@
 import os
 import sys
 from datetime import datetime, timedelta
-from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 
 # Add parent directory to path
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
 
-from src.database.models import Base, Patient, Provider, ProviderAvailability, SystemMetrics
+from src.database.models import Patient, Provider, ProviderAvailability, SystemMetrics
+from src.database.session import create_db_engine
+from src.database.migrations import apply_migrations
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -16,10 +17,10 @@ load_dotenv()
 def init_database():
     """Initialize the database and create all tables"""
     database_url = os.getenv('DATABASE_URL', 'sqlite:///ohipforward.db')
-    engine = create_engine(database_url)
+    engine = create_db_engine(database_url)
     
     print("Creating database tables...")
-    Base.metadata.create_all(engine)
+    apply_migrations(engine)
     print("Database tables created successfully!")
     
     # Create session for seeding data
@@ -0,0 +1,249 @@
+"""
+Schema migrations for existing OHIPFORWARD databases
+
+Creates any tables, columns and indexes declared in models.py that are
+missing from the target database, plus the provider text search indexes,
+and backfills derived tables. Each
+backfill is recorded in schema_backfills once it completes, so one that
+was interrupted, or skipped by an earlier failed run, runs again next
+time. Safe to run repeatedly.
+
+Databases booked before the slot reservation index may hold double
+bookings the index forbids; the migration then stops before changing
+anything and lists them. Resolve them by hand, or cancel all but the
+earliest booking of each slot with --cancel-duplicate-slots.
+
+Usage:
+    python -m src.database.migrations
+    python -m src.database.migrations --cancel-duplicate-slots
+"""
+import argparse
+import os
+import sys
+from datetime import datetime
+from typing import Callable, List, Set, Tuple
+
+# Add parent directory to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+from sqlalchemy import func, inspect, text, update
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from src.database.models import Appointment, Base, SchemaBackfill
+from src.database.session import create_db_engine
+from src.database.text_search import create_text_search
+from dotenv import load_dotenv
+
+load_dotenv()
+
+SLOT_INDEX = 'uq_appointments_provider_slot_active'
+ACTIVE_STATUSES = ('scheduled', 'confirmed')
+
+
+class DuplicateSlotError(Exception):
+    """Active appointments share a provider slot, so the slot index cannot be created"""
+
+    def __init__(self, duplicates: List[Tuple[int, datetime, List[int]]]):
+        self.duplicates = duplicates
+        lines = [
+            f'  provider {provider_id} at {scheduled:%Y-%m-%d %H:%M}: appointments '
+            + ', '.join(str(appointment_id) for appointment_id in appointment_ids)
+            for provider_id, scheduled, appointment_ids in duplicates
+        ]
+        super().__init__(
+            f'{len(duplicates)} slot(s) are booked more than once; resolve them or re-run '
+            f'with --cancel-duplicate-slots before creating {SLOT_INDEX}:\n' + '\n'.join(lines)
+        )
+
+
+def find_duplicate_slots(engine: Engine) -> List[Tuple[int, datetime, List[int]]]:
+    """
+    Active appointments booked into the same provider slot
+
+    Returns:
+        (provider_id, scheduled_datetime, appointment IDs in booking order)
+        for every slot with more than one active appointment
+    """
+    session = Session(bind=engine)
+    try:
+        slots = session.query(Appointment.provider_id, Appointment.scheduled_datetime).filter(
+            Appointment.status.in_(ACTIVE_STATUSES)
+        ).group_by(
+            Appointment.provider_id, Appointment.scheduled_datetime
+        ).having(func.count(Appointment.id) > 1).order_by(
+            Appointment.provider_id, Appointment.scheduled_datetime
+        ).all()
+
+        duplicates = []
+        for provider_id, scheduled in slots:
+            appointment_ids = [appointment_id for (appointment_id,) in session.query(Appointment.id).filter(
+                Appointment.provider_id == provider_id,
+                Appointment.scheduled_datetime == scheduled,
+                Appointment.status.in_(ACTIVE_STATUSES)
+            ).order_by(Appointment.id)]
+            duplicates.append((provider_id, scheduled, appointment_ids))
+        return duplicates
+    finally:
+        session.close()
+
+
+def cancel_duplicate_slots(engine: Engine) -> List[int]:
+    """
+    Cancel all but the earliest booking of each double-booked slot
+
+    Returns:
+        IDs of the cancelled appointments
+    """
+    from src.services.appointment_stats import record_appointment_stats
+
+    cancelled = [
+        appointment_id
+        for _, _, appointment_ids in find_duplicate_slots(engine)
+        for appointment_id in appointment_ids[1:]
+    ]
+    if not cancelled:
+        return []
+
+    session = Session(bind=engine)
+    try:
+        # Keep the running counters (if already built) in step with the rows
+        count_stats = 'appointment_daily_stats' in inspect(engine).get_table_names()
+        rows = session.query(Appointment.id, Appointment.created_at).filter(
+            Appointment.id.in_(cancelled)
+        ).all()
+        session.execute(
+            update(Appointment).where(Appointment.id.in_(cancelled)).values(
+                status='cancelled', updated_at=datetime.utcnow()
+            )
+        )
+        if count_stats:
+            for _, created_at in rows:
+                if created_at is not None:
+                    record_appointment_stats(session, created_at.date(), cancelled=1)
+        session.commit()
+    finally:
+        session.close()
+    return cancelled
+
+
+def index_names(engine: Engine, table_name: str) -> Set[str]:
+    """Names of a table's indexes, including expression indexes SQLite cannot reflect"""
+    if engine.dialect.name == 'sqlite':
+        with engine.connect() as conn:
+            return set(conn.execute(text(
+                "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = :table"
+            ), {'table': table_name}).scalars())
+    return {index['name'] for index in inspect(engine).get_indexes(table_name)}
+
+
+def run_backfill(engine: Engine, name: str, backfill: Callable[[Session], object]) -> bool:
+    """
+    Run a data backfill unless it has already completed
+
+    The backfill must be safe to re-run, as a crash before the marker is
+    committed runs it again.
+
+    Returns:
+        Whether the backfill ran
+    """
+    session = Session(bind=engine)
+    try:
+        if session.get(SchemaBackfill, name) is not None:
+            return False
+        backfill(session)
+        session.add(SchemaBackfill(name=name))
+        session.commit()
+        return True
+    finally:
+        session.close()
+
+
+def apply_migrations(engine: Engine) -> List[str]:
+    """
+    Bring the database schema up to date with the models
+
+    Returns:
+        Names of the columns (as table.column) and indexes that were created
+
+    Raises:
+        DuplicateSlotError: Existing double bookings block the slot index;
+            nothing has been changed
+    """
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+
+    # Check before any DDL so a blocked run leaves the database as it was
+    if 'appointments' in existing_tables and SLOT_INDEX not in index_names(engine, 'appointments'):
+        duplicates = find_duplicate_slots(engine)
+        if duplicates:
+            raise DuplicateSlotError(duplicates)
+
+    # New tables are created together with their indexes
+    Base.metadata.create_all(engine)
+
+    created = []
+    inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+
+        # Columns are added without constraints; existing rows read them as NULL
+        columns = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in columns:
+                column_type = column.type.compile(dialect=engine.dialect)
+                with engine.begin() as conn:
+                    conn.execute(text(
+                        f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'
+                    ))
+                created.append(f'{table.name}.{column.name}')
+
+        existing = index_names(engine, table.name)
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(engine)
+                created.append(index.name)
+
+    # Provider text search indexes sit outside the models (see text_search.py)
+    if 'providers' in existing_tables:
+        with engine.begin() as conn:
+            created.extend(create_text_search(conn))
+
+    # Running appointment counters start from the existing history
+    from src.services.appointment_stats import rebuild_appointment_stats
+    run_backfill(engine, 'appointment_daily_stats', rebuild_appointment_stats)
+
+    # Milestones move out of the care_journeys.milestones JSON arrays
+    from src.services.care_monitoring_service import copy_legacy_milestones
+    run_backfill(engine, 'care_journey_milestones', copy_legacy_milestones)
+
+    return created
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Apply schema migrations')
+    parser.add_argument('--cancel-duplicate-slots', action='store_true',
+                        help='Cancel all but the earliest booking of each double-booked slot')
+    args = parser.parse_args()
+
+    database_url = os.getenv('DATABASE_URL', 'sqlite:///ohipforward.db')
+    engine = create_db_engine(database_url)
+
+    if args.cancel_duplicate_slots:
+        cancelled = cancel_duplicate_slots(engine)
+        print(f"Cancelled {len(cancelled)} duplicate booking(s): {cancelled}")
+
+    print("Applying schema migrations...")
+    try:
+        created = apply_migrations(engine)
+    except DuplicateSlotError as e:
+        print(f"Migration stopped: {e}")
+        sys.exit(1)
+    for name in created:
+        print(f"  created {name}")
+    print(f"Migrations complete ({len(created)} column(s) and index(es) created)")
+
+
+if __name__ == '__main__':
+    main()
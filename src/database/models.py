@@ -1,8 +1,10 @@
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, Float, DateTime, Boolean, ForeignKey, Text, JSON
+from sqlalchemy import Column, Integer, String, Float, Date, DateTime, Boolean, ForeignKey, Text, JSON, Index, UniqueConstraint, event, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 
+from src.database.text_search import create_text_search, drop_text_search
+
 Base = declarative_base()
 
 
@@ -29,6 +31,9 @@ class Patient(Base):
 
 class TriageSession(Base):
     __tablename__ = 'triage_sessions'
+    __table_args__ = (
+        Index('ix_triage_sessions_patient_id', 'patient_id'),
+    )
     
     id = Column(Integer, primary_key=True)
     patient_id = Column(Integer, ForeignKey('patients.id'), nullable=False)
@@ -47,6 +52,15 @@ class TriageSession(Base):
 
 class Provider(Base):
     __tablename__ = 'providers'
+    __table_args__ = (
+        # Directory order: rating desc, wait asc, unrated and unknown waits
+        # last; the IS NULL flags make that order the same on every database
+        Index(
+            'ix_providers_rating_wait_id',
+            text('(rating IS NULL)'), text('rating DESC'),
+            text('(average_wait_time_days IS NULL)'), text('average_wait_time_days'), text('id')
+        ),
+    )
     
     id = Column(Integer, primary_key=True)
     name = Column(String(200), nullable=False)
@@ -69,8 +83,18 @@ class Provider(Base):
     appointments = relationship('Appointment', back_populates='provider')
 
 
+# Name and specialty search indexes live outside the table (see text_search.py)
+event.listen(Provider.__table__, 'after_create',
+             lambda table, connection, **kw: create_text_search(connection))
+event.listen(Provider.__table__, 'before_drop',
+             lambda table, connection, **kw: drop_text_search(connection))
+
+
 class ProviderAvailability(Base):
     __tablename__ = 'provider_availability'
+    __table_args__ = (
+        Index('ix_provider_availability_provider_day', 'provider_id', 'day_of_week'),
+    )
     
     id = Column(Integer, primary_key=True)
     provider_id = Column(Integer, ForeignKey('providers.id'), nullable=False)
@@ -85,6 +109,21 @@ class ProviderAvailability(Base):
 
 class Appointment(Base):
     __tablename__ = 'appointments'
+    __table_args__ = (
+        # Slot search: provider + time window + active status
+        Index('ix_appointments_provider_schedule', 'provider_id', 'scheduled_datetime', 'status'),
+        # Care gaps: missed/last completed appointments per patient
+        Index('ix_appointments_patient_status', 'patient_id', 'status', 'scheduled_datetime'),
+        # System metrics: appointments created in a recent window
+        Index('ix_appointments_created_at', 'created_at'),
+        # Slot reservation: one active appointment per provider and start time
+        Index(
+            'uq_appointments_provider_slot_active', 'provider_id', 'scheduled_datetime',
+            unique=True,
+            sqlite_where=text("status IN ('scheduled', 'confirmed')"),
+            postgresql_where=text("status IN ('scheduled', 'confirmed')")
+        ),
+    )
     
     id = Column(Integer, primary_key=True)
     patient_id = Column(Integer, ForeignKey('patients.id'), nullable=False)
@@ -107,6 +146,9 @@ class Appointment(Base):
 
 class Transportation(Base):
     __tablename__ = 'transportation'
+    __table_args__ = (
+        Index('ix_transportation_ride_id', 'ride_id'),
+    )
     
     id = Column(Integer, primary_key=True)
     appointment_id = Column(Integer, ForeignKey('appointments.id'), nullable=False)
@@ -116,7 +158,10 @@ class Transportation(Base):
     scheduled_time = Column(DateTime)
     pickup_time = Column(DateTime)
     dropoff_time = Column(DateTime)
-    status = Column(String(20), default='pending')  # pending, confirmed, in_progress, completed, cancelled
+    status = Column(String(20), default='pending')  # pending, confirmed, in_progress, completed, cancelled, failed
+    booking_error = Column(String(200))  # Why a background booking failed
+    booking_group_id = Column(Integer)  # First row of a shared ride booked as one request
+    last_event_at = Column(DateTime)  # Time of the latest provider status event applied
     cost = Column(Float)
     driver_name = Column(String(100))
     driver_phone = Column(String(20))
@@ -130,6 +175,9 @@ class Transportation(Base):
 
 class CareJourney(Base):
     __tablename__ = 'care_journeys'
+    __table_args__ = (
+        Index('ix_care_journeys_patient_status', 'patient_id', 'status'),
+    )
     
     id = Column(Integer, primary_key=True)
     patient_id = Column(Integer, ForeignKey('patients.id'), nullable=False)
@@ -137,7 +185,7 @@ class CareJourney(Base):
     status = Column(String(50), default='active')  # active, completed, inactive
     start_date = Column(DateTime, default=datetime.utcnow)
     end_date = Column(DateTime)
-    milestones = Column(JSON)  # Track key events in the care journey
+    milestones = Column(JSON)  # Legacy; milestones now live in care_journey_milestones
     care_gaps = Column(JSON)  # Identified gaps in care
     outcomes = Column(JSON)  # Tracked outcomes
     created_at = Column(DateTime, default=datetime.utcnow)
@@ -147,16 +195,76 @@ class CareJourney(Base):
     patient = relationship('Patient', back_populates='care_journeys')
 
 
+# Provider webhook events already applied, for idempotent redelivery
+class RideWebhookEvent(Base):
+    __tablename__ = 'ride_webhook_events'
+    
+    id = Column(Integer, primary_key=True)
+    event_id = Column(String(100), nullable=False, unique=True)
+    ride_id = Column(String(100))
+    received_at = Column(DateTime, default=datetime.utcnow)
+
+
+# Append-only log of key events in a care journey
+class CareJourneyMilestone(Base):
+    __tablename__ = 'care_journey_milestones'
+    __table_args__ = (
+        # Journey history and latest-milestone lookup
+        Index('ix_care_journey_milestones_journey_timestamp', 'journey_id', 'timestamp'),
+    )
+    
+    id = Column(Integer, primary_key=True)
+    journey_id = Column(Integer, ForeignKey('care_journeys.id'), nullable=False)
+    timestamp = Column(DateTime, nullable=False, default=datetime.utcnow)
+    milestone_type = Column(String(50))
+    description = Column(Text)
+    details = Column(JSON)  # Extra fields, e.g. triage_id or metadata
+
+
 class SystemMetrics(Base):
     __tablename__ = 'system_metrics'
+    __table_args__ = (
+        Index('ix_system_metrics_metric_date', 'metric_date'),
+    )
     
     id = Column(Integer, primary_key=True)
     metric_date = Column(DateTime, default=datetime.utcnow)
     total_patients = Column(Integer, default=0)
     total_appointments = Column(Integer, default=0)
+    recent_appointments = Column(Integer, default=0)  # Created in the last 30 days
+    active_care_journeys = Column(Integer, default=0)
     average_wait_time_hours = Column(Float, default=0.0)
+    completed_appointments = Column(Integer, default=0)  # Of those created in the last 30 days
+    wait_time_p50_hours = Column(Float)
+    wait_time_p90_hours = Column(Float)
     wait_time_reduction_percent = Column(Float, default=0.0)
     cost_savings_percent = Column(Float, default=0.0)
     patient_satisfaction = Column(Float, default=0.0)
     system_utilization = Column(Float, default=0.0)
     created_at = Column(DateTime, default=datetime.utcnow)
+
+
+# Running appointment counters per creation day, updated on every write.
+# Each day is spread over a few slot rows so concurrent writers rarely
+# wait on the same row lock; a day's counters are the sum of its slots.
+class AppointmentDailyStats(Base):
+    __tablename__ = 'appointment_daily_stats'
+    __table_args__ = (
+        UniqueConstraint('stat_date', 'slot', name='uq_appointment_daily_stats_date_slot'),
+    )
+    
+    id = Column(Integer, primary_key=True)
+    stat_date = Column(Date, nullable=False)
+    slot = Column(Integer, default=0, nullable=False)
+    appointments_created = Column(Integer, default=0, nullable=False)
+    appointments_completed = Column(Integer, default=0, nullable=False)
+    appointments_cancelled = Column(Integer, default=0, nullable=False)
+    completed_wait_hours = Column(Float, default=0.0, nullable=False)  # Sum of scheduled - created
+
+
+# One-off data backfills run by the migrations, recorded once completed
+class SchemaBackfill(Base):
+    __tablename__ = 'schema_backfills'
+    
+    name = Column(String(100), primary_key=True)
+    completed_at = Column(DateTime, default=datetime.utcnow, nullable=False)
@@ -0,0 +1,114 @@
+"""
+Database engine and connection pool configuration
+
+Pool tuning is read from environment variables:
+    DB_POOL_SIZE         Persistent connections kept per process (default 5)
+    DB_MAX_OVERFLOW      Extra connections allowed under burst load (default 10)
+    DB_POOL_TIMEOUT      Seconds to wait for a free connection (default 30)
+    DB_POOL_RECYCLE      Seconds before a connection is replaced (default 1800)
+    DB_POOL_PRE_PING     Test connections before use (default true)
+"""
+import os
+import threading
+import time
+from typing import Dict
+
+from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.pool import QueuePool
+
+
+class PoolStatistics:
+    """Counters for connection checkouts and time spent waiting for one"""
+
+    def __init__(self):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def record_wait(self, seconds: float, timed_out: bool = False):
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.total_wait_seconds += seconds
+            self.max_wait_seconds = max(self.max_wait_seconds, seconds)
+
+    def to_dict(self) -> Dict:
+        with self._lock:
+            attempts = self.checkouts + self.timeouts
+            return {
+                'total_checkouts': self.checkouts,
+                'timeouts': self.timeouts,
+                'average_wait_ms': round(self.total_wait_seconds / attempts * 1000, 3) if attempts else 0.0,
+                'max_wait_ms': round(self.max_wait_seconds * 1000, 3)
+            }
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that records how long callers wait for a connection"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.statistics = PoolStatistics()
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except Exception:
+            self.statistics.record_wait(time.perf_counter() - start, timed_out=True)
+            raise
+        self.statistics.record_wait(time.perf_counter() - start)
+        return connection
+
+
+def _env_bool(name: str, default: str) -> bool:
+    return os.getenv(name, default).lower() == 'true'
+
+
+def create_db_engine(database_url: str = None, **kwargs) -> Engine:
+    """
+    Create an engine with a tuned, instrumented connection pool
+
+    In-memory SQLite databases keep SQLAlchemy's default single-connection
+    pool, since a second connection would see a different database.
+    """
+    database_url = database_url or os.getenv('DATABASE_URL', 'sqlite:///ohipforward.db')
+    url = make_url(database_url)
+
+    if url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:'):
+        return create_engine(database_url, **kwargs)
+
+    options = {
+        'poolclass': InstrumentedQueuePool,
+        'pool_size': int(os.getenv('DB_POOL_SIZE', 5)),
+        'max_overflow': int(os.getenv('DB_MAX_OVERFLOW', 10)),
+        'pool_timeout': float(os.getenv('DB_POOL_TIMEOUT', 30)),
+        'pool_recycle': int(os.getenv('DB_POOL_RECYCLE', 1800)),
+        'pool_pre_ping': _env_bool('DB_POOL_PRE_PING', 'true')
+    }
+    options.update(kwargs)
+    return create_engine(database_url, **options)
+
+
+def get_pool_stats(engine: Engine) -> Dict:
+    """Return connection pool occupancy and wait-time statistics"""
+    pool = engine.pool
+    stats = {'pool_class': type(pool).__name__}
+
+    if isinstance(pool, QueuePool):
+        stats.update({
+            'size': pool.size(),
+            'checked_out': pool.checkedout(),
+            'checked_in': pool.checkedin(),
+            'overflow': max(0, pool.overflow())
+        })
+
+    if isinstance(pool, InstrumentedQueuePool):
+        stats.update(pool.statistics.to_dict())
+
+    return stats
@@ -0,0 +1,95 @@
+"""
+Text search indexes on provider names and specialties
+
+The database keeps these in step with the providers table itself:
+
+    SQLite      providers_fts, an FTS5 trigram table over name and specialty
+                maintained by triggers. Its LIKE answers substring and word
+                prefix patterns from the trigram index, case-insensitively
+                for ASCII like ILIKE.
+    PostgreSQL  pg_trgm GIN indexes on name and specialty, used by ILIKE and
+                by the % similarity operator.
+
+They are created with the providers table and added to existing databases
+by the migrations.
+"""
+from typing import List
+
+from sqlalchemy import text
+
+FTS_TABLE = 'providers_fts'
+TRIGRAM_INDEXES = {
+    'ix_providers_name_trgm': 'name',
+    'ix_providers_specialty_trgm': 'specialty',
+}
+
+_SQLITE_TRIGGERS = {
+    'providers_fts_insert': """
+        CREATE TRIGGER providers_fts_insert AFTER INSERT ON providers BEGIN
+            INSERT INTO providers_fts (rowid, name, specialty)
+            VALUES (new.id, new.name, new.specialty);
+        END""",
+    'providers_fts_delete': """
+        CREATE TRIGGER providers_fts_delete AFTER DELETE ON providers BEGIN
+            INSERT INTO providers_fts (providers_fts, rowid, name, specialty)
+            VALUES ('delete', old.id, old.name, old.specialty);
+        END""",
+    'providers_fts_update': """
+        CREATE TRIGGER providers_fts_update AFTER UPDATE OF id, name, specialty ON providers BEGIN
+            INSERT INTO providers_fts (providers_fts, rowid, name, specialty)
+            VALUES ('delete', old.id, old.name, old.specialty);
+            INSERT INTO providers_fts (rowid, name, specialty)
+            VALUES (new.id, new.name, new.specialty);
+        END""",
+}
+
+
+def create_text_search(connection) -> List[str]:
+    """
+    Create the provider text search indexes that are missing
+
+    A new FTS table is filled from the existing providers.
+
+    Returns:
+        Names of the tables and indexes created
+    """
+    dialect = connection.dialect.name
+    if dialect == 'sqlite':
+        exists = connection.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"
+        ), {'name': FTS_TABLE}).first()
+        if exists:
+            return []
+        connection.execute(text(
+            f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5("
+            "name, specialty, content='providers', content_rowid='id', tokenize='trigram')"
+        ))
+        for trigger in _SQLITE_TRIGGERS.values():
+            connection.execute(text(trigger))
+        connection.execute(text(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('rebuild')"))
+        return [FTS_TABLE]
+
+    if dialect == 'postgresql':
+        existing = set(connection.execute(text(
+            "SELECT indexname FROM pg_indexes WHERE tablename = 'providers'"
+        )).scalars())
+        missing = [name for name in TRIGRAM_INDEXES if name not in existing]
+        if missing:
+            connection.execute(text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+        for name in missing:
+            connection.execute(text(
+                f'CREATE INDEX {name} ON providers USING gin ({TRIGRAM_INDEXES[name]} gin_trgm_ops)'
+            ))
+        return missing
+
+    # Other databases fall back to scanning with ILIKE
+    return []
+
+
+def drop_text_search(connection):
+    """Drop the SQLite FTS table and its triggers (PostgreSQL indexes go with the table)"""
+    if connection.dialect.name != 'sqlite':
+        return
+    for trigger in _SQLITE_TRIGGERS:
+        connection.execute(text(f'DROP TRIGGER IF EXISTS {trigger}'))
+    connection.execute(text(f'DROP TABLE IF EXISTS {FTS_TABLE}'))
@@ -0,0 +1,111 @@
+"""
+Population-wide care gap sweep
+
+Recomputes care_gaps for every active care journey in keyset-ordered
+chunks, writing a JSON checkpoint after each committed chunk so an
+interrupted run resumes where it stopped.
+
+Usage:
+    python -m src.jobs.care_gap_sweep --chunk-size 1000 --checkpoint care_gap_sweep.json
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime
+from typing import Callable, Dict, Optional
+
+# Add parent directory to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+from sqlalchemy.orm import sessionmaker
+
+from src.database.session import create_db_engine
+from src.services.care_monitoring_service import CareMonitoringService
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def load_checkpoint(path: Optional[str]) -> Optional[Dict]:
+    """Progress saved by an interrupted run, if any"""
+    if not path or not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_checkpoint(path: str, state: Dict):
+    """Write progress atomically so a crash never leaves a torn file"""
+    temp_path = f'{path}.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump(state, f)
+    os.replace(temp_path, path)
+
+
+def run_sweep(db_session, chunk_size: int = 1000, checkpoint_path: str = None,
+              now: datetime = None, progress: Callable[[Dict], None] = None) -> Dict:
+    """
+    Sweep all active journeys, resuming from a checkpoint if one exists
+
+    A resumed run keeps the reference time of the original run so every
+    journey is judged against the same moment. The checkpoint is removed
+    once the sweep completes.
+
+    Returns:
+        Totals: journeys, gaps, last_journey_id and now
+    """
+    state = load_checkpoint(checkpoint_path) or {
+        'last_journey_id': 0,
+        'journeys': 0,
+        'gaps': 0,
+        'now': (now or datetime.utcnow()).isoformat()
+    }
+
+    service = CareMonitoringService(db_session)
+    for chunk in service.sweep_care_gaps(
+        chunk_size=chunk_size,
+        after_id=state['last_journey_id'],
+        now=datetime.fromisoformat(state['now'])
+    ):
+        state['last_journey_id'] = chunk['last_journey_id']
+        state['journeys'] += chunk['journeys']
+        state['gaps'] += chunk['gaps']
+        if checkpoint_path:
+            save_checkpoint(checkpoint_path, state)
+        if progress:
+            progress(state)
+
+    if checkpoint_path and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    return state
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Recompute care gaps for all active journeys')
+    parser.add_argument('--database-url', default=os.getenv('DATABASE_URL', 'sqlite:///ohipforward.db'))
+    parser.add_argument('--chunk-size', type=int, default=1000)
+    parser.add_argument('--checkpoint', default='care_gap_sweep.json',
+                        help='Progress file; an existing one resumes the sweep')
+    args = parser.parse_args()
+
+    engine = create_db_engine(args.database_url)
+    session = sessionmaker(bind=engine)()
+
+    if load_checkpoint(args.checkpoint):
+        print(f"Resuming from {args.checkpoint}...")
+    start = time.perf_counter()
+
+    def report(state):
+        elapsed = time.perf_counter() - start
+        print(f"  {state['journeys']} journeys, {state['gaps']} gaps "
+              f"(last id {state['last_journey_id']}, {elapsed:.1f}s)")
+
+    state = run_sweep(session, args.chunk_size, args.checkpoint, progress=report)
+    session.close()
+    print(f"Care gap sweep complete: {state['journeys']} journeys, {state['gaps']} gaps")
+
+
+if __name__ == '__main__':
+    main()
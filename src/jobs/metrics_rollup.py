@@ -0,0 +1,55 @@
+"""
+System metrics rollup
+
+Writes a SystemMetrics snapshot from the running appointment counters.
+Schedule it (e.g. every few minutes) so /api/v1/metrics always serves a
+fresh snapshot and /api/v1/metrics/history has an even time series.
+
+Usage:
+    python -m src.jobs.metrics_rollup
+    python -m src.jobs.metrics_rollup --rebuild-daily-stats
+"""
+import argparse
+import os
+import sys
+
+# Add parent directory to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+from sqlalchemy.orm import sessionmaker
+
+from src.database.session import create_db_engine
+from src.services.appointment_stats import rebuild_appointment_stats
+from src.services.care_monitoring_service import CareMonitoringService
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write a system metrics snapshot')
+    parser.add_argument('--database-url', default=os.getenv('DATABASE_URL', 'sqlite:///ohipforward.db'))
+    parser.add_argument('--rebuild-daily-stats', action='store_true',
+                        help='Recompute the daily appointment counters from the appointments table first')
+    args = parser.parse_args()
+
+    engine = create_db_engine(args.database_url)
+    session = sessionmaker(bind=engine)()
+
+    if args.rebuild_daily_stats:
+        days = rebuild_appointment_stats(session)
+        print(f"Rebuilt appointment stats for {days} day(s)")
+
+    care_service = CareMonitoringService(session)
+    care_service.rollup_system_metrics()
+    metrics = care_service.get_system_metrics()
+    session.close()
+
+    print(f"Metrics snapshot as of {metrics['as_of']}:")
+    for name, value in metrics.items():
+        if name != 'as_of':
+            print(f"  {name}: {value}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,46 +1,58 @@
 """
 Main Flask application for OHIPFORWARD API
 """
+import atexit
+import hashlib
+import hmac
+import math
 import os
 import sys
-from datetime import datetime
+from datetime import datetime, timezone
 from flask import Flask, request, jsonify
 from flask_cors import CORS
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import scoped_session, sessionmaker
 from dotenv import load_dotenv
 
 # Add parent directory to path for imports
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from src.database.models import Base, Patient, Provider, Appointment
-from src.ai.triage_engine import SymptomTriageEngine
-from src.services.appointment_service import AppointmentService
-from src.services.transportation_service import TransportationService
-from src.services.care_monitoring_service import CareMonitoringService
+from src.container import AppConfig, ServiceContainer
+from src.database.models import Base, Patient, Appointment, TriageSession
+from src.database.session import create_db_engine, get_pool_stats
+from src.services.http_client import http_client_stats
+from src.services.provider_geo_index import parse_location
+from src.services.provider_service import ProviderService
+from src.services.provider_text_index import fold
 
 # Load environment variables
 load_dotenv()
+config = AppConfig()
 
 # Initialize Flask app
 app = Flask(__name__)
 CORS(app)
-app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'dev-secret-key')
+app.config['SECRET_KEY'] = config.secret_key
 
-# Database setup
-DATABASE_URL = os.getenv('DATABASE_URL', 'sqlite:///ohipforward.db')
-engine = create_engine(DATABASE_URL)
-Session = sessionmaker(bind=engine)
+# Database setup (pool tuning via DB_POOL_* environment variables)
+engine = create_db_engine(config.database_url)
+Session = scoped_session(sessionmaker(bind=engine))
 
-# Initialize AI engine
-triage_engine = SymptomTriageEngine()
+# Services, caches, indexes and outbound clients shared by all requests
+services = ServiceContainer(config, Session)
+atexit.register(services.shutdown)
 
 
 def get_db():
-    """Get database session"""
+    """Get the database session scoped to the current request"""
     return Session()
 
 
+@app.teardown_appcontext
+def remove_db_session(exception=None):
+    """Roll back any open transaction and return the connection to the pool"""
+    Session.remove()
+
+
 @app.route('/')
 def index():
     """Root endpoint"""
@@ -61,6 +73,27 @@ def health_check():
     })
 
 
+@app.route('/api/v1/health/db')
+def database_pool_status():
+    """Connection pool statistics for sizing workers against the database"""
+    return jsonify({'pool': get_pool_stats(Session.get_bind())})
+
+
+@app.route('/api/v1/health/cache')
+def cache_status():
+    """Cache hit ratios for tuning cache sizes and TTLs"""
+    return jsonify({
+        'providers': services.provider_cache.stats(),
+        'triage': services.triage_engine.cache.stats() if services.triage_engine.cache is not None else None
+    })
+
+
+@app.route('/api/v1/health/http')
+def http_client_status():
+    """Per-host latency, failures and circuit state of outbound HTTP clients"""
+    return jsonify(http_client_stats())
+
+
 # =============================================================================
 # Symptom Triage Endpoints
 # =============================================================================
@@ -78,7 +111,7 @@ def triage_symptoms():
         return jsonify({'error': 'Symptoms are required'}), 400
     
     # Perform triage assessment
-    assessment = triage_engine.assess_symptoms(
+    assessment = services.triage_engine.assess_symptoms(
         symptoms=data['symptoms'],
         duration=data.get('duration'),
         severity=data.get('severity'),
@@ -88,7 +121,6 @@ def triage_symptoms():
     # Save triage session if patient ID provided
     if data.get('patientId'):
         db = get_db()
-        from src.database.models import TriageSession
         
         triage_session = TriageSession(
             patient_id=data['patientId'],
@@ -103,11 +135,76 @@ def triage_symptoms():
         db.add(triage_session)
         db.commit()
         assessment['sessionId'] = triage_session.id
-        db.close()
     
     return jsonify(assessment)
 
 
+@app.route('/api/v1/triage/batch', methods=['POST'])
+def triage_symptoms_batch():
+    """
+    POST /api/v1/triage/batch
+    Assess a batch of symptom reports in one request
+    """
+    data = request.json
+    items = data.get('requests') if isinstance(data, dict) else None
+    
+    # Validate input
+    if not items or not isinstance(items, list):
+        return jsonify({'error': 'requests must be a non-empty list'}), 400
+    
+    if len(items) > config.max_triage_batch_size:
+        return jsonify({
+            'error': f'Batch size exceeds limit of {config.max_triage_batch_size}'
+        }), 400
+    
+    for index, item in enumerate(items):
+        if not isinstance(item, dict) or not item.get('symptoms'):
+            return jsonify({'error': f'Symptoms are required (request {index})'}), 400
+    
+    # Perform triage assessments
+    assessments = services.triage_engine.assess_many([
+        {
+            'symptoms': item['symptoms'],
+            'duration': item.get('duration'),
+            'severity': item.get('severity'),
+            'patient_age': item.get('patientAge')
+        }
+        for item in items
+    ])
+    
+    # Save triage sessions for requests with a patient ID in one transaction
+    to_save = [
+        (item, assessment)
+        for item, assessment in zip(items, assessments)
+        if item.get('patientId')
+    ]
+    
+    if to_save:
+        db = get_db()
+        
+        triage_sessions = [
+            TriageSession(
+                patient_id=item['patientId'],
+                symptoms=item['symptoms'],
+                duration=item.get('duration'),
+                severity=item.get('severity'),
+                urgency_level=assessment['urgency'],
+                ai_confidence=assessment['confidence'],
+                recommended_action=assessment['recommendedAction'],
+                next_steps=assessment['nextSteps']
+            )
+            for item, assessment in to_save
+        ]
+        db.add_all(triage_sessions)
+        # Flush issues one multi-row INSERT; read IDs before commit expires them
+        db.flush()
+        for (item, assessment), triage_session in zip(to_save, triage_sessions):
+            assessment['sessionId'] = triage_session.id
+        db.commit()
+    
+    return jsonify({'assessments': assessments})
+
+
 # =============================================================================
 # Provider Endpoints
 # =============================================================================
@@ -118,75 +215,54 @@ def get_providers():
     GET /api/v1/providers
     Search for healthcare providers
     """
-    db = get_db()
-    
     # Get query parameters
-    specialty = request.args.get('specialty')
-    location = request.args.get('location')
-    available = request.args.get('available', 'true').lower() == 'true'
-    
-    # Build query
-    query = db.query(Provider)
-    
-    if specialty:
-        query = query.filter(Provider.specialty.ilike(f'%{specialty}%'))
-    
-    if available:
-        query = query.filter(Provider.accepts_new_patients == True)
+    try:
+        limit = int(request.args.get('limit', 20))
+        radius_km = float(request.args.get('radius', ProviderService.DEFAULT_RADIUS_KM))
+    except ValueError:
+        return jsonify({'error': 'limit and radius must be numbers'}), 400
+    if not math.isfinite(radius_km) or radius_km <= 0:
+        return jsonify({'error': 'radius must be a positive number'}), 400
+    fields = request.args.get('fields')
+    point = parse_location(request.args.get('location'))
+    
+    # Normalized so equivalent requests share a cache entry; text matching
+    # is ASCII case-insensitive and free-text locations are ignored
+    params = {
+        'specialty': fold(request.args.get('specialty') or '') or None,
+        'search': fold(request.args.get('q', '').strip()),
+        'fuzzy': request.args.get('fuzzy', 'false').lower() == 'true',
+        'location': f'{point[0]},{point[1]}' if point else None,
+        'radius_km': radius_km if point else None,
+        'available': request.args.get('available', 'true').lower() == 'true',
+        'limit': limit,
+        'cursor': request.args.get('cursor'),
+        'fields': [field.strip() for field in fields.split(',') if field.strip()] if fields else None
+    }
     
-    # Execute query
-    providers = query.order_by(
-        Provider.rating.desc(),
-        Provider.average_wait_time_days.asc()
-    ).limit(20).all()
+    provider_service = services.providers
     
-    # Format response
-    result = {
-        'providers': [
-            {
-                'id': p.id,
-                'name': p.name,
-                'specialty': p.specialty,
-                'phone': p.phone,
-                'address': p.address,
-                'rating': p.rating,
-                'totalReviews': p.total_reviews,
-                'waitTime': f'{p.average_wait_time_days} days',
-                'acceptsNewPatients': p.accepts_new_patients
-            }
-            for p in providers
-        ]
-    }
+    try:
+        result = services.provider_cache.search(params, lambda: provider_service.search_providers(**params))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
-    db.close()
     return jsonify(result)
 
 
 @app.route('/api/v1/providers/<int:provider_id>', methods=['GET'])
 def get_provider(provider_id):
     """Get details for a specific provider"""
-    db = get_db()
-    provider = db.query(Provider).filter(Provider.id == provider_id).first()
+    provider_service = services.providers
+    
+    provider = services.provider_cache.get_provider(
+        provider_id, lambda: provider_service.get_provider(provider_id)
+    )
     
     if not provider:
-        db.close()
         return jsonify({'error': 'Provider not found'}), 404
     
-    result = {
-        'id': provider.id,
-        'name': provider.name,
-        'specialty': provider.specialty,
-        'phone': provider.phone,
-        'email': provider.email,
-        'address': provider.address,
-        'rating': provider.rating,
-        'totalReviews': provider.total_reviews,
-        'waitTime': f'{provider.average_wait_time_days} days',
-        'acceptsNewPatients': provider.accepts_new_patients
-    }
-    
-    db.close()
-    return jsonify(result)
+    return jsonify(provider)
 
 
 # =============================================================================
@@ -207,8 +283,7 @@ def schedule_appointment():
         if field not in data:
             return jsonify({'error': f'{field} is required'}), 400
     
-    db = get_db()
-    appointment_service = AppointmentService(db)
+    appointment_service = services.appointments
     
     # Schedule appointment
     result = appointment_service.schedule_appointment(
@@ -218,22 +293,57 @@ def schedule_appointment():
         preferences=data.get('preferences', {})
     )
     
-    db.close()
-    
     if result.get('success'):
         return jsonify(result), 201
     else:
         return jsonify(result), 400
 
 
+@app.route('/api/v1/appointments/batch', methods=['POST'])
+def schedule_appointments_batch():
+    """
+    POST /api/v1/appointments/batch
+    Schedule appointments for many patients in one pass
+    """
+    data = request.json
+    items = data.get('requests') if isinstance(data, dict) else None
+    
+    # Validate input
+    if not items or not isinstance(items, list):
+        return jsonify({'error': 'requests must be a non-empty list'}), 400
+    
+    if len(items) > config.max_appointment_batch_size:
+        return jsonify({
+            'error': f'Batch size exceeds limit of {config.max_appointment_batch_size}'
+        }), 400
+    
+    required_fields = ['patientId', 'serviceType', 'urgency']
+    for index, item in enumerate(items):
+        for field in required_fields:
+            if not isinstance(item, dict) or field not in item:
+                return jsonify({'error': f'{field} is required (request {index})'}), 400
+    
+    appointment_service = services.appointments
+    
+    results = appointment_service.schedule_appointments([
+        {
+            'patient_id': item['patientId'],
+            'service_type': item['serviceType'],
+            'urgency': item['urgency'],
+            'preferences': item.get('preferences', {})
+        }
+        for item in items
+    ])
+    
+    return jsonify({'results': results})
+
+
 @app.route('/api/v1/appointments/<int:appointment_id>', methods=['GET'])
 def get_appointment(appointment_id):
     """Get appointment details"""
-    db = get_db()
-    appointment_service = AppointmentService(db)
+    appointment_service = services.appointments
     
     appointment = appointment_service.get_appointment(appointment_id)
-    db.close()
     
     if appointment:
         return jsonify(appointment)
@@ -241,14 +351,27 @@ def get_appointment(appointment_id):
         return jsonify({'error': 'Appointment not found'}), 404
 
 
+@app.route('/api/v1/appointments/<int:appointment_id>/complete', methods=['POST'])
+def complete_appointment(appointment_id):
+    """Mark an appointment as attended"""
+    appointment_service = services.appointments
+    
+    result = appointment_service.complete_appointment(appointment_id)
+    
+    if result.get('success'):
+        return jsonify(result)
+    elif result['error'] == 'Appointment not found':
+        return jsonify(result), 404
+    else:
+        return jsonify(result), 409
+
+
 @app.route('/api/v1/appointments/<int:appointment_id>', methods=['DELETE'])
 def cancel_appointment(appointment_id):
     """Cancel an appointment"""
-    db = get_db()
-    appointment_service = AppointmentService(db)
+    appointment_service = services.appointments
     
     success = appointment_service.cancel_appointment(appointment_id)
-    db.close()
     
     if success:
         return jsonify({'message': 'Appointment cancelled successfully'})
@@ -271,8 +394,7 @@ def book_transportation():
     if not data.get('appointmentId') or not data.get('pickupLocation'):
         return jsonify({'error': 'appointmentId and pickupLocation are required'}), 400
     
-    db = get_db()
-    transport_service = TransportationService(db)
+    transport_service = services.transportation
     
     result = transport_service.book_ride(
         appointment_id=data['appointmentId'],
@@ -281,22 +403,143 @@ def book_transportation():
         scheduled_time=datetime.fromisoformat(data['scheduledTime']) if data.get('scheduledTime') else None
     )
     
-    db.close()
-    
     if result.get('success'):
-        return jsonify(result), 201
+        # Accepted but still being booked: poll the booking for the outcome
+        return jsonify(result), 202 if 'bookingId' in result else 201
     else:
         return jsonify(result), 400
 
 
+@app.route('/api/v1/transportation/batch', methods=['POST'])
+def book_transportation_batch():
+    """
+    POST /api/v1/transportation/batch
+    Book transportation for many appointments, sharing rides where possible
+    """
+    data = request.json
+    items = data.get('requests') if isinstance(data, dict) else None
+    
+    # Validate input
+    if not items or not isinstance(items, list):
+        return jsonify({'error': 'requests must be a non-empty list'}), 400
+    
+    if len(items) > config.max_transportation_batch_size:
+        return jsonify({
+            'error': f'Batch size exceeds limit of {config.max_transportation_batch_size}'
+        }), 400
+    
+    for index, item in enumerate(items):
+        for field in ['appointmentId', 'pickupLocation']:
+            if not isinstance(item, dict) or not item.get(field):
+                return jsonify({'error': f'{field} is required (request {index})'}), 400
+    
+    try:
+        rides = [
+            {
+                'appointment_id': item['appointmentId'],
+                'pickup_location': item['pickupLocation'],
+                'dropoff_location': item.get('dropoffLocation'),
+                'scheduled_time': datetime.fromisoformat(item['scheduledTime']) if item.get('scheduledTime') else None
+            }
+            for item in items
+        ]
+    except ValueError:
+        return jsonify({'error': 'scheduledTime must be an ISO date'}), 400
+    
+    transport_service = services.transportation
+    
+    results = transport_service.book_rides(rides, share_rides=data.get('shareRides', True))
+    
+    return jsonify({'results': results})
+
+
+def _parse_event_time(value):
+    """Event timestamps as naive UTC, like the rest of the database"""
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+@app.route('/api/v1/transportation/webhook', methods=['POST'])
+def ride_status_webhook():
+    """
+    POST /api/v1/transportation/webhook
+    Apply a batch of ride status events from the ride provider
+    """
+    # Unsigned deliveries could complete or cancel any ride, so without a
+    # secret the webhook stays closed
+    if not config.uber_health_webhook_secret:
+        return jsonify({'error': 'Webhook signing secret is not configured'}), 503
+    expected = hmac.new(config.uber_health_webhook_secret.encode(), request.get_data(), hashlib.sha256).hexdigest()
+    if not hmac.compare_digest(expected, request.headers.get('X-Uber-Signature', '')):
+        return jsonify({'error': 'Invalid signature'}), 401
+    
+    data = request.json
+    items = data.get('events') if isinstance(data, dict) else None
+    
+    # Validate input
+    if not items or not isinstance(items, list):
+        return jsonify({'error': 'events must be a non-empty list'}), 400
+    
+    if len(items) > config.max_ride_event_batch_size:
+        return jsonify({
+            'error': f'Batch size exceeds limit of {config.max_ride_event_batch_size}'
+        }), 400
+    
+    events = []
+    for index, item in enumerate(items):
+        for field in ['eventId', 'rideId']:
+            if not isinstance(item, dict) or not item.get(field):
+                return jsonify({'error': f'{field} is required (event {index})'}), 400
+        try:
+            events.append({
+                'event_id': str(item['eventId']),
+                'ride_id': str(item['rideId']),
+                'status': item.get('status'),
+                'timestamp': _parse_event_time(item.get('timestamp')),
+                'pickup_time': _parse_event_time(item.get('pickupTime')),
+                'dropoff_time': _parse_event_time(item.get('dropoffTime'))
+            })
+        except (TypeError, ValueError):
+            return jsonify({'error': f'Invalid timestamp (event {index})'}), 400
+    
+    transport_service = services.transportation
+    
+    result = transport_service.apply_ride_events(events)
+    
+    if not result['success']:
+        return jsonify(result), 503
+    return jsonify({
+        'received': result['received'],
+        'duplicates': result['duplicates'],
+        'applied': result['applied'],
+        'stale': result['stale'],
+        'unknownRides': result['unknown_rides']
+    })
+
+
+@app.route('/api/v1/transportation/bookings/<int:booking_id>', methods=['GET'])
+def get_transportation_booking(booking_id):
+    """Get the state of a transportation booking"""
+    transport_service = services.transportation
+    
+    booking = transport_service.get_booking(booking_id)
+    
+    if booking:
+        return jsonify(booking)
+    else:
+        return jsonify({'error': 'Booking not found'}), 404
+
+
 @app.route('/api/v1/transportation/<ride_id>', methods=['GET'])
 def get_ride_status(ride_id):
     """Get transportation status"""
-    db = get_db()
-    transport_service = TransportationService(db)
+    transport_service = services.transportation
     
     status = transport_service.get_ride_status(ride_id)
-    db.close()
     
     if status:
         return jsonify(status)
@@ -311,11 +554,9 @@ def get_ride_status(ride_id):
 @app.route('/api/v1/care-journeys/<int:patient_id>', methods=['GET'])
 def get_care_journeys(patient_id):
     """Get care journeys for a patient"""
-    db = get_db()
-    care_service = CareMonitoringService(db)
+    care_service = services.care
     
     journeys = care_service.get_patient_journey(patient_id)
-    db.close()
     
     return jsonify({'journeys': journeys})
 
@@ -323,11 +564,9 @@ def get_care_journeys(patient_id):
 @app.route('/api/v1/care-journeys/<int:patient_id>/gaps', methods=['GET'])
 def identify_care_gaps(patient_id):
     """Identify care gaps for a patient"""
-    db = get_db()
-    care_service = CareMonitoringService(db)
+    care_service = services.care
     
     gaps = care_service.identify_care_gaps(patient_id)
-    db.close()
     
     return jsonify({'gaps': gaps})
 
@@ -335,15 +574,34 @@ def identify_care_gaps(patient_id):
 @app.route('/api/v1/metrics', methods=['GET'])
 def get_system_metrics():
     """Get system-wide metrics"""
-    db = get_db()
-    care_service = CareMonitoringService(db)
+    care_service = services.care
     
-    metrics = care_service.get_system_metrics()
-    db.close()
+    metrics = care_service.get_system_metrics(max_age_seconds=config.metrics_snapshot_max_age)
     
     return jsonify(metrics)
 
 
+@app.route('/api/v1/metrics/history', methods=['GET'])
+def get_metrics_history():
+    """Get metrics snapshots over time"""
+    try:
+        since = request.args.get('since')
+        until = request.args.get('until')
+        since = datetime.fromisoformat(since) if since else None
+        until = datetime.fromisoformat(until) if until else None
+        limit = min(int(request.args.get('limit', 100)), 1000)
+    except ValueError:
+        return jsonify({'error': 'since and until must be ISO dates and limit a number'}), 400
+    if limit < 1:
+        return jsonify({'error': 'limit must be at least 1'}), 400
+    
+    care_service = services.care
+    
+    history = care_service.get_metrics_history(since=since, until=until, limit=limit)
+    
+    return jsonify({'history': history})
+
+
 # =============================================================================
 # Patient Endpoints
 # =============================================================================
@@ -366,7 +624,6 @@ def create_patient():
     ).first()
     
     if existing:
-        db.close()
         return jsonify({'error': 'Patient with this OHIP number already exists'}), 400
     
     # Create patient
@@ -392,7 +649,6 @@ def create_patient():
         'lastName': patient.last_name
     }
     
-    db.close()
     return jsonify(result), 201
 
 
@@ -403,7 +659,6 @@ def get_patient(patient_id):
     patient = db.query(Patient).filter(Patient.id == patient_id).first()
     
     if not patient:
-        db.close()
         return jsonify({'error': 'Patient not found'}), 404
     
     result = {
@@ -417,7 +672,6 @@ def get_patient(patient_id):
         'address': patient.address
     }
     
-    db.close()
     return jsonify(result)
 
 
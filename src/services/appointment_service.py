@@ -1,12 +1,18 @@
 """
 Automated appointment scheduling service
 """
-from datetime import datetime, timedelta
+import random
+import time
+from datetime import datetime
 from typing import Dict, List, Optional
 from sqlalchemy.orm import Session
 from sqlalchemy import and_
+from sqlalchemy.exc import IntegrityError
 
-from src.database.models import Appointment, Provider, ProviderAvailability, Patient
+from src.database.models import Appointment, Provider, Patient
+from src.services.appointment_stats import record_appointment_stats, wait_hours
+from src.services.provider_calendar import CalendarIndex
+from src.services.provider_geo_index import ProviderGeoIndex, parse_location
 
 
 class AppointmentService:
@@ -14,8 +20,30 @@ class AppointmentService:
     Smart scheduling service that optimizes appointment allocation
     """
     
-    def __init__(self, db_session: Session):
+    # Slot reservations are optimistic: a concurrent booking of the same
+    # provider/start time fails the unique index and the search is retried
+    # after a short jittered backoff, capped so retries keep pace with
+    # fresh requests competing for the same slots
+    MAX_BOOKING_ATTEMPTS = 20
+    BOOKING_BACKOFF_SECONDS = 0.005
+    MAX_BOOKING_BACKOFF_SECONDS = 0.1
+    
+    # Default search radius when a patient location is given
+    DEFAULT_MAX_DISTANCE_KM = 25
+    
+    def __init__(self, db_session: Session, calendar_index: CalendarIndex = None,
+                 geo_index: ProviderGeoIndex = None):
+        """
+        Args:
+            db_session: Database session
+            calendar_index: Shared provider calendar cache; when omitted,
+                calendars are built per call
+            geo_index: Shared provider location index; when omitted, one is
+                built on the first location-aware request
+        """
         self.db = db_session
+        self.calendar_index = calendar_index
+        self.geo_index = geo_index
         
     def schedule_appointment(self, patient_id: int, service_type: str,
                            urgency: str, preferences: Dict = None) -> Dict:
@@ -26,7 +54,8 @@ class AppointmentService:
             patient_id: Patient ID
             service_type: Type of service needed
             urgency: Urgency level (critical, urgent, routine)
-            preferences: Optional preferences (specialty, location, provider)
+            preferences: Optional preferences (specialty, location as
+                "lat,lng" or {latitude, longitude}, max_distance_km)
             
         Returns:
             Appointment details
@@ -38,7 +67,8 @@ class AppointmentService:
             service_type=service_type,
             specialty=preferences.get('specialty'),
             location=preferences.get('location'),
-            max_wait_time=self._get_max_wait_time(urgency)
+            max_wait_time=self._get_max_wait_time(urgency),
+            max_distance_km=preferences.get('max_distance_km')
         )
         
         if not providers:
@@ -47,53 +77,307 @@ class AppointmentService:
                 'error': 'No available providers found matching criteria'
             }
         
-        # Find next available slot
-        for provider in providers:
-            slot = self._find_next_available_slot(
-                provider.id,
+        # Ranked IDs stay usable after a rollback expires the ORM objects
+        provider_ids = [provider.id for provider in providers]
+        providers_by_id = {provider.id: provider for provider in providers}
+        
+        for attempt in range(self.MAX_BOOKING_ATTEMPTS):
+            # Find next available slot for all candidates at once
+            slots = self._find_available_slots(
+                provider_ids,
                 urgency,
                 preferences.get('preferred_time')
             )
             
-            if slot:
+            # Best match is the highest-ranked provider with a free slot
+            provider_id = next((pid for pid in provider_ids if pid in slots), None)
+            if provider_id is None:
+                break
+            provider = providers_by_id[provider_id]
+            slot = slots[provider_id]
+            
+            try:
                 # Create appointment
                 appointment = self._create_appointment(
                     patient_id=patient_id,
-                    provider_id=provider.id,
+                    provider_id=provider_id,
                     service_type=service_type,
                     scheduled_datetime=slot,
                     urgency=urgency,
                     location=provider.address
                 )
-                
-                return {
-                    'success': True,
-                    'appointmentId': appointment.id,
-                    'provider': {
-                        'id': provider.id,
-                        'name': provider.name,
-                        'specialty': provider.specialty,
-                        'rating': provider.rating,
-                        'phone': provider.phone
-                    },
-                    'dateTime': slot.isoformat(),
-                    'location': provider.address,
-                    'serviceType': service_type,
-                    'urgency': urgency
-                }
+            except IntegrityError:
+                self.db.rollback()
+                if not self._is_slot_taken(provider_id, slot):
+                    raise
+                # Lost the race for this slot; search again without it
+                if self.calendar_index:
+                    self.calendar_index.record_booking(provider_id, slot)
+                time.sleep(random.uniform(0, min(
+                    self.MAX_BOOKING_BACKOFF_SECONDS,
+                    self.BOOKING_BACKOFF_SECONDS * 2 ** attempt
+                )))
+                continue
+            
+            return self._format_booking(
+                appointment.id, provider, slot, service_type, urgency
+            )
+        
+        if provider_id is not None:
+            return {
+                'success': False,
+                'error': 'Appointment slots are in high demand, please retry'
+            }
         
         return {
             'success': False,
             'error': 'No available appointment slots found'
         }
     
+    def schedule_appointments(self, requests: List[Dict],
+                              now: datetime = None) -> List[Dict]:
+        """
+        Schedule appointments for many patients in one pass
+        
+        Requests are served in priority order (most urgent first, then
+        earliest deadline, then submission order). Each takes the earliest
+        free slot of the best-ranked suitable provider, exactly as
+        schedule_appointment would, with slots tracked in memory across the
+        batch. All appointments are written with one bulk insert and one
+        commit; if a concurrent booking claims one of the slots, the whole
+        pass is recomputed against fresh calendars.
+        
+        Args:
+            requests: Dicts with patient_id, service_type, urgency and
+                optional preferences
+            now: Reference time for the search windows (defaults to now)
+            
+        Returns:
+            Results in the same order and format as schedule_appointment
+        """
+        if not requests:
+            return []
+        
+        # Plain rows keep provider details readable after commit/rollback
+        providers = self.db.query(
+            Provider.id,
+            Provider.name,
+            Provider.specialty,
+            Provider.rating,
+            Provider.phone,
+            Provider.address,
+            Provider.average_wait_time_days
+        ).filter(
+            Provider.accepts_new_patients == True
+        ).order_by(
+            Provider.rating.desc(),
+            Provider.average_wait_time_days.asc()
+        ).all()
+        
+        order = sorted(
+            range(len(requests)),
+            key=lambda i: (
+                self._get_max_wait_time(requests[i]['urgency']),
+                self._get_search_window_days(requests[i]['urgency']),
+                i
+            )
+        )
+        
+        for attempt in range(self.MAX_BOOKING_ATTEMPTS):
+            results, assignments = self._assign_slots(
+                requests, order, providers, now or datetime.now()
+            )
+            
+            appointments = [
+                Appointment(
+                    patient_id=requests[i]['patient_id'],
+                    provider_id=provider.id,
+                    service_type=requests[i]['service_type'],
+                    scheduled_datetime=slot,
+                    duration_minutes=30,
+                    status='scheduled',
+                    urgency=requests[i]['urgency'],
+                    location=provider.address
+                )
+                for i, provider, slot in assignments
+            ]
+            
+            try:
+                self.db.add_all(appointments)
+                # One batched INSERT; read IDs before commit expires them
+                self.db.flush()
+                appointment_ids = [appointment.id for appointment in appointments]
+                self._record_created(appointments)
+                self.db.commit()
+            except IntegrityError:
+                self.db.rollback()
+                taken = self._taken_slots([(provider.id, slot) for _, provider, slot in assignments])
+                if not taken:
+                    raise
+                # Lost the race for some slots; assign again without them
+                if self.calendar_index:
+                    for provider_id, slot in taken:
+                        self.calendar_index.record_booking(provider_id, slot)
+                time.sleep(random.uniform(0, min(
+                    self.MAX_BOOKING_BACKOFF_SECONDS,
+                    self.BOOKING_BACKOFF_SECONDS * 2 ** attempt
+                )))
+                continue
+            
+            for (i, provider, slot), appointment_id in zip(assignments, appointment_ids):
+                results[i] = self._format_booking(
+                    appointment_id, provider, slot,
+                    requests[i]['service_type'], requests[i]['urgency']
+                )
+                if self.calendar_index:
+                    self.calendar_index.record_booking(provider.id, slot)
+            
+            return results
+        
+        return [
+            {
+                'success': False,
+                'error': 'Appointment slots are in high demand, please retry'
+            }
+            for _ in requests
+        ]
+    
+    def _assign_slots(self, requests: List[Dict], order: List[int],
+                      providers: List, now: datetime):
+        """
+        Greedily assign slots to requests in priority order
+        
+        Returns:
+            Tuple of (results with failures filled in, list of
+            (request index, provider row, slot) assignments)
+        """
+        max_search_days = max(
+            self._get_search_window_days(req['urgency']) for req in requests
+        )
+        # A private index sees committed bookings and our own tentative ones
+        calendars = CalendarIndex(horizon_days=max_search_days + 1).get_calendars(
+            self.db, [provider.id for provider in providers], now
+        )
+        
+        # Largest search window each provider is known to be full for
+        exhausted = {}
+        candidates_by_key = {}
+        results = [None] * len(requests)
+        assignments = []
+        
+        for i in order:
+            req = requests[i]
+            preferences = req.get('preferences') or {}
+            max_wait_time = self._get_max_wait_time(req['urgency'])
+            search_days = self._get_search_window_days(req['urgency'])
+            
+            point = parse_location(preferences.get('location'))
+            max_distance_km = preferences.get('max_distance_km')
+            key = (preferences.get('specialty'), max_wait_time, point, max_distance_km)
+            candidates = candidates_by_key.get(key)
+            if candidates is None:
+                candidates = [
+                    provider for provider in providers
+                    if (not key[0] or provider.specialty == key[0])
+                    and (not max_wait_time or (
+                        provider.average_wait_time_days is not None
+                        and provider.average_wait_time_days <= max_wait_time
+                    ))
+                ]
+                if point is not None:
+                    distances = self._providers_near(preferences['location'], max_distance_km)
+                    candidates = sorted(
+                        (provider for provider in candidates if provider.id in distances),
+                        key=lambda provider: distances[provider.id]
+                    )
+                candidates_by_key[key] = candidates
+            
+            if not candidates:
+                results[i] = {
+                    'success': False,
+                    'error': 'No available providers found matching criteria'
+                }
+                continue
+            
+            for provider in candidates:
+                calendar = calendars.get(provider.id)
+                if not calendar or exhausted.get(provider.id, -1) >= search_days:
+                    continue
+                
+                slot = calendar.next_free_slot(now, search_days)
+                if slot is None:
+                    exhausted[provider.id] = search_days
+                    continue
+                
+                calendar.book(slot)
+                assignments.append((i, provider, slot))
+                break
+            else:
+                results[i] = {
+                    'success': False,
+                    'error': 'No available appointment slots found'
+                }
+        
+        return results, assignments
+    
+    def _format_booking(self, appointment_id: int, provider, slot: datetime,
+                        service_type: str, urgency: str) -> Dict:
+        """Format a successful booking for API response"""
+        return {
+            'success': True,
+            'appointmentId': appointment_id,
+            'provider': {
+                'id': provider.id,
+                'name': provider.name,
+                'specialty': provider.specialty,
+                'rating': provider.rating,
+                'phone': provider.phone
+            },
+            'dateTime': slot.isoformat(),
+            'location': provider.address,
+            'serviceType': service_type,
+            'urgency': urgency
+        }
+    
+    def _is_slot_taken(self, provider_id: int, slot: datetime) -> bool:
+        """Check whether a provider already has an active appointment at slot"""
+        return self.db.query(Appointment.id).filter(
+            and_(
+                Appointment.provider_id == provider_id,
+                Appointment.scheduled_datetime == slot,
+                Appointment.status.in_(['scheduled', 'confirmed'])
+            )
+        ).first() is not None
+    
+    def _taken_slots(self, slots: List) -> set:
+        """The (provider_id, slot) pairs that already have an active appointment"""
+        wanted = set(slots)
+        if not wanted:
+            return set()
+        rows = self.db.query(Appointment.provider_id, Appointment.scheduled_datetime).filter(
+            and_(
+                Appointment.provider_id.in_({provider_id for provider_id, _ in wanted}),
+                Appointment.scheduled_datetime.in_({slot for _, slot in wanted}),
+                Appointment.status.in_(['scheduled', 'confirmed'])
+            )
+        )
+        return {(provider_id, slot) for provider_id, slot in rows} & wanted
+    
     def _find_suitable_providers(self, service_type: str, specialty: str = None,
-                                location: str = None, max_wait_time: float = None) -> List:
+                                location=None, max_wait_time: float = None,
+                                max_distance_km: float = None) -> List:
         """Find providers matching criteria"""
         query = self.db.query(Provider).filter(
             Provider.accepts_new_patients == True
         )
         
+        # Restrict to providers near the patient using the spatial index
+        distances = self._providers_near(location, max_distance_km)
+        if distances is not None:
+            if not distances:
+                return []
+            query = query.filter(Provider.id.in_(list(distances)))
+        
         # Filter by specialty if provided
         if specialty:
             query = query.filter(Provider.specialty == specialty)
@@ -108,76 +392,64 @@ class AppointmentService:
             Provider.average_wait_time_days.asc()
         ).all()
         
-        # TODO: Add location-based filtering with distance calculation
+        # Closest first; the rating order above breaks distance ties
+        if distances is not None:
+            providers.sort(key=lambda provider: distances[provider.id])
         
         return providers
     
-    def _find_next_available_slot(self, provider_id: int, urgency: str,
-                                 preferred_time: str = None) -> Optional[datetime]:
-        """Find next available time slot for a provider"""
-        # Get provider availability
-        availability = self.db.query(ProviderAvailability).filter(
-            and_(
-                ProviderAvailability.provider_id == provider_id,
-                ProviderAvailability.is_available == True
-            )
-        ).all()
+    def _providers_near(self, location, max_distance_km: float = None) -> Optional[Dict[int, float]]:
+        """
+        Distances to providers within range of a location
         
-        if not availability:
+        Returns:
+            Mapping of provider ID to distance in km, or None when the
+            location has no usable coordinates
+        """
+        point = parse_location(location)
+        if point is None:
             return None
         
-        # Determine search window based on urgency
-        search_days = self._get_search_window_days(urgency)
-        start_date = datetime.now()
-        end_date = start_date + timedelta(days=search_days)
+        if self.geo_index is None:
+            self.geo_index = ProviderGeoIndex()
+        self.geo_index.sync(self.db)
+        return dict(self.geo_index.within_radius(
+            point[0], point[1], max_distance_km or self.DEFAULT_MAX_DISTANCE_KM
+        ))
+    
+    def _find_next_available_slot(self, provider_id: int, urgency: str,
+                                 preferred_time: str = None) -> Optional[datetime]:
+        """Find next available time slot for a provider"""
+        return self._find_available_slots(
+            [provider_id], urgency, preferred_time
+        ).get(provider_id)
+    
+    def _find_available_slots(self, provider_ids: List[int], urgency: str,
+                              preferred_time: str = None,
+                              now: datetime = None) -> Dict[int, datetime]:
+        """
+        Find the next available time slot for each of several providers
         
-        # Get existing appointments
-        existing_appointments = self.db.query(Appointment).filter(
-            and_(
-                Appointment.provider_id == provider_id,
-                Appointment.scheduled_datetime >= start_date,
-                Appointment.scheduled_datetime <= end_date,
-                Appointment.status.in_(['scheduled', 'confirmed'])
-            )
-        ).all()
+        Uses bitmap calendars of 30-minute slots. Calendars missing from the
+        index are built with one availability and one appointment query per
+        chunk of providers.
         
-        # Convert to set of occupied time slots
-        occupied_slots = {
-            appt.scheduled_datetime.replace(minute=0, second=0, microsecond=0)
-            for appt in existing_appointments
-        }
+        Returns:
+            Mapping of provider ID to its earliest free slot; providers with
+            no free slot in the search window are omitted
+        """
+        if not provider_ids:
+            return {}
         
-        # Find first available slot
-        current_date = start_date
-        while current_date <= end_date:
-            day_of_week = current_date.weekday()
-            
-            # Check if provider is available on this day
-            day_availability = [
-                avail for avail in availability
-                if avail.day_of_week == day_of_week
-            ]
-            
-            if day_availability:
-                avail = day_availability[0]
-                # Parse time slots (9 AM to 5 PM in 30-min increments)
-                start_hour = int(avail.start_time.split(':')[0])
-                end_hour = int(avail.end_time.split(':')[0])
-                
-                for hour in range(start_hour, end_hour):
-                    for minute in [0, 30]:
-                        slot_time = current_date.replace(
-                            hour=hour, minute=minute, second=0, microsecond=0
-                        )
-                        
-                        # Check if slot is in the future and not occupied
-                        if slot_time > datetime.now() and slot_time not in occupied_slots:
-                            return slot_time
-            
-            # Move to next day
-            current_date += timedelta(days=1)
+        # Search from now through the end of the urgency window
+        search_days = self._get_search_window_days(urgency)
+        calendar_index = self.calendar_index or CalendarIndex(
+            horizon_days=search_days + 1
+        )
         
-        return None
+        return calendar_index.next_free_slots(
+            self.db, provider_ids, now or datetime.now(), search_days
+        )
     
     def _create_appointment(self, patient_id: int, provider_id: int,
                           service_type: str, scheduled_datetime: datetime,
@@ -195,11 +467,27 @@ class AppointmentService:
         )
         
         self.db.add(appointment)
+        self.db.flush()
+        self._record_created([appointment])
         self.db.commit()
         self.db.refresh(appointment)
         
+        if self.calendar_index:
+            self.calendar_index.record_booking(
+                provider_id, scheduled_datetime, appointment.duration_minutes
+            )
+        
         return appointment
     
+    def _record_created(self, appointments: List[Appointment]):
+        """Count flushed appointments in their creation day's stats"""
+        created_by_day = {}
+        for appointment in appointments:
+            day = appointment.created_at.date()
+            created_by_day[day] = created_by_day.get(day, 0) + 1
+        for day, count in created_by_day.items():
+            record_appointment_stats(self.db, day, created=count)
+    
     def _get_max_wait_time(self, urgency: str) -> float:
         """Get maximum acceptable wait time in days based on urgency"""
         wait_times = {
@@ -243,15 +531,84 @@ class AppointmentService:
             'location': appointment.location
         }
     
+    def _set_status(self, appointment_id: int, from_status: str, to_status: str) -> bool:
+        """
+        Change an appointment's status if it is still from_status
+        
+        A conditional UPDATE, so of two concurrent requests changing the
+        same appointment only one succeeds and records the change in the
+        running counters.
+        """
+        return self.db.query(Appointment).filter(
+            Appointment.id == appointment_id,
+            Appointment.status == from_status
+        ).update({'status': to_status}, synchronize_session=False) == 1
+    
     def cancel_appointment(self, appointment_id: int) -> bool:
         """Cancel an appointment"""
         appointment = self.db.query(Appointment).filter(
             Appointment.id == appointment_id
         ).first()
         
-        if appointment:
-            appointment.status = 'cancelled'
+        if not appointment:
+            return False
+        
+        while appointment.status != 'cancelled':
+            previous = appointment.status
+            if not self._set_status(appointment.id, previous, 'cancelled'):
+                # Changed by a concurrent request: reload and look again
+                self.db.rollback()
+                continue
+            
+            # A cancelled completion no longer counts towards wait times
+            was_completed = previous == 'completed'
+            record_appointment_stats(
+                self.db, appointment.created_at.date(),
+                cancelled=1,
+                completed=-1 if was_completed else 0,
+                completed_wait_hours=-wait_hours(
+                    appointment.created_at, appointment.scheduled_datetime
+                ) if was_completed else 0.0
+            )
+            slot = (appointment.provider_id, appointment.scheduled_datetime, appointment.duration_minutes)
+            self.db.commit()
+            
+            if self.calendar_index and previous in ('scheduled', 'confirmed'):
+                self.calendar_index.record_cancellation(*slot)
+            break
+        
+        return True
+    
+    def complete_appointment(self, appointment_id: int) -> Dict:
+        """Mark an appointment as attended"""
+        appointment = self.db.query(Appointment).filter(
+            Appointment.id == appointment_id
+        ).first()
+        
+        if not appointment:
+            return {'success': False, 'error': 'Appointment not found'}
+        
+        while appointment.status not in ('cancelled', 'completed'):
+            if not self._set_status(appointment.id, appointment.status, 'completed'):
+                # Changed by a concurrent request: reload and look again
+                self.db.rollback()
+                continue
+            
+            record_appointment_stats(
+                self.db, appointment.created_at.date(),
+                completed=1,
+                completed_wait_hours=wait_hours(
+                    appointment.created_at, appointment.scheduled_datetime
+                )
+            )
+            slot = (appointment.provider_id, appointment.scheduled_datetime, appointment.duration_minutes)
             self.db.commit()
-            return True
+            
+            # Only scheduled and confirmed appointments hold calendar slots
+            if self.calendar_index:
+                self.calendar_index.record_cancellation(*slot)
+        
+        if appointment.status == 'cancelled':
+            return {'success': False, 'error': 'Cancelled appointments cannot be completed'}
         
-        return False
+        return {'success': True, 'id': appointment.id, 'status': appointment.status}
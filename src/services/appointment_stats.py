@@ -0,0 +1,176 @@
+"""
+Running per-day appointment counters behind the system metrics
+
+Every appointment write adds to one of the STAT_SLOTS AppointmentDailyStats
+rows of the day the appointment was created, in the same transaction, so
+metrics over a window of days are a sum over a handful of rows instead of
+a scan of the appointments table, and concurrent bookings rarely queue on
+the same row lock.
+"""
+import math
+import random
+from collections import defaultdict
+from datetime import date, datetime
+from typing import Dict, Optional, Sequence
+
+from sqlalchemy import delete, func, insert, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+
+from src.database.models import Appointment, AppointmentDailyStats
+
+COUNTERS = (
+    'appointments_created',
+    'appointments_completed',
+    'appointments_cancelled',
+    'completed_wait_hours'
+)
+
+# Rows each day's counters are spread over
+STAT_SLOTS = 16
+
+
+def wait_hours(created_at: datetime, scheduled_datetime: datetime) -> float:
+    """Hours from booking to the appointment"""
+    return (scheduled_datetime - created_at).total_seconds() / 3600
+
+
+def record_appointment_stats(db, stat_date: date, created: int = 0, completed: int = 0,
+                             cancelled: int = 0, completed_wait_hours: float = 0.0):
+    """
+    Add to one day's counters in the caller's transaction
+
+    The change goes to a randomly chosen slot row of the day. PostgreSQL
+    and SQLite use a single INSERT ... ON CONFLICT DO UPDATE so concurrent
+    writers never race to create the row; other databases update the row
+    and insert it when missing.
+    """
+    values = {
+        'stat_date': stat_date,
+        'slot': random.randrange(STAT_SLOTS),
+        'appointments_created': created,
+        'appointments_completed': completed,
+        'appointments_cancelled': cancelled,
+        'completed_wait_hours': completed_wait_hours
+    }
+    table = AppointmentDailyStats.__table__
+    dialect = db.get_bind().dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        statement = (postgresql if dialect == 'postgresql' else sqlite).insert(table)
+        statement = statement.values(**values).on_conflict_do_update(
+            index_elements=['stat_date', 'slot'],
+            set_={name: table.c[name] + statement.excluded[name] for name in COUNTERS}
+        )
+        db.execute(statement)
+        return
+
+    add = update(table).where(
+        table.c.stat_date == stat_date, table.c.slot == values['slot']
+    ).values(**{name: table.c[name] + values[name] for name in COUNTERS})
+    if db.execute(add).rowcount:
+        return
+    try:
+        with db.begin_nested():
+            db.execute(insert(table).values(**values))
+    except IntegrityError:
+        # Another writer created the row first
+        db.execute(add)
+
+
+def rebuild_appointment_stats(db, chunk_size: int = 10000) -> int:
+    """
+    Recompute every day's counters from the appointments table
+
+    Used to backfill the table once; rows are streamed so memory is bounded
+    by the number of distinct days.
+
+    Returns:
+        Number of days written
+    """
+    days: Dict[date, Dict] = defaultdict(lambda: dict.fromkeys(COUNTERS, 0))
+    rows = db.query(
+        Appointment.created_at, Appointment.scheduled_datetime, Appointment.status
+    ).filter(Appointment.created_at.isnot(None)).yield_per(chunk_size)
+
+    for created_at, scheduled_datetime, status in rows:
+        counters = days[created_at.date()]
+        counters['appointments_created'] += 1
+        if status == 'completed':
+            counters['appointments_completed'] += 1
+            counters['completed_wait_hours'] += wait_hours(created_at, scheduled_datetime)
+        elif status == 'cancelled':
+            counters['appointments_cancelled'] += 1
+
+    db.execute(delete(AppointmentDailyStats))
+    if days:
+        db.execute(insert(AppointmentDailyStats), [
+            {'stat_date': stat_date, 'slot': 0, **counters} for stat_date, counters in days.items()
+        ])
+    db.commit()
+    return len(days)
+
+
+def _wait_hours_expression(dialect: str):
+    """SQL expression for wait_hours() on the appointments table, None if unknown"""
+    if dialect == 'postgresql':
+        return func.extract(
+            'epoch', Appointment.scheduled_datetime - Appointment.created_at
+        ) / 3600
+    if dialect == 'sqlite':
+        return (func.julianday(Appointment.scheduled_datetime) - func.julianday(Appointment.created_at)) * 24
+    return None
+
+
+def completed_wait_percentiles(db, since: datetime,
+                               percentiles: Sequence[float] = (0.5, 0.9)) -> Dict[float, Optional[float]]:
+    """
+    Percentiles of wait hours for appointments completed since a booking time
+
+    Computed in the database with linear interpolation between the closest
+    ranks, as percentile_cont does: PostgreSQL runs percentile_cont itself;
+    SQLite, which has no ordered-set aggregates, counts the rows and reads
+    the (at most two) neighbouring values per percentile with ORDER BY /
+    LIMIT / OFFSET over the created_at index. Only scalars are fetched, so
+    memory does not grow with the window. Other databases, with no known
+    interval expression, sort the waits computed from streamed timestamps.
+
+    Returns:
+        Mapping of percentile to hours, None when nothing was completed
+    """
+    dialect = db.get_bind().dialect.name
+    wait = _wait_hours_expression(dialect)
+    completed = (Appointment.status == 'completed', Appointment.created_at >= since)
+
+    if dialect == 'postgresql':
+        row = db.query(*[
+            func.percentile_cont(p).within_group(wait) for p in percentiles
+        ]).filter(*completed).one()
+        return {p: (float(value) if value is not None else None) for p, value in zip(percentiles, row)}
+
+    if wait is None:
+        waits = sorted(
+            wait_hours(created_at, scheduled_datetime)
+            for created_at, scheduled_datetime in db.query(
+                Appointment.created_at, Appointment.scheduled_datetime
+            ).filter(*completed).yield_per(10000)
+        )
+        count = len(waits)
+        neighbours = lambda lower: waits[lower:lower + 2]
+    else:
+        count = db.query(func.count(Appointment.id)).filter(*completed).scalar()
+        neighbours = lambda lower: [
+            value for (value,) in db.query(wait).filter(*completed)
+            .order_by(wait).limit(2).offset(lower)
+        ]
+
+    results = {}
+    for p in percentiles:
+        if not count:
+            results[p] = None
+            continue
+        position = p * (count - 1)
+        lower = math.floor(position)
+        values = neighbours(lower)
+        upper_value = values[1] if len(values) > 1 else values[0]
+        results[p] = values[0] + (upper_value - values[0]) * (position - lower)
+    return results
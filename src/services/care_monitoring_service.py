@@ -1,12 +1,16 @@
 """
 Continuous care monitoring and journey tracking service
 """
-from datetime import datetime, timedelta
-from typing import Dict, List, Optional
+from datetime import datetime, time, timedelta
+from typing import Dict, Iterator, List
 from sqlalchemy.orm import Session
-from sqlalchemy import and_, or_
+from sqlalchemy import and_, case, func, insert, select, update
 
-from src.database.models import CareJourney, Patient, Appointment, TriageSession
+from src.database.models import (
+    CareJourney, CareJourneyMilestone, Patient, Appointment,
+    SystemMetrics, AppointmentDailyStats
+)
+from src.services.appointment_stats import completed_wait_percentiles
 
 
 class CareMonitoringService:
@@ -30,59 +34,63 @@ class CareMonitoringService:
         Returns:
             Care journey details
         """
-        milestones = []
-        if initial_triage_id:
-            milestones.append({
-                'timestamp': datetime.utcnow().isoformat(),
-                'type': 'triage',
-                'description': 'Initial symptom assessment',
-                'triage_id': initial_triage_id
-            })
-        
         journey = CareJourney(
             patient_id=patient_id,
             condition=condition,
             status='active',
             start_date=datetime.utcnow(),
-            milestones=milestones,
             care_gaps=[],
             outcomes={}
         )
-        
         self.db.add(journey)
+        self.db.flush()
+        
+        milestones = []
+        if initial_triage_id:
+            milestone = CareJourneyMilestone(
+                journey_id=journey.id,
+                timestamp=datetime.utcnow(),
+                milestone_type='triage',
+                description='Initial symptom assessment',
+                details={'triage_id': initial_triage_id}
+            )
+            self.db.add(milestone)
+            milestones.append(milestone)
+        
         self.db.commit()
         self.db.refresh(journey)
         
-        return self._format_journey(journey)
+        return self._format_journey(journey, milestones)
     
     def add_milestone(self, journey_id: int, milestone_type: str,
                      description: str, metadata: Dict = None) -> bool:
-        """Add a milestone to a care journey"""
-        journey = self.db.query(CareJourney).filter(
-            CareJourney.id == journey_id
-        ).first()
-        
-        if not journey:
-            return False
+        """
+        Add a milestone to a care journey
         
-        milestone = {
-            'timestamp': datetime.utcnow().isoformat(),
-            'type': milestone_type,
-            'description': description,
-            'metadata': metadata or {}
-        }
+        Appends one row to the milestone log, so the cost does not depend
+        on how many milestones the journey already has.
+        """
+        now = datetime.utcnow()
+        touched = self.db.execute(
+            update(CareJourney).where(CareJourney.id == journey_id).values(updated_at=now)
+        )
         
-        if journey.milestones:
-            journey.milestones.append(milestone)
-        else:
-            journey.milestones = [milestone]
+        if not touched.rowcount:
+            self.db.rollback()
+            return False
         
-        journey.updated_at = datetime.utcnow()
+        self.db.add(CareJourneyMilestone(
+            journey_id=journey_id,
+            timestamp=now,
+            milestone_type=milestone_type,
+            description=description,
+            details={'metadata': metadata or {}}
+        ))
         self.db.commit()
         
         return True
     
-    def identify_care_gaps(self, patient_id: int) -> List[Dict]:
+    def identify_care_gaps(self, patient_id: int, now: datetime = None) -> List[Dict]:
         """
         Identify gaps in patient care
         
@@ -91,20 +99,123 @@ class CareMonitoringService:
         - Incomplete test results
         - Missing specialist referrals
         - Medication adherence issues
+        
+        Runs a fixed number of queries however many journeys are active and
+        saves the gaps of every journey in one commit.
         """
-        gaps = []
+        now = now or datetime.utcnow()
         
-        # Get active care journeys
-        active_journeys = self.db.query(CareJourney).filter(
+        # Get active care journeys, each with its latest milestone
+        rows = self.db.query(CareJourney, CareJourneyMilestone).outerjoin(
+            CareJourneyMilestone, CareJourneyMilestone.id == self._latest_milestone_id()
+        ).filter(
             and_(
                 CareJourney.patient_id == patient_id,
                 CareJourney.status == 'active'
             )
         ).all()
         
+        if not rows:
+            return []
+        
+        active_journeys = [journey for journey, _ in rows]
+        gaps = self._compute_gaps(
+            active_journeys,
+            self._missed_appointments_by_patient([patient_id], now),
+            self._last_appointments_by_patient([patient_id]),
+            {journey.id: milestone for journey, milestone in rows if milestone},
+            now
+        )
+        
+        # Update journeys with identified gaps
+        gaps_by_journey = {}
+        for gap in gaps:
+            gaps_by_journey.setdefault(gap['journey_id'], []).append(gap)
         for journey in active_journeys:
+            journey.care_gaps = gaps_by_journey.get(journey.id, [])
+        self.db.commit()
+        
+        return gaps
+    
+    def sweep_care_gaps(self, chunk_size: int = 1000, after_id: int = 0,
+                        now: datetime = None) -> Iterator[Dict]:
+        """
+        Recompute care gaps for every active journey, one chunk at a time
+        
+        Journeys are read in ID order by keyset (id > last seen), as plain
+        rows rather than ORM objects, so memory stays bounded by chunk_size;
+        only the latest milestone of each journey is loaded.
+        Each chunk costs three queries and one bulk UPDATE, and is committed
+        before the next is read.
+        
+        Args:
+            chunk_size: Journeys per chunk
+            after_id: Resume after this journey ID
+            now: Reference time (default: current time)
+            
+        Yields:
+            Per-chunk progress: last_journey_id, journeys and gaps
+        """
+        now = now or datetime.utcnow()
+        
+        while True:
+            journeys = self.db.query(
+                CareJourney.id, CareJourney.patient_id, CareJourneyMilestone
+            ).outerjoin(
+                CareJourneyMilestone, CareJourneyMilestone.id == self._latest_milestone_id()
+            ).filter(
+                and_(
+                    CareJourney.status == 'active',
+                    CareJourney.id > after_id
+                )
+            ).order_by(CareJourney.id).limit(chunk_size).all()
+            
+            if not journeys:
+                return
+            
+            patient_ids = sorted({journey.patient_id for journey in journeys})
+            gaps = self._compute_gaps(
+                journeys,
+                self._missed_appointments_by_patient(patient_ids, now),
+                self._last_appointments_by_patient(patient_ids),
+                {journey.id: journey.CareJourneyMilestone for journey in journeys
+                 if journey.CareJourneyMilestone},
+                now
+            )
+            
+            gaps_by_journey = {}
+            for gap in gaps:
+                gaps_by_journey.setdefault(gap['journey_id'], []).append(gap)
+            
+            # Bulk UPDATE by primary key, one statement for the chunk
+            self.db.execute(update(CareJourney), [
+                {'id': journey.id, 'care_gaps': gaps_by_journey.get(journey.id, [])}
+                for journey in journeys
+            ])
+            self.db.commit()
+            
+            after_id = journeys[-1].id
+            yield {'last_journey_id': after_id, 'journeys': len(journeys), 'gaps': len(gaps)}
+    
+    def _compute_gaps(self, journeys, missed_by_patient: Dict[int, List[Dict]],
+                      last_by_patient: Dict[int, datetime],
+                      latest_milestone_by_journey: Dict[int, CareJourneyMilestone],
+                      now: datetime) -> List[Dict]:
+        """
+        Care gaps of journeys, in journey order
+        
+        Args:
+            journeys: Journeys (or rows) with id and patient_id
+            missed_by_patient: Missed appointments per patient ID
+            last_by_patient: Date of the last completed appointment per patient ID
+            latest_milestone_by_journey: Most recent milestone per journey ID
+            now: Reference time
+        """
+        gaps = []
+        
+        for journey in journeys:
             # Check for missed appointments
-            missed_appointments = self._check_missed_appointments(patient_id)
+            missed_appointments = missed_by_patient.get(journey.patient_id)
             if missed_appointments:
                 gaps.append({
                     'journey_id': journey.id,
@@ -115,24 +226,22 @@ class CareMonitoringService:
                 })
             
             # Check for overdue follow-ups
-            last_appointment = self._get_last_appointment(patient_id)
-            if last_appointment:
-                days_since = (datetime.utcnow() - last_appointment.scheduled_datetime).days
+            last_appointment_date = last_by_patient.get(journey.patient_id)
+            if last_appointment_date:
+                days_since = (now - last_appointment_date).days
                 if days_since > 90:  # No appointment in 90 days
                     gaps.append({
                         'journey_id': journey.id,
                         'type': 'overdue_followup',
                         'severity': 'medium',
                         'description': f'No follow-up appointment in {days_since} days',
-                        'last_appointment_date': last_appointment.scheduled_datetime.isoformat()
+                        'last_appointment_date': last_appointment_date.isoformat()
                     })
             
             # Check milestone progression
-            if journey.milestones:
-                last_milestone_date = datetime.fromisoformat(
-                    journey.milestones[-1]['timestamp']
-                )
-                days_since_milestone = (datetime.utcnow() - last_milestone_date).days
+            last_milestone = latest_milestone_by_journey.get(journey.id)
+            if last_milestone:
+                days_since_milestone = (now - last_milestone.timestamp).days
                 
                 if days_since_milestone > 30:
                     gaps.append({
@@ -140,44 +249,70 @@ class CareMonitoringService:
                         'type': 'stalled_progress',
                         'severity': 'medium',
                         'description': f'No progress in {days_since_milestone} days',
-                        'last_milestone': journey.milestones[-1]
+                        'last_milestone': self._format_milestone(last_milestone)
                     })
         
-        # Update journey with identified gaps
-        for journey in active_journeys:
-            journey_gaps = [g for g in gaps if g['journey_id'] == journey.id]
-            journey.care_gaps = journey_gaps
-            self.db.commit()
-        
         return gaps
     
-    def _check_missed_appointments(self, patient_id: int) -> List[Dict]:
-        """Check for missed appointments"""
-        missed = self.db.query(Appointment).filter(
+    def _missed_appointments_by_patient(self, patient_ids: List[int],
+                                        now: datetime) -> Dict[int, List[Dict]]:
+        """Appointments still scheduled after their start time, per patient"""
+        missed = self.db.query(
+            Appointment.patient_id,
+            Appointment.id,
+            Appointment.scheduled_datetime,
+            Appointment.service_type
+        ).filter(
             and_(
-                Appointment.patient_id == patient_id,
+                Appointment.patient_id.in_(patient_ids),
                 Appointment.status == 'scheduled',
-                Appointment.scheduled_datetime < datetime.utcnow()
+                Appointment.scheduled_datetime < now
             )
-        ).all()
+        ).order_by(Appointment.scheduled_datetime, Appointment.id)
+        
+        missed_by_patient = {}
+        for patient_id, appointment_id, scheduled_datetime, service_type in missed:
+            missed_by_patient.setdefault(patient_id, []).append({
+                'id': appointment_id,
+                'scheduled_datetime': scheduled_datetime.isoformat(),
+                'service_type': service_type
+            })
+        return missed_by_patient
+    
+    def _latest_milestone_id(self):
+        """Correlated subquery for the ID of a journey's most recent milestone"""
+        return select(CareJourneyMilestone.id).where(
+            CareJourneyMilestone.journey_id == CareJourney.id
+        ).order_by(
+            CareJourneyMilestone.timestamp.desc(), CareJourneyMilestone.id.desc()
+        ).limit(1).correlate(CareJourney).scalar_subquery()
+    
+    def _milestones_by_journey(self, journey_ids: List[int]) -> Dict[int, List[CareJourneyMilestone]]:
+        """Milestones of journeys in time order, per journey ID"""
+        milestones = self.db.query(CareJourneyMilestone).filter(
+            CareJourneyMilestone.journey_id.in_(journey_ids)
+        ).order_by(
+            CareJourneyMilestone.journey_id, CareJourneyMilestone.timestamp, CareJourneyMilestone.id
+        )
         
-        return [
-            {
-                'id': appt.id,
-                'scheduled_datetime': appt.scheduled_datetime.isoformat(),
-                'service_type': appt.service_type
-            }
-            for appt in missed
-        ]
+        milestones_by_journey = {}
+        for milestone in milestones:
+            milestones_by_journey.setdefault(milestone.journey_id, []).append(milestone)
+        return milestones_by_journey
     
-    def _get_last_appointment(self, patient_id: int) -> Optional[Appointment]:
-        """Get most recent completed appointment"""
-        return self.db.query(Appointment).filter(
+    def _last_appointments_by_patient(self, patient_ids: List[int]) -> Dict[int, datetime]:
+        """Date of the most recent completed appointment, per patient"""
+        last = self.db.query(
+            Appointment.patient_id,
+            func.max(Appointment.scheduled_datetime)
+        ).filter(
             and_(
-                Appointment.patient_id == patient_id,
+                Appointment.patient_id.in_(patient_ids),
                 Appointment.status == 'completed'
             )
-        ).order_by(Appointment.scheduled_datetime.desc()).first()
+        ).group_by(Appointment.patient_id)
+        
+        return {patient_id: scheduled_datetime for patient_id, scheduled_datetime in last}
     
     def get_patient_journey(self, patient_id: int) -> List[Dict]:
         """Get all care journeys for a patient"""
@@ -185,7 +320,8 @@ class CareMonitoringService:
             CareJourney.patient_id == patient_id
         ).order_by(CareJourney.start_date.desc()).all()
         
-        return [self._format_journey(j) for j in journeys]
+        milestones_by_journey = self._milestones_by_journey([j.id for j in journeys])
+        return [self._format_journey(j, milestones_by_journey.get(j.id, [])) for j in journeys]
     
     def complete_journey(self, journey_id: int, outcomes: Dict) -> bool:
         """Mark a care journey as completed"""
@@ -204,7 +340,8 @@ class CareMonitoringService:
         self.db.commit()
         return True
     
-    def _format_journey(self, journey: CareJourney) -> Dict:
+    def _format_journey(self, journey: CareJourney,
+                        milestones: List[CareJourneyMilestone]) -> Dict:
         """Format care journey for API response"""
         return {
             'id': journey.id,
@@ -213,38 +350,77 @@ class CareMonitoringService:
             'status': journey.status,
             'start_date': journey.start_date.isoformat(),
             'end_date': journey.end_date.isoformat() if journey.end_date else None,
-            'milestones': journey.milestones or [],
+            'milestones': [self._format_milestone(m) for m in milestones],
             'care_gaps': journey.care_gaps or [],
             'outcomes': journey.outcomes or {}
         }
     
-    def get_system_metrics(self) -> Dict:
-        """Calculate and return system-wide metrics"""
+    def _format_milestone(self, milestone: CareJourneyMilestone) -> Dict:
+        """Format a milestone as the entries of the legacy milestones array"""
+        return {
+            'timestamp': milestone.timestamp.isoformat(),
+            'type': milestone.milestone_type,
+            'description': milestone.description,
+            **(milestone.details or {})
+        }
+    
+    def get_system_metrics(self, max_age_seconds: float = 300) -> Dict:
+        """
+        Return system-wide metrics from the latest snapshot
+        
+        A new snapshot is rolled up first when none is younger than
+        max_age_seconds.
+        """
+        snapshot = self.db.query(SystemMetrics).order_by(
+            SystemMetrics.metric_date.desc()
+        ).first()
+        
+        if not snapshot or snapshot.metric_date < datetime.utcnow() - timedelta(seconds=max_age_seconds):
+            snapshot = self.rollup_system_metrics()
+        
+        return self._format_metrics(snapshot)
+    
+    def rollup_system_metrics(self, now: datetime = None) -> SystemMetrics:
+        """
+        Save a SystemMetrics snapshot from the running appointment stats
+        
+        Appointment figures are sums over the daily counters (a few slot
+        rows per day in the window); only patients and active journeys are
+        counted directly.
+        """
+        now = now or datetime.utcnow()
+        
         # Get total patients
         total_patients = self.db.query(Patient).count()
         
-        # Get appointments in last 30 days
-        thirty_days_ago = datetime.utcnow() - timedelta(days=30)
-        recent_appointments = self.db.query(Appointment).filter(
-            Appointment.created_at >= thirty_days_ago
-        ).count()
+        # Appointment totals, and those created in the last 30 days
+        window_start = (now - timedelta(days=30)).date()
+        created, recent_created, recent_completed, recent_wait_hours = self.db.query(
+            func.coalesce(func.sum(AppointmentDailyStats.appointments_created), 0),
+            func.coalesce(func.sum(case(
+                (AppointmentDailyStats.stat_date >= window_start, AppointmentDailyStats.appointments_created),
+                else_=0
+            )), 0),
+            func.coalesce(func.sum(case(
+                (AppointmentDailyStats.stat_date >= window_start, AppointmentDailyStats.appointments_completed),
+                else_=0
+            )), 0),
+            func.coalesce(func.sum(case(
+                (AppointmentDailyStats.stat_date >= window_start, AppointmentDailyStats.completed_wait_hours),
+                else_=0.0
+            )), 0.0)
+        ).one()
         
         # Calculate average wait time
-        completed_appointments = self.db.query(Appointment).filter(
-            and_(
-                Appointment.status == 'completed',
-                Appointment.created_at >= thirty_days_ago
-            )
-        ).all()
+        avg_wait_time = recent_wait_hours / recent_completed if recent_completed else 0
         
-        if completed_appointments:
-            wait_times = [
-                (appt.scheduled_datetime - appt.created_at).total_seconds() / 3600
-                for appt in completed_appointments
-            ]
-            avg_wait_time = sum(wait_times) / len(wait_times)
-        else:
-            avg_wait_time = 0
+        # Wait time distribution over the same window, aggregated in SQL
+        percentiles = {
+            p: (round(hours, 2) if hours is not None else None)
+            for p, hours in completed_wait_percentiles(
+                self.db, datetime.combine(window_start, time.min), (0.5, 0.9)
+            ).items()
+        }
         
         # Calculate reductions (baseline comparison)
         baseline_wait_time = 168  # 7 days in hours
@@ -255,12 +431,118 @@ class CareMonitoringService:
             CareJourney.status == 'active'
         ).count()
         
+        snapshot = SystemMetrics(
+            metric_date=now,
+            total_patients=total_patients,
+            total_appointments=created,
+            recent_appointments=recent_created,
+            active_care_journeys=active_journeys,
+            average_wait_time_hours=round(avg_wait_time, 2),
+            completed_appointments=recent_completed,
+            wait_time_p50_hours=percentiles[0.5],
+            wait_time_p90_hours=percentiles[0.9],
+            wait_time_reduction_percent=round(wait_time_reduction * 100, 2),
+            cost_savings_percent=round(wait_time_reduction * 0.4167, 2)  # Approx 25% at 60% reduction
+        )
+        self.db.add(snapshot)
+        self.db.commit()
+        
+        return snapshot
+    
+    def get_metrics_history(self, since: datetime = None, until: datetime = None,
+                            limit: int = 100) -> List[Dict]:
+        """
+        Metrics snapshots in time order, oldest first
+        
+        With since, the first limit snapshots from that time; otherwise
+        the latest limit snapshots.
+        """
+        query = self.db.query(SystemMetrics)
+        if since:
+            query = query.filter(SystemMetrics.metric_date >= since)
+        if until:
+            query = query.filter(SystemMetrics.metric_date <= until)
+        
+        if since:
+            snapshots = query.order_by(SystemMetrics.metric_date, SystemMetrics.id).limit(limit).all()
+        else:
+            snapshots = query.order_by(
+                SystemMetrics.metric_date.desc(), SystemMetrics.id.desc()
+            ).limit(limit).all()[::-1]
+        return [self._format_metrics(snapshot) for snapshot in snapshots]
+    
+    def _format_metrics(self, snapshot: SystemMetrics) -> Dict:
+        """Format a metrics snapshot for API response"""
         return {
-            'total_patients': total_patients,
-            'recent_appointments': recent_appointments,
-            'average_wait_time_hours': round(avg_wait_time, 2),
-            'wait_time_reduction_percent': round(wait_time_reduction * 100, 2),
-            'cost_savings_percent': round(wait_time_reduction * 0.4167, 2),  # Approx 25% at 60% reduction
-            'active_care_journeys': active_journeys,
-            'system_status': 'operational'
+            'total_patients': snapshot.total_patients,
+            'recent_appointments': snapshot.recent_appointments or 0,
+            'average_wait_time_hours': snapshot.average_wait_time_hours,
+            'completed_appointments': snapshot.completed_appointments or 0,
+            'wait_time_p50_hours': snapshot.wait_time_p50_hours,
+            'wait_time_p90_hours': snapshot.wait_time_p90_hours,
+            'wait_time_reduction_percent': snapshot.wait_time_reduction_percent,
+            'cost_savings_percent': snapshot.cost_savings_percent,
+            'active_care_journeys': snapshot.active_care_journeys or 0,
+            'system_status': 'operational',
+            'as_of': snapshot.metric_date.isoformat()
         }
+
+
+def copy_legacy_milestones(db, chunk_size: int = 1000) -> int:
+    """
+    Copy milestones from the legacy care_journeys.milestones JSON column
+    
+    Run by the migrations until it completes. Journeys are read by keyset
+    in chunks and their milestones bulk inserted in array order; fields
+    other than timestamp, type and description go to details so the
+    formatted milestones are unchanged. Entries already in the table (same
+    journey, timestamp, type and description) are skipped, so an
+    interrupted copy can simply be run again. The legacy column is left in
+    place.
+    
+    Returns:
+        Number of milestones copied
+    """
+    copied = 0
+    after_id = 0
+    
+    while True:
+        journeys = db.query(CareJourney.id, CareJourney.milestones).filter(
+            and_(CareJourney.id > after_id, CareJourney.milestones.isnot(None))
+        ).order_by(CareJourney.id).limit(chunk_size).all()
+        
+        if not journeys:
+            break
+        
+        copied_before = set(db.query(
+            CareJourneyMilestone.journey_id, CareJourneyMilestone.timestamp,
+            CareJourneyMilestone.milestone_type, CareJourneyMilestone.description
+        ).filter(CareJourneyMilestone.journey_id.in_([journey.id for journey in journeys])))
+        
+        rows = []
+        for journey_id, milestones in journeys:
+            for entry in milestones or []:
+                timestamp = datetime.fromisoformat(entry['timestamp'])
+                key = (journey_id, timestamp, entry.get('type'), entry.get('description'))
+                if key in copied_before:
+                    continue
+                details = {
+                    key: value for key, value in entry.items()
+                    if key not in ('timestamp', 'type', 'description')
+                }
+                rows.append({
+                    'journey_id': journey_id,
+                    'timestamp': timestamp,
+                    'milestone_type': entry.get('type'),
+                    'description': entry.get('description'),
+                    'details': details
+                })
+        
+        if rows:
+            db.execute(insert(CareJourneyMilestone), rows)
+        db.commit()
+        
+        copied += len(rows)
+        after_id = journeys[-1].id
+    
+    return copied
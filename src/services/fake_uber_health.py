@@ -0,0 +1,181 @@
+"""
+Local stand-in for the Uber Health ride API
+
+Serves the subset of the API UberHealthClient uses, with configurable
+latency and failures, so the booking pipeline can be exercised offline.
+
+Usage:
+    python -m src.services.fake_uber_health --port 8089 --latency 0.5 --failure-rate 0.2
+    UBER_HEALTH_API_URL=http://127.0.0.1:8089 python src/main.py
+"""
+import argparse
+import itertools
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+
+
+class FakeUberHealth:
+    """
+    Threaded HTTP server answering ride requests
+
+    Args:
+        latency: Seconds to wait before answering each request
+        failure_rate: Fraction of requests answered with failure_status
+        fail_first: Answer this many requests with failure_status first
+        failure_status: HTTP status of failed requests
+        seed: Seed for the failure draw
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency: float = 0.0,
+                 failure_rate: float = 0.0, fail_first: int = 0, failure_status: int = 503,
+                 seed: Optional[int] = None):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.fail_first = fail_first
+        self.failure_status = failure_status
+        self.requests = 0
+        self.connections = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.rides: Dict[str, Dict] = {}
+        self._by_key: Dict[str, str] = {}
+        self._ids = itertools.count(1)
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._thread = None
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        # Clients that time out close their end mid-response; not an error here
+        self.server.handle_error = lambda request, client_address: None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self) -> 'FakeUberHealth':
+        """Serve in a background thread"""
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        if self._thread:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _should_fail(self) -> bool:
+        with self._lock:
+            self.requests += 1
+            if self.requests <= self.fail_first:
+                return True
+            return self._random.random() < self.failure_rate
+
+    def _book(self, body: Dict, idempotency_key: Optional[str]) -> Dict:
+        """The ride for a request, reusing the earlier one for a repeated key"""
+        with self._lock:
+            if idempotency_key in self._by_key:
+                return self.rides[self._by_key[idempotency_key]]
+            ride_id = f'fake-ride-{next(self._ids)}'
+            ride = {
+                'request_id': ride_id,
+                'status': 'confirmed',
+                'pickup': body.get('pickup'),
+                'additional_pickups': body.get('additional_pickups', []),
+                'dropoff': body.get('dropoff'),
+                'scheduled_time': body.get('scheduled_time'),
+                'fare': {'value': 15.50, 'currency_code': 'CAD'},
+                'driver': {'name': 'Fake Driver', 'phone_number': '416-555-0100'},
+                'vehicle': {'make': 'Toyota', 'model': 'Camry', 'license_plate': 'FAKE 123'}
+            }
+            self.rides[ride_id] = ride
+            if idempotency_key:
+                self._by_key[idempotency_key] = ride_id
+            return ride
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # Keep-alive, so connection reuse by clients is observable
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                super().setup()
+                with fake._lock:
+                    fake.connections += 1
+
+            def _send(self, status: int, body: Dict):
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                body = json.loads(self.rfile.read(length) or b'{}')
+                if self.path != '/v1/health/requests':
+                    return self._send(404, {'message': 'Not found'})
+
+                failed = fake._should_fail()
+                with fake._lock:
+                    fake.in_flight += 1
+                    fake.max_in_flight = max(fake.max_in_flight, fake.in_flight)
+                if fake.latency:
+                    time.sleep(fake.latency)
+                with fake._lock:
+                    fake.in_flight -= 1
+                if failed:
+                    return self._send(fake.failure_status, {'message': 'Simulated failure'})
+                if not body.get('pickup'):
+                    return self._send(400, {'message': 'pickup is required'})
+                self._send(200, fake._book(body, self.headers.get('Idempotency-Key')))
+
+            def do_GET(self):
+                prefix = '/v1/health/requests/'
+                ride = fake.rides.get(self.path[len(prefix):]) if self.path.startswith(prefix) else None
+                if ride is None:
+                    return self._send(404, {'message': 'Not found'})
+                self._send(200, ride)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a local Uber Health stand-in')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds per request')
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    parser.add_argument('--failure-status', type=int, default=503)
+    args = parser.parse_args()
+
+    fake = FakeUberHealth(args.host, args.port, latency=args.latency,
+                          failure_rate=args.failure_rate, failure_status=args.failure_status)
+    print(f"Fake Uber Health listening on {fake.url}")
+    try:
+        fake.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        fake.server.server_close()
+
+
+if __name__ == '__main__':
+    main()
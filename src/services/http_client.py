@@ -0,0 +1,265 @@
+"""
+Shared outbound HTTP clients
+
+One pooled, keep-alive requests.Session per named client per process,
+with per-host concurrency limits, default timeouts, a circuit breaker per
+host and latency/failure metrics. Integrations get their client from
+get_http_client() instead of opening their own connections.
+"""
+import threading
+import time
+from collections import deque
+from typing import Dict, Tuple, Union
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+Timeout = Union[float, Tuple[float, float]]
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """Request refused without being sent because the host's circuit is open"""
+
+
+class HostBusyError(requests.exceptions.ConnectionError):
+    """No concurrency slot for the host became free within the timeout"""
+
+
+class CircuitBreaker:
+    """
+    Thread-safe closed / open / half-open circuit breaker
+
+    After failure_threshold consecutive failures the circuit opens and
+    calls are refused for reset_timeout seconds. Then one trial call is let
+    through (half-open): success closes the circuit, failure reopens it.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        if failure_threshold <= 0:
+            raise ValueError('failure_threshold must be positive')
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opens = 0
+        self._state = self.CLOSED
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                return self.HALF_OPEN
+            return self._state
+
+    def allow(self) -> bool:
+        """Whether a call may be made now"""
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    return False
+                self._state = self.HALF_OPEN
+            if self._trial_in_flight:
+                return False
+            self._trial_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._state = self.CLOSED
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_in_flight = False
+            if self._state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    self.opens += 1
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+
+
+class _HostMetrics:
+    """Request counts and recent latencies of one host"""
+
+    def __init__(self, window: int):
+        self.requests = 0
+        self.failures = 0
+        self.rejected = 0
+        self.in_flight = 0
+        self.latencies = deque(maxlen=window)
+
+    def snapshot(self) -> Dict:
+        latencies = sorted(self.latencies)
+
+        def percentile(p):
+            return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000, 2)
+
+        return {
+            'requests': self.requests,
+            'failures': self.failures,
+            'rejected': self.rejected,
+            'in_flight': self.in_flight,
+            'latency_ms': {
+                'p50': percentile(0.5),
+                'p95': percentile(0.95),
+                'max': round(latencies[-1] * 1000, 2)
+            } if latencies else None
+        }
+
+
+class HttpClient:
+    """
+    Pooled HTTP client shared by every caller in the process
+
+    Args:
+        pool_size: Keep-alive connections kept per host
+        max_concurrency: Requests in flight per host; further callers wait
+            for a slot
+        timeout: Default (connect, read) timeout for requests without one
+        acquire_timeout: Seconds to wait for a slot before HostBusyError
+        failure_threshold: Consecutive failures (connection errors,
+            timeouts and 5xx responses) that open a host's circuit
+        reset_timeout: Seconds an open circuit refuses requests
+        latency_window: Recent latencies kept per host for percentiles
+    """
+
+    def __init__(self, pool_size: int = 10, max_concurrency: int = 10,
+                 timeout: Timeout = (3.05, 10), acquire_timeout: float = 10.0,
+                 failure_threshold: int = 5, reset_timeout: float = 30.0,
+                 latency_window: int = 1000):
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.acquire_timeout = acquire_timeout
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.latency_window = latency_window
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self._slots: Dict[str, threading.BoundedSemaphore] = {}
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._metrics: Dict[str, _HostMetrics] = {}
+        self._lock = threading.Lock()
+
+    def _host_state(self, host: str):
+        with self._lock:
+            if host not in self._slots:
+                self._slots[host] = threading.BoundedSemaphore(self.max_concurrency)
+                self._breakers[host] = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+                self._metrics[host] = _HostMetrics(self.latency_window)
+            return self._slots[host], self._breakers[host], self._metrics[host]
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """
+        Send a request through the shared pool
+
+        Raises:
+            CircuitOpenError: The host's circuit is open
+            HostBusyError: No concurrency slot freed up in time
+            requests.RequestException: As raised by requests
+        """
+        host = urlsplit(url).netloc
+        slots, breaker, metrics = self._host_state(host)
+        kwargs.setdefault('timeout', self.timeout)
+
+        if not slots.acquire(timeout=self.acquire_timeout):
+            with self._lock:
+                metrics.rejected += 1
+            raise HostBusyError(f'Too many requests in flight to {host}')
+
+        if not breaker.allow():
+            slots.release()
+            with self._lock:
+                metrics.rejected += 1
+            raise CircuitOpenError(f'Circuit open for {host}')
+
+        with self._lock:
+            metrics.in_flight += 1
+        start = time.perf_counter()
+        failed = True
+        try:
+            response = self.session.request(method, url, **kwargs)
+            failed = response.status_code >= 500
+            return response
+        finally:
+            elapsed = time.perf_counter() - start
+            slots.release()
+            if failed:
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+            with self._lock:
+                metrics.in_flight -= 1
+                metrics.requests += 1
+                metrics.failures += failed
+                metrics.latencies.append(elapsed)
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request('POST', url, **kwargs)
+
+    def stats(self) -> Dict[str, Dict]:
+        """Per-host metrics and circuit state"""
+        with self._lock:
+            hosts = list(self._metrics)
+        return {
+            host: {
+                **self._metrics[host].snapshot(),
+                'circuit': self._breakers[host].state,
+                'circuit_opens': self._breakers[host].opens
+            }
+            for host in hosts
+        }
+
+    def close(self):
+        self.session.close()
+
+
+_clients: Dict[str, HttpClient] = {}
+_clients_lock = threading.Lock()
+
+
+def get_http_client(name: str = 'default', **config) -> HttpClient:
+    """
+    The process-wide client registered under name
+
+    The first call for a name creates the client with config; later calls
+    return the same client and ignore config.
+    """
+    with _clients_lock:
+        client = _clients.get(name)
+        if client is None:
+            client = _clients[name] = HttpClient(**config)
+        return client
+
+
+def http_client_stats() -> Dict[str, Dict]:
+    """Stats of every registered client, by name"""
+    with _clients_lock:
+        clients = dict(_clients)
+    return {name: client.stats() for name, client in clients.items()}
+
+
+def close_http_clients():
+    """Close and forget every registered client"""
+    with _clients_lock:
+        clients = list(_clients.values())
+        _clients.clear()
+    for client in clients:
+        client.close()
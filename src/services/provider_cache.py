@@ -0,0 +1,107 @@
+"""
+Read-through cache for provider details and directory searches
+"""
+import json
+import threading
+import uuid
+from typing import Callable, Dict, Iterable, Optional
+
+
+class ProviderCache:
+    """
+    Read-through cache in front of ProviderService lookups
+
+    Details are cached per provider and deleted when that provider changes.
+    A search page can contain any provider, so search keys embed a
+    generation token that is replaced on every change, orphaning all cached
+    pages at once; they then age out of the backend. The token lives in the
+    backend itself so processes sharing a Redis backend agree on it.
+
+    Search pages are built from per-process indexes, so a generation this
+    process has not seen yet means another process changed providers: the
+    on_new_generation hook runs before the page is loaded so those indexes
+    are refreshed rather than cached stale under the new token.
+    """
+
+    GENERATION_KEY = 'providers:generation'
+
+    def __init__(self, backend=None, on_new_generation: Callable[[], None] = None):
+        """
+        Args:
+            backend: LRUCache or RedisCache; None disables caching
+            on_new_generation: Called when a search first sees a new generation
+        """
+        self.backend = backend
+        self.on_new_generation = on_new_generation
+        self._seen_generation: Optional[str] = None
+        self._counters = {'detail': [0, 0], 'search': [0, 0]}
+        self._lock = threading.Lock()
+
+    def get_provider(self, provider_id: int, loader: Callable[[], Optional[Dict]]) -> Optional[Dict]:
+        """Cached provider details, loading and storing them on a miss"""
+        return self._read_through('detail', f'provider:{provider_id}', loader)
+
+    def search(self, params: Dict, loader: Callable[[], Dict]) -> Dict:
+        """
+        Cached search page for normalized search parameters
+
+        Args:
+            params: Search arguments; equal dicts must mean equal results
+            loader: Runs the search on a miss
+        """
+        if self.backend is None:
+            return loader()
+        generation = self._generation()
+        if generation != self._seen_generation:
+            self._seen_generation = generation
+            if self.on_new_generation is not None:
+                self.on_new_generation()
+        key = 'providers:search:{}:{}'.format(
+            generation, json.dumps(params, sort_keys=True, separators=(',', ':'))
+        )
+        return self._read_through('search', key, loader)
+
+    def invalidate(self, provider_ids: Iterable[int]):
+        """Drop cached details of changed providers and all cached searches"""
+        if self.backend is None:
+            return
+        for provider_id in provider_ids:
+            self.backend.delete(f'provider:{provider_id}')
+        self.backend.set(self.GENERATION_KEY, uuid.uuid4().hex)
+
+    def _generation(self) -> str:
+        generation = self.backend.get(self.GENERATION_KEY)
+        if generation is None:
+            # Evicted or expired: start a new generation rather than risk
+            # reviving pages cached under an older one
+            generation = uuid.uuid4().hex
+            self.backend.set(self.GENERATION_KEY, generation)
+        return generation
+
+    def _read_through(self, kind: str, key: str, loader: Callable):
+        if self.backend is None:
+            return loader()
+
+        value = self.backend.get(key)
+        with self._lock:
+            self._counters[kind][0 if value is not None else 1] += 1
+        if value is None:
+            value = loader()
+            # Not-found results are not cached
+            if value is not None:
+                self.backend.set(key, value)
+        return value
+
+    def stats(self) -> Dict:
+        """Hit ratios for detail and search lookups, plus backend counters"""
+        with self._lock:
+            stats = {}
+            for kind, (hits, misses) in self._counters.items():
+                lookups = hits + misses
+                stats[kind] = {
+                    'hits': hits,
+                    'misses': misses,
+                    'hit_ratio': round(hits / lookups, 4) if lookups else 0.0
+                }
+        stats['backend'] = self.backend.stats() if self.backend is not None else None
+        return stats
@@ -0,0 +1,246 @@
+"""
+Bitmap calendars for provider slot availability
+
+Each provider's schedule over a rolling horizon is held as two integer
+bitmaps of 30-minute slots (bit i = slot i from midnight of the origin day):
+one for slots the provider works, one for slots already booked. Finding the
+next free slot is a mask and a lowest-set-bit scan instead of datetime
+arithmetic per candidate slot.
+"""
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import and_
+
+from src.database.models import Appointment, ProviderAvailability
+
+SLOT_MINUTES = 30
+SLOTS_PER_DAY = 24 * 60 // SLOT_MINUTES
+
+
+class ProviderCalendar:
+    """
+    Working and booked 30-minute slots for one provider
+    """
+
+    def __init__(self, provider_id: int, origin: datetime, days: int,
+                 availability: List[ProviderAvailability]):
+        """
+        Args:
+            provider_id: Provider ID
+            origin: Midnight of the first day covered
+            days: Number of days covered
+            availability: Available ProviderAvailability rows, in ID order
+        """
+        self.provider_id = provider_id
+        self.origin = origin
+        self.days = days
+        self.built_at = time.monotonic()
+        self.available = self._build_available(availability)
+        self.occupied = 0
+
+    def _build_available(self, availability: List[ProviderAvailability]) -> int:
+        """Expand the weekly availability template over the horizon"""
+        # The first row per weekday wins; hours are whole-hour bounds
+        day_masks = {}
+        for avail in availability:
+            if avail.day_of_week in day_masks:
+                continue
+            start_hour = int(avail.start_time.split(':')[0])
+            end_hour = int(avail.end_time.split(':')[0])
+            first = start_hour * 60 // SLOT_MINUTES
+            last = end_hour * 60 // SLOT_MINUTES
+            day_masks[avail.day_of_week] = ((1 << last) - 1) & ~((1 << first) - 1) if last > first else 0
+
+        mask = 0
+        for day in range(self.days):
+            weekday = (self.origin + timedelta(days=day)).weekday()
+            day_mask = day_masks.get(weekday)
+            if day_mask:
+                mask |= day_mask << (day * SLOTS_PER_DAY)
+        return mask
+
+    def slot_index(self, moment: datetime) -> int:
+        """Index of the slot containing moment"""
+        return int((moment - self.origin).total_seconds() // (SLOT_MINUTES * 60))
+
+    def slot_time(self, index: int) -> datetime:
+        """Start time of a slot"""
+        return self.origin + timedelta(minutes=index * SLOT_MINUTES)
+
+    def _span_mask(self, start: datetime, duration_minutes: int) -> int:
+        """Bitmask of the slots an appointment covers"""
+        first = self.slot_index(start)
+        count = max(1, -(-(duration_minutes or SLOT_MINUTES) // SLOT_MINUTES))
+        if first + count <= 0 or first >= self.days * SLOTS_PER_DAY:
+            return 0
+        mask = (1 << count) - 1
+        return mask << first if first >= 0 else mask >> -first
+
+    def book(self, start: datetime, duration_minutes: int = SLOT_MINUTES):
+        """Mark the slots covered by an appointment as occupied"""
+        self.occupied |= self._span_mask(start, duration_minutes)
+
+    def release(self, start: datetime, duration_minutes: int = SLOT_MINUTES):
+        """Mark the slots covered by a cancelled appointment as free"""
+        self.occupied &= ~self._span_mask(start, duration_minutes)
+
+    def next_free_slot(self, after: datetime, end_day: int) -> Optional[datetime]:
+        """
+        Earliest free slot starting strictly after a moment
+
+        Args:
+            after: Slots must start after this time
+            end_day: Last day offset (from origin) that may be returned
+        """
+        first = self.slot_index(after) + 1
+        limit = min(end_day + 1, self.days) * SLOTS_PER_DAY
+        if first >= limit:
+            return None
+
+        free = (self.available & ~self.occupied) >> max(first, 0)
+        if not free:
+            return None
+
+        index = max(first, 0) + (free & -free).bit_length() - 1
+        return self.slot_time(index) if index < limit else None
+
+
+class CalendarIndex:
+    """
+    Process-wide cache of provider calendars
+
+    Calendars are built in bulk from ProviderAvailability and Appointment
+    rows, updated incrementally on booking and cancellation, and rebuilt when
+    the day rolls over or they are older than max_age seconds (to pick up
+    changes made by other processes).
+    """
+
+    def __init__(self, horizon_days: int = 32, max_age: float = 300.0,
+                 chunk_size: int = 5000):
+        self.horizon_days = horizon_days
+        self.max_age = max_age
+        self.chunk_size = chunk_size
+        self._calendars: Dict[int, ProviderCalendar] = {}
+        self._lock = threading.Lock()
+
+    def get_calendars(self, db, provider_ids: Iterable[int],
+                      now: datetime = None) -> Dict[int, ProviderCalendar]:
+        """
+        Return calendars for providers, loading missing or stale ones
+
+        Providers without any available days are omitted.
+        """
+        now = now or datetime.now()
+        origin = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        expiry = time.monotonic() - self.max_age
+
+        calendars = {}
+        stale = []
+        with self._lock:
+            for provider_id in provider_ids:
+                calendar = self._calendars.get(provider_id)
+                if calendar and calendar.origin == origin and calendar.built_at >= expiry:
+                    calendars[provider_id] = calendar
+                else:
+                    stale.append(provider_id)
+
+        if stale:
+            loaded = self._load(db, stale, origin)
+            with self._lock:
+                for provider_id in stale:
+                    calendar = loaded.get(provider_id)
+                    if calendar:
+                        self._calendars[provider_id] = calendar
+                        calendars[provider_id] = calendar
+                    else:
+                        self._calendars.pop(provider_id, None)
+
+        return calendars
+
+    def _load(self, db, provider_ids: List[int],
+              origin: datetime) -> Dict[int, ProviderCalendar]:
+        """Build calendars with one availability and one appointment query per chunk"""
+        horizon_end = origin + timedelta(days=self.horizon_days)
+        calendars = {}
+
+        for i in range(0, len(provider_ids), self.chunk_size):
+            chunk = provider_ids[i:i + self.chunk_size]
+
+            availability = db.query(ProviderAvailability).filter(
+                and_(
+                    ProviderAvailability.provider_id.in_(chunk),
+                    ProviderAvailability.is_available == True
+                )
+            ).order_by(ProviderAvailability.id).all()
+
+            rows_by_provider = {}
+            for avail in availability:
+                rows_by_provider.setdefault(avail.provider_id, []).append(avail)
+
+            for provider_id, rows in rows_by_provider.items():
+                calendars[provider_id] = ProviderCalendar(
+                    provider_id, origin, self.horizon_days, rows
+                )
+
+            if not rows_by_provider:
+                continue
+
+            booked = db.query(
+                Appointment.provider_id,
+                Appointment.scheduled_datetime,
+                Appointment.duration_minutes
+            ).filter(
+                and_(
+                    Appointment.provider_id.in_(list(rows_by_provider)),
+                    Appointment.scheduled_datetime >= origin,
+                    Appointment.scheduled_datetime < horizon_end,
+                    Appointment.status.in_(['scheduled', 'confirmed'])
+                )
+            )
+
+            for provider_id, scheduled_datetime, duration in booked:
+                calendars[provider_id].book(scheduled_datetime, duration)
+
+        return calendars
+
+    def record_booking(self, provider_id: int, start: datetime,
+                       duration_minutes: int = SLOT_MINUTES):
+        """Reflect a new appointment in a cached calendar"""
+        with self._lock:
+            calendar = self._calendars.get(provider_id)
+            if calendar:
+                calendar.book(start, duration_minutes)
+
+    def record_cancellation(self, provider_id: int, start: datetime,
+                            duration_minutes: int = SLOT_MINUTES):
+        """Reflect a cancelled appointment in a cached calendar"""
+        with self._lock:
+            calendar = self._calendars.get(provider_id)
+            if calendar:
+                calendar.release(start, duration_minutes)
+
+    def invalidate(self, provider_id: int = None):
+        """Drop one provider's calendar, or all calendars"""
+        with self._lock:
+            if provider_id is None:
+                self._calendars.clear()
+            else:
+                self._calendars.pop(provider_id, None)
+
+    def next_free_slots(self, db, provider_ids: List[int], now: datetime,
+                        search_days: int) -> Dict[int, datetime]:
+        """Earliest free slot per provider within search_days of today"""
+        calendars = self.get_calendars(db, provider_ids, now)
+        slots = {}
+        with self._lock:
+            for provider_id, calendar in calendars.items():
+                slot = calendar.next_free_slot(now, search_days)
+                if slot:
+                    slots[provider_id] = slot
+        return slots
+
+    def __len__(self) -> int:
+        return len(self._calendars)
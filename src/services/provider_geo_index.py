@@ -0,0 +1,201 @@
+"""
+In-process geospatial index over provider coordinates
+
+Providers are bucketed into a fixed latitude/longitude grid so radius and
+k-nearest queries only visit cells near the query point, with exact
+haversine distances computed for the candidates in those cells.
+"""
+import math
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple
+
+from src.database.models import Provider
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE_LAT = math.pi * EARTH_RADIUS_KM / 180
+# No two points are further apart than half the circumference
+MAX_RADIUS_KM = math.pi * EARTH_RADIUS_KM
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Great-circle distance between two points in kilometres"""
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def parse_location(location) -> Optional[Tuple[float, float]]:
+    """
+    Parse a location given as "lat,lng" or a dict with latitude/longitude
+
+    Returns:
+        (latitude, longitude), or None if the value has no usable coordinates
+    """
+    if isinstance(location, dict):
+        lat = location.get('latitude', location.get('lat'))
+        lon = location.get('longitude', location.get('lng', location.get('lon')))
+    elif isinstance(location, str) and ',' in location:
+        lat, _, lon = location.partition(',')
+    else:
+        return None
+
+    try:
+        lat, lon = float(lat), float(lon)
+    except (TypeError, ValueError):
+        return None
+
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        return None
+    return lat, lon
+
+
+class ProviderGeoIndex:
+    """
+    Grid index of provider locations supporting radius and k-nearest queries
+
+    The index is kept current incrementally: sync() loads only providers
+    whose updated_at moved past the last sync, and upsert()/remove() apply
+    individual changes directly. Deletions leave no updated_at behind, so
+    the owner removes deleted providers as their commits are reported (see
+    track_provider_changes). A point left behind by a delete elsewhere only
+    names a row the SQL queries it feeds no longer return.
+    """
+
+    def __init__(self, cell_degrees: float = 0.1, refresh_interval: float = 60.0):
+        """
+        Args:
+            cell_degrees: Grid cell size in degrees (0.1 is roughly 11 km)
+            refresh_interval: Minimum seconds between incremental syncs
+        """
+        self.cell_degrees = cell_degrees
+        self.refresh_interval = refresh_interval
+        self._lon_cells = int(round(360 / cell_degrees))
+        self._cells: Dict[Tuple[int, int], Set[int]] = {}
+        self._points: Dict[int, Tuple[float, float]] = {}
+        self._watermark: Optional[datetime] = None
+        self._last_sync: Optional[float] = None
+        self._lock = threading.RLock()
+
+    def _cell(self, lat: float, lon: float) -> Tuple[int, int]:
+        return (
+            int(math.floor(lat / self.cell_degrees)),
+            int(math.floor((lon + 180) / self.cell_degrees)) % self._lon_cells
+        )
+
+    def upsert(self, provider_id: int, latitude: float, longitude: float):
+        """Add or move a provider; providers without coordinates are removed"""
+        with self._lock:
+            self.remove(provider_id)
+            if latitude is None or longitude is None:
+                return
+            self._points[provider_id] = (latitude, longitude)
+            self._cells.setdefault(self._cell(latitude, longitude), set()).add(provider_id)
+
+    def remove(self, provider_id: int):
+        """Drop a provider from the index"""
+        with self._lock:
+            point = self._points.pop(provider_id, None)
+            if point is None:
+                return
+            cell = self._cell(*point)
+            members = self._cells.get(cell)
+            if members:
+                members.discard(provider_id)
+                if not members:
+                    del self._cells[cell]
+
+    def sync(self, db, force: bool = False):
+        """Load providers created or changed since the last sync"""
+        now = time.monotonic()
+        if not force and self._last_sync is not None and now - self._last_sync < self.refresh_interval:
+            return
+
+        with self._lock:
+            query = db.query(
+                Provider.id, Provider.latitude, Provider.longitude, Provider.updated_at
+            )
+            if self._watermark is not None:
+                # Inclusive so rows sharing the watermark timestamp are not missed
+                query = query.filter(Provider.updated_at >= self._watermark)
+
+            for provider_id, latitude, longitude, updated_at in query:
+                self.upsert(provider_id, latitude, longitude)
+                if updated_at and (self._watermark is None or updated_at > self._watermark):
+                    self._watermark = updated_at
+
+            self._last_sync = now
+
+    def expire(self):
+        """Make the next sync() look for changes regardless of refresh_interval"""
+        self._last_sync = None
+
+    def within_radius(self, latitude: float, longitude: float,
+                      radius_km: float) -> List[Tuple[int, float]]:
+        """
+        Providers within radius_km of a point
+
+        Returns:
+            (provider_id, distance_km) pairs, nearest first
+        """
+        radius_km = min(radius_km, MAX_RADIUS_KM)
+        lat_span = radius_km / KM_PER_DEGREE_LAT
+        min_row = int(math.floor((latitude - lat_span) / self.cell_degrees))
+        max_row = int(math.floor((latitude + lat_span) / self.cell_degrees))
+
+        # Longitude degrees shrink towards the poles; widest at the band edge
+        max_abs_lat = min(90.0, abs(latitude) + lat_span)
+        cos_lat = math.cos(math.radians(max_abs_lat))
+        if cos_lat < 1e-9 or radius_km / (KM_PER_DEGREE_LAT * cos_lat) >= 180:
+            columns = range(self._lon_cells)
+        else:
+            lon_span = radius_km / (KM_PER_DEGREE_LAT * cos_lat)
+            first = int(math.floor((longitude - lon_span + 180) / self.cell_degrees))
+            last = int(math.floor((longitude + lon_span + 180) / self.cell_degrees))
+            columns = {c % self._lon_cells for c in range(first, last + 1)}
+
+        rows = range(min_row, max_row + 1)
+        results = []
+        with self._lock:
+            # Large radii: walking occupied cells beats probing empty ones
+            if len(rows) * len(columns) > len(self._cells):
+                columns = set(columns)
+                cells = [
+                    members for (row, column), members in self._cells.items()
+                    if min_row <= row <= max_row and column in columns
+                ]
+            else:
+                cells = [self._cells.get((row, column), ()) for row in rows for column in columns]
+
+            for members in cells:
+                for provider_id in members:
+                    lat, lon = self._points[provider_id]
+                    distance = haversine_km(latitude, longitude, lat, lon)
+                    if distance <= radius_km:
+                        results.append((provider_id, distance))
+
+        results.sort(key=lambda item: (item[1], item[0]))
+        return results
+
+    def nearest(self, latitude: float, longitude: float, k: int,
+                max_radius_km: float = None) -> List[Tuple[int, float]]:
+        """
+        The k providers closest to a point
+
+        Searches expanding radii; once at least k providers fall inside a
+        radius, no provider outside it can be closer.
+        """
+        limit = min(max_radius_km or MAX_RADIUS_KM, MAX_RADIUS_KM)
+        radius = min(limit, self.cell_degrees * KM_PER_DEGREE_LAT)
+        while True:
+            results = self.within_radius(latitude, longitude, radius)
+            if len(results) >= k or radius >= limit:
+                return results[:k]
+            radius = min(limit, radius * 2)
+
+    def __len__(self) -> int:
+        return len(self._points)
@@ -0,0 +1,237 @@
+"""
+Provider directory search and detail lookups
+"""
+import base64
+import binascii
+import json
+from typing import Dict, List, Optional, Sequence
+from sqlalchemy.orm import Session
+from sqlalchemy import and_, or_
+
+from src.database.models import Provider
+from src.services.provider_geo_index import ProviderGeoIndex, parse_location
+from src.services.provider_text_index import similar_providers, substring_filter, word_prefix_filter
+
+# Response field -> Provider column
+PROVIDER_FIELDS = {
+    'id': 'id',
+    'name': 'name',
+    'specialty': 'specialty',
+    'phone': 'phone',
+    'address': 'address',
+    'rating': 'rating',
+    'totalReviews': 'total_reviews',
+    'waitTime': 'average_wait_time_days',
+    'acceptsNewPatients': 'accepts_new_patients'
+}
+
+def encode_cursor(order: str, key: Sequence) -> str:
+    """Opaque cursor pointing just past the row with this sort key"""
+    payload = json.dumps({'o': order, 'k': list(key)}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str, order: str, size: int) -> List:
+    """Sort key from a cursor issued for the same ordering"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        key = payload['k']
+        valid = payload['o'] == order and isinstance(key, list) and len(key) == size and all(
+            isinstance(value, (int, float)) and not isinstance(value, bool) for value in key
+        )
+    except (binascii.Error, ValueError, TypeError, KeyError):
+        valid = False
+
+    if not valid:
+        raise ValueError('Invalid cursor')
+    return key
+
+
+class ProviderService:
+    """
+    Search the provider directory and look up provider details
+    """
+
+    DEFAULT_RADIUS_KM = 25
+    MAX_PAGE_SIZE = 100
+
+    # Most similar providers, among those passing the other filters,
+    # considered for a fuzzy search
+    FUZZY_SEARCH_CANDIDATES = 200
+
+    def __init__(self, db_session: Session, geo_index: ProviderGeoIndex = None):
+        """
+        Args:
+            db_session: Database session
+            geo_index: Shared provider location index (built on demand if omitted)
+        """
+        self.db = db_session
+        # Empty indexes are falsy, so test for None to keep a shared one
+        self.geo_index = geo_index if geo_index is not None else ProviderGeoIndex()
+
+    def search_providers(self, specialty: str = None, search: str = None,
+                         fuzzy: bool = False, location: str = None,
+                         radius_km: float = None, available: bool = True,
+                         limit: int = 20, cursor: str = None,
+                         fields: List[str] = None) -> Dict:
+        """
+        Search providers one page at a time
+
+        Results are ordered by rating (best first), then wait time, then ID,
+        and paged by keyset so later pages cost the same as the first. A
+        location ranks by distance and a fuzzy search by match quality
+        before that order.
+
+        Args:
+            specialty: Case-insensitive substring of the specialty
+            search: Word prefix of the name or specialty
+            fuzzy: Match search by trigram similarity instead of prefix
+            location: "lat,lng" to search around; free text is ignored
+            radius_km: Search radius around location
+            available: Only providers accepting new patients
+            limit: Page size (1 to MAX_PAGE_SIZE)
+            cursor: nextCursor from the previous page
+            fields: Response fields to include (default: all)
+
+        Returns:
+            Page of providers and the cursor of the next page (None at the end)
+
+        Raises:
+            ValueError: If limit, fields or cursor are invalid
+        """
+        if not 1 <= limit <= self.MAX_PAGE_SIZE:
+            raise ValueError(f'limit must be between 1 and {self.MAX_PAGE_SIZE}')
+
+        fields = list(fields or PROVIDER_FIELDS)
+        unknown = [field for field in fields if field not in PROVIDER_FIELDS]
+        if unknown:
+            raise ValueError(f"Unknown field(s): {', '.join(unknown)}")
+
+        # Only the requested columns plus the sort key are loaded
+        columns = {'id', 'rating', 'average_wait_time_days'}
+        columns.update(PROVIDER_FIELDS[field] for field in fields)
+        query = self.db.query(*(getattr(Provider, column) for column in sorted(columns)))
+
+        # Text filters read the database's own text indexes
+        if specialty:
+            query = query.filter(substring_filter(self.db, 'specialty', specialty))
+        if search and not fuzzy:
+            query = query.filter(word_prefix_filter(self.db, search))
+
+        if available:
+            query = query.filter(Provider.accepts_new_patients == True)
+
+        rank = None
+        point = parse_location(location)
+        if point:
+            order = 'distance'
+            self.geo_index.sync(self.db)
+            rank = dict(self.geo_index.within_radius(
+                point[0], point[1], radius_km or self.DEFAULT_RADIUS_KM
+            ))
+            query = query.filter(Provider.id.in_(list(rank)))
+
+        # Candidates are cut only after every other filter has applied
+        if search and fuzzy:
+            similarity = similar_providers(query, search, self.FUZZY_SEARCH_CANDIDATES)
+            query = query.filter(Provider.id.in_(list(similarity)))
+            if rank is None:
+                order = 'similarity'
+                rank = {provider_id: -score for provider_id, score in similarity.items()}
+
+        if rank is None:
+            order = 'rating'
+            after = decode_cursor(cursor, order, 5) if cursor else None
+            rows = self._rating_page(query, after, limit + 1)
+            keys = [self._sort_key(row) for row in rows]
+        else:
+            after = decode_cursor(cursor, order, 6) if cursor else None
+            ranked = sorted(
+                ([rank[row.id]] + self._sort_key(row), row) for row in query
+            )
+            if after is not None:
+                ranked = [item for item in ranked if item[0] > after]
+            keys = [key for key, _ in ranked[:limit + 1]]
+            rows = [row for _, row in ranked[:limit + 1]]
+
+        next_cursor = encode_cursor(order, keys[limit - 1]) if len(rows) > limit else None
+
+        providers = []
+        for row in rows[:limit]:
+            provider = self._format_fields(row, fields)
+            if order == 'distance':
+                provider['distanceKm'] = round(rank[row.id], 2)
+            if search and fuzzy:
+                provider['matchScore'] = round(similarity[row.id], 3)
+            providers.append(provider)
+
+        return {'providers': providers, 'nextCursor': next_cursor}
+
+    def get_provider(self, provider_id: int) -> Optional[Dict]:
+        """Get details for a specific provider"""
+        provider = self.db.query(Provider).filter(Provider.id == provider_id).first()
+
+        if not provider:
+            return None
+
+        return {
+            'id': provider.id,
+            'name': provider.name,
+            'specialty': provider.specialty,
+            'phone': provider.phone,
+            'email': provider.email,
+            'address': provider.address,
+            'rating': provider.rating,
+            'totalReviews': provider.total_reviews,
+            'waitTime': f'{provider.average_wait_time_days} days',
+            'acceptsNewPatients': provider.accepts_new_patients
+        }
+
+    def _rating_page(self, query, after: Optional[List], size: int) -> List:
+        """
+        Rows after a keyset position in directory order
+
+        Rating descending, then wait ascending, then ID, with unrated
+        providers and unknown waits last. The raw columns and their IS NULL
+        flags match ix_providers_rating_wait_id, so the page is read in
+        index order.
+        """
+        rating, wait = Provider.rating, Provider.average_wait_time_days
+
+        if after is not None:
+            rating_null, neg_rating, wait_null, after_wait, after_id = after
+            later = Provider.id > after_id
+            if wait_null:
+                later = and_(wait.is_(None), later)
+            else:
+                later = or_(wait.is_(None), wait > after_wait, and_(wait == after_wait, later))
+            if rating_null:
+                later = and_(rating.is_(None), later)
+            else:
+                later = or_(rating.is_(None), rating < -neg_rating,
+                            and_(rating == -neg_rating, later))
+            query = query.filter(later)
+
+        return query.order_by(
+            rating.is_(None), rating.desc(), wait.is_(None), wait.asc(), Provider.id.asc()
+        ).limit(size).all()
+
+    @staticmethod
+    def _sort_key(row) -> List:
+        """Ascending sort key matching the SQL order, NULLs flagged to sort last"""
+        rating, wait = row.rating, row.average_wait_time_days
+        return [
+            int(rating is None), -rating if rating is not None else 0.0,
+            int(wait is None), wait if wait is not None else 0.0,
+            row.id
+        ]
+
+    @staticmethod
+    def _format_fields(row, fields: List[str]) -> Dict:
+        """Response dict with only the requested fields"""
+        provider = {}
+        for field in fields:
+            value = getattr(row, PROVIDER_FIELDS[field])
+            provider[field] = f'{value} days' if field == 'waitTime' else value
+        return provider
@@ -0,0 +1,106 @@
+"""
+Provider name and specialty search on the database's text indexes
+
+Substring and word prefix filters read providers_fts on SQLite and the
+pg_trgm GIN indexes on PostgreSQL (see src/database/text_search.py), so
+they never scan the providers table and always see committed rows. Fuzzy
+matches are ranked by word-trigram similarity as pg_trgm defines it:
+PostgreSQL scores them with its own similarity() and % operator, other
+databases score the rows left by the other filters here.
+"""
+import re
+from typing import Dict, Set
+
+from sqlalchemy import func, or_, select
+from sqlalchemy.sql import column, table
+
+from src.database.models import Provider
+from src.database.text_search import FTS_TABLE
+
+# pg_trgm's default similarity_threshold, which its % operator uses
+SIMILARITY_THRESHOLD = 0.3
+
+FIELDS = ('name', 'specialty')
+
+_ASCII_LOWER = str.maketrans('ABCDEFGHIJKLMNOPQRSTUVWXYZ', 'abcdefghijklmnopqrstuvwxyz')
+_WORD = re.compile(r'[^\W_]+')
+
+_fts = table(FTS_TABLE, column('rowid'), *(column(field) for field in FIELDS))
+
+
+def fold(text: str) -> str:
+    """Lower-case ASCII letters only, as SQLite's ILIKE does"""
+    return text.translate(_ASCII_LOWER)
+
+
+def trigrams(text: str) -> Set[str]:
+    """Every three-character substring of a folded string"""
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def word_trigrams(text: str) -> Set[str]:
+    """Trigrams of each word padded pg_trgm-style ("  w", " wo", ..., "rd ")"""
+    grams = set()
+    for word in _WORD.findall(text.lower()):
+        grams |= trigrams(f'  {word} ')
+    return grams
+
+
+def similarity(grams: Set[str], text: str) -> float:
+    """Word trigrams shared with text over the union of both trigram sets"""
+    other = word_trigrams(text or '')
+    if not grams or not other:
+        return 0.0
+    shared = len(grams & other)
+    return shared / (len(grams) + len(other) - shared)
+
+
+def _like_any(db, patterns: Dict[str, tuple]):
+    """Providers where any field matches any of its LIKE patterns"""
+    if db.get_bind().dialect.name == 'sqlite':
+        matches = select(_fts.c.rowid).where(or_(*(
+            _fts.c[field].like(pattern)
+            for field, field_patterns in patterns.items() for pattern in field_patterns
+        )))
+        return Provider.id.in_(matches)
+    return or_(*(
+        getattr(Provider, field).ilike(pattern)
+        for field, field_patterns in patterns.items() for pattern in field_patterns
+    ))
+
+
+def substring_filter(db, field: str, value: str):
+    """Case-insensitive substring match on one field"""
+    return _like_any(db, {field: (f'%{value}%',)})
+
+
+def word_prefix_filter(db, value: str):
+    """Case-insensitive word prefix match on the name or specialty"""
+    return _like_any(db, {field: (f'{value}%', f'% {value}%') for field in FIELDS})
+
+
+def similar_providers(query, search: str, limit: int) -> Dict[int, float]:
+    """
+    Providers of an already filtered query similar to search, with scores
+
+    Each provider scores its best field; only the limit best (ties by ID)
+    at or above SIMILARITY_THRESHOLD are returned.
+    """
+    db = query.session
+    if db.get_bind().dialect.name == 'postgresql':
+        scores = [func.coalesce(func.similarity(getattr(Provider, field), search), 0)
+                  for field in FIELDS]
+        score = func.greatest(*scores)
+        rows = query.with_entities(Provider.id, score).filter(
+            # % is what the GIN indexes serve; the score check pins the threshold
+            or_(*(getattr(Provider, field).op('%')(search) for field in FIELDS)),
+            score >= SIMILARITY_THRESHOLD
+        ).order_by(score.desc(), Provider.id).limit(limit)
+        return {provider_id: float(value) for provider_id, value in rows}
+
+    grams, scored = word_trigrams(search), []
+    for row in query.with_entities(Provider.id, *(getattr(Provider, field) for field in FIELDS)):
+        score = max(similarity(grams, getattr(row, field)) for field in FIELDS)
+        if score >= SIMILARITY_THRESHOLD:
+            scored.append((-score, row.id))
+    return {provider_id: -score for score, provider_id in sorted(scored)[:limit]}
@@ -0,0 +1,189 @@
+"""
+Background ride booking
+
+Transportation rows are saved as ``pending`` by the request that books
+them; a worker pool then calls the ride provider and records the outcome,
+so API workers never wait on the provider's round trip. The queue lives in
+memory, so rows left pending by a crash or restart are picked up again by
+the recovery sweep.
+"""
+import logging
+import random
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Callable, List, Optional
+
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+
+from src.database.models import Transportation
+from src.services.uber_health_client import RideProviderError
+
+logger = logging.getLogger(__name__)
+
+
+class RideDispatcher:
+    """
+    Books pending rides on a thread pool with retries and backoff
+
+    Each booking uses its own session from session_factory; a shared ride
+    is one provider request for several rows, its cost split evenly. Failed
+    attempts are retried after a jittered exponential backoff unless the
+    provider rejected the request outright; a ride still unbooked after
+    max_attempts is marked ``failed`` with the last error.
+
+    Args:
+        session_factory: Callable returning a new database session
+        client: Ride provider client with request_ride()
+        max_workers: Concurrent bookings
+        max_attempts: Provider calls per booking
+        backoff_seconds: Base delay before the second attempt
+        max_backoff_seconds: Upper bound on any delay
+    """
+
+    def __init__(self, session_factory: Callable[[], Session], client, max_workers: int = 4,
+                 max_attempts: int = 3, backoff_seconds: float = 0.5,
+                 max_backoff_seconds: float = 8.0):
+        self.session_factory = session_factory
+        self.client = client
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='ride-booking')
+        self._queued = set()
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._recovery = None
+
+    def submit(self, transportation_id: int) -> Future:
+        """
+        Book a pending ride in the background
+
+        The future yields the status written, or None if the row was no
+        longer pending.
+        """
+        return self._submit([transportation_id])
+
+    def submit_shared(self, transportation_ids: List[int]) -> Future:
+        """Book one ride for several pending rows going to the same place"""
+        return self._submit(list(transportation_ids))
+
+    def _submit(self, transportation_ids: List[int]) -> Future:
+        with self._lock:
+            self._queued.update(transportation_ids)
+        future = self.executor.submit(self._book, transportation_ids)
+        future.add_done_callback(lambda _: self._forget(transportation_ids))
+        return future
+
+    def _forget(self, transportation_ids: List[int]):
+        with self._lock:
+            self._queued.difference_update(transportation_ids)
+
+    def resubmit_pending(self, grace_seconds: float = 300) -> List[Future]:
+        """
+        Queue rides that have been pending for longer than grace_seconds
+
+        Picks up bookings lost from the in-memory queue of a process that
+        crashed or restarted. Shared rides are re-queued as one booking.
+        Rides still queued here are skipped; ones another live process is
+        booking are safe to repeat, as the Idempotency-Key makes the
+        provider return the same ride.
+        """
+        cutoff = datetime.utcnow() - timedelta(seconds=grace_seconds)
+        db = self.session_factory()
+        try:
+            rows = db.query(Transportation.id, Transportation.booking_group_id).filter(
+                Transportation.status == 'pending',
+                Transportation.created_at <= cutoff
+            ).order_by(Transportation.id).all()
+        finally:
+            db.close()
+
+        bookings = {}
+        for transportation_id, group_id in rows:
+            bookings.setdefault(group_id or transportation_id, []).append(transportation_id)
+        with self._lock:
+            stale = [ids for ids in bookings.values() if self._queued.isdisjoint(ids)]
+        return [self._submit(ids) for ids in stale]
+
+    def start_recovery(self, interval_seconds: float = 60, grace_seconds: float = 300):
+        """Run resubmit_pending now and then every interval_seconds in a daemon thread"""
+        def sweep():
+            while True:
+                try:
+                    self.resubmit_pending(grace_seconds)
+                except Exception:
+                    logger.exception('Ride booking recovery failed')
+                if self._stopping.wait(interval_seconds):
+                    return
+
+        self._recovery = threading.Thread(target=sweep, name='ride-booking-recovery', daemon=True)
+        self._recovery.start()
+
+    def shutdown(self, wait: bool = True):
+        self._stopping.set()
+        if self._recovery is not None and wait:
+            self._recovery.join()
+        self.executor.shutdown(wait=wait)
+
+    def _book(self, transportation_ids: List[int]) -> Optional[str]:
+        db = self.session_factory()
+        try:
+            rows = db.query(
+                Transportation.id, Transportation.pickup_location,
+                Transportation.dropoff_location, Transportation.scheduled_time
+            ).filter(
+                Transportation.id.in_(transportation_ids),
+                Transportation.status == 'pending'
+            ).order_by(Transportation.id).all()
+            db.rollback()  # Don't hold a transaction open across provider calls
+            if not rows:
+                return None
+
+            pending_ids = [row.id for row in rows]
+            values = None
+            for attempt in range(self.max_attempts):
+                try:
+                    ride = self.client.request_ride(
+                        {'address': rows[0].pickup_location},
+                        {'address': rows[0].dropoff_location},
+                        min(row.scheduled_time for row in rows),
+                        reference_id=f'transportation-{pending_ids[0]}',
+                        additional_pickups=[{'address': row.pickup_location} for row in rows[1:]]
+                    )
+                except RideProviderError as error:
+                    values = {'status': 'failed', 'booking_error': str(error)[:200]}
+                    if not error.retryable or attempt == self.max_attempts - 1:
+                        break
+                    time.sleep(random.uniform(0, min(
+                        self.max_backoff_seconds,
+                        self.backoff_seconds * 2 ** attempt
+                    )))
+                    continue
+
+                cost = ride.get('estimated_cost')
+                values = {
+                    'ride_id': ride['ride_id'],
+                    'status': ride['status'],
+                    'cost': round(cost / len(rows), 2) if cost is not None else None,
+                    'driver_name': ride.get('driver_name'),
+                    'driver_phone': ride.get('driver_phone'),
+                    'vehicle_info': ride.get('vehicle_info'),
+                    'booking_error': None
+                }
+                break
+
+            # Only still-pending rows are updated, so a booking cancelled
+            # meanwhile stays cancelled
+            result = db.execute(
+                update(Transportation).where(
+                    Transportation.id.in_(pending_ids),
+                    Transportation.status == 'pending'
+                ).values(updated_at=datetime.utcnow(), **values)
+            )
+            db.commit()
+            return values['status'] if result.rowcount else None
+        finally:
+            db.close()
@@ -1,12 +1,13 @@
 """
 Transportation service integration (Uber Health)
 """
-import os
 from datetime import datetime, timedelta
-from typing import Dict, Optional
+from typing import Dict, List, Optional
+from sqlalchemy import DateTime, String, and_, bindparam, case, func, insert, or_, update
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 
-from src.database.models import Transportation, Appointment
+from src.database.models import Transportation, Appointment, RideWebhookEvent
 
 
 class TransportationService:
@@ -14,10 +15,30 @@ class TransportationService:
     Integration with Uber Health API for patient transportation
     """
     
-    def __init__(self, db_session: Session):
+    # Batch bookings share a ride between patients going to the same
+    # address with pickups this close together
+    SHARED_RIDE_WINDOW_MINUTES = 15
+    MAX_SHARED_RIDERS = 4
+    
+    # Statuses a provider event may set; others (e.g. location pings)
+    # leave the status unchanged
+    RIDE_STATUSES = {'confirmed', 'in_progress', 'completed', 'cancelled'}
+    MAX_EVENT_ATTEMPTS = 3
+    
+    def __init__(self, db_session: Session, dispatcher=None, enabled: bool = True,
+                 api_key: str = None):
+        """
+        Args:
+            db_session: Database session
+            dispatcher: RideDispatcher booking rides in the background;
+                without one rides are booked within the request
+            enabled: Book through Uber Health; otherwise rides are mocked
+            api_key: Uber Health API key
+        """
         self.db = db_session
-        self.api_key = os.getenv('UBER_HEALTH_API_KEY')
-        self.enabled = os.getenv('ENABLE_UBER_HEALTH', 'true').lower() == 'true'
+        self.api_key = api_key
+        self.enabled = enabled
+        self.dispatcher = dispatcher
         
     def book_ride(self, appointment_id: int, pickup_location: Dict,
                  dropoff_location: Dict = None, scheduled_time: datetime = None) -> Dict:
@@ -31,7 +52,9 @@ class TransportationService:
             scheduled_time: Scheduled pickup time (defaults to 30 min before appointment)
             
         Returns:
-            Transportation booking details
+            Transportation booking details. With a dispatcher the ride is
+            saved as pending and booked in the background; poll it with
+            get_booking(bookingId).
         """
         # Get appointment details
         appointment = self.db.query(Appointment).filter(
@@ -54,23 +77,12 @@ class TransportationService:
             # Schedule pickup 30 minutes before appointment
             scheduled_time = appointment.scheduled_datetime - timedelta(minutes=30)
         
-        # Create transportation record
-        if self.enabled:
-            # In production, this would call the actual Uber Health API
-            ride_result = self._book_uber_health_ride(
-                pickup_location,
-                dropoff_location,
-                scheduled_time
-            )
-        else:
-            # Mock response for development
-            ride_result = {
-                'ride_id': f'mock-ride-{appointment_id}',
-                'status': 'confirmed',
-                'estimated_cost': 15.50,
-                'driver_name': 'Mock Driver',
-                'vehicle_info': 'Toyota Camry - ABC 123'
-            }
+        if self.enabled and self.dispatcher:
+            return self._book_in_background(appointment_id, pickup_location,
+                                            dropoff_location, scheduled_time)
+        
+        ride_result = self._request_ride(appointment_id, pickup_location,
+                                         dropoff_location, scheduled_time)
         
         # Save transportation record
         transportation = Transportation(
@@ -89,13 +101,210 @@ class TransportationService:
         self.db.commit()
         self.db.refresh(transportation)
         
+        return self._format_ride(transportation)
+    
+    def book_rides(self, requests: List[Dict], share_rides: bool = True,
+                   window_minutes: float = None, max_riders: int = None) -> List[Dict]:
+        """
+        Book transportation for many appointments at once
+        
+        Requests going to the same dropoff address with pickups within
+        window_minutes of each other are proposed as one shared ride (see
+        propose_shared_rides), booked with a single provider request and
+        picked up from the earliest pickup time; the estimated cost is
+        split between the riders. All Transportation rows are written in
+        one transaction.
+        
+        Args:
+            requests: Dicts with appointment_id, pickup_location and optional
+                dropoff_location and scheduled_time, as for book_ride
+            share_rides: Group requests into shared rides
+            window_minutes: Pickup window of a shared ride
+            max_riders: Riders per shared ride
+            
+        Returns:
+            Results in request order, in the format of book_ride; riders of
+            a shared ride also get sharedWith, the other appointment IDs
+        """
+        results = [None] * len(requests)
+        legs = self._resolve_legs(requests, results)
+        
+        if share_rides:
+            rides = self._group_legs(legs, window_minutes or self.SHARED_RIDE_WINDOW_MINUTES,
+                                     max_riders or self.MAX_SHARED_RIDERS)
+        else:
+            rides = [[leg] for leg in legs]
+        
+        booked = []
+        for ride in rides:
+            first = ride[0]
+            scheduled_time = min(leg['scheduled_time'] for leg in ride)
+            if self.enabled and self.dispatcher:
+                ride_result = {'ride_id': None, 'status': 'pending'}
+            else:
+                ride_result = self._request_ride(
+                    first['appointment_id'], first['pickup_location'],
+                    first['dropoff_location'], scheduled_time
+                )
+            cost = ride_result.get('estimated_cost')
+            
+            transportations = [
+                Transportation(
+                    appointment_id=leg['appointment_id'],
+                    ride_id=ride_result['ride_id'],
+                    pickup_location=leg['pickup_location'].get('address'),
+                    dropoff_location=leg['dropoff_location'].get('address'),
+                    scheduled_time=scheduled_time,
+                    status=ride_result['status'],
+                    cost=round(cost / len(ride), 2) if cost is not None else None,
+                    driver_name=ride_result.get('driver_name'),
+                    vehicle_info=ride_result.get('vehicle_info')
+                )
+                for leg in ride
+            ]
+            self.db.add_all(transportations)
+            booked.append((ride, transportations))
+        
+        # Results are read before the commit expires the rows
+        self.db.flush()
+        shared_rides = []
+        for ride, transportations in booked:
+            shared_rides.append([t.id for t in transportations])
+            if len(transportations) > 1 and transportations[0].status == 'pending':
+                # Lets a restarted dispatcher book the ride as one again
+                for transportation in transportations:
+                    transportation.booking_group_id = transportations[0].id
+            for leg, transportation in zip(ride, transportations):
+                result = (self._format_pending(transportation) if transportation.status == 'pending'
+                          else self._format_ride(transportation))
+                if len(ride) > 1:
+                    result['sharedWith'] = [
+                        other['appointment_id'] for other in ride if other is not leg
+                    ]
+                results[leg['index']] = result
+        
+        self.db.commit()
+        
+        # Submitted after the commit so the workers can see the rows
+        if self.enabled and self.dispatcher:
+            for transportation_ids in shared_rides:
+                self.dispatcher.submit_shared(transportation_ids)
+        
+        return results
+    
+    def propose_shared_rides(self, requests: List[Dict], window_minutes: float = None,
+                             max_riders: int = None) -> List[Dict]:
+        """
+        Group ride requests into shared rides without booking them
+        
+        Requests are grouped by dropoff address (ignoring case and
+        spacing), then, in pickup time order, into rides of up to
+        max_riders whose pickups fall within window_minutes of the ride's
+        first pickup. Requests for unknown appointments are left out.
+        
+        Returns:
+            Proposed rides with appointmentIds, dropoffLocation and
+            scheduledTime (the earliest pickup)
+        """
+        legs = self._resolve_legs(requests, [None] * len(requests))
+        rides = self._group_legs(legs, window_minutes or self.SHARED_RIDE_WINDOW_MINUTES,
+                                 max_riders or self.MAX_SHARED_RIDERS)
+        return [
+            {
+                'appointmentIds': [leg['appointment_id'] for leg in ride],
+                'dropoffLocation': ride[0]['dropoff_location'].get('address'),
+                'scheduledTime': min(leg['scheduled_time'] for leg in ride).isoformat()
+            }
+            for ride in rides
+        ]
+    
+    def _resolve_legs(self, requests: List[Dict], results: List[Optional[Dict]]) -> List[Dict]:
+        """
+        Fill in dropoff and pickup time defaults from the appointments
+        
+        Appointments are read with one query; requests for unknown ones get
+        their error result in results.
+        """
+        appointment_ids = {r['appointment_id'] for r in requests}
+        appointments = {
+            appointment.id: appointment
+            for appointment in self.db.query(
+                Appointment.id, Appointment.location, Appointment.scheduled_datetime
+            ).filter(Appointment.id.in_(appointment_ids))
+        }
+        
+        legs = []
+        for index, request in enumerate(requests):
+            appointment = appointments.get(request['appointment_id'])
+            if not appointment:
+                results[index] = {'success': False, 'error': 'Appointment not found'}
+                continue
+            legs.append({
+                'index': index,
+                'appointment_id': appointment.id,
+                'pickup_location': request['pickup_location'],
+                'dropoff_location': request.get('dropoff_location') or {'address': appointment.location},
+                'scheduled_time': request.get('scheduled_time') or (
+                    appointment.scheduled_datetime - timedelta(minutes=30)
+                )
+            })
+        return legs
+    
+    def _group_legs(self, legs: List[Dict], window_minutes: float,
+                    max_riders: int) -> List[List[Dict]]:
+        """Shared rides as lists of legs, each ordered by pickup time"""
+        by_dropoff = {}
+        rides = []
+        for leg in legs:
+            address = leg['dropoff_location'].get('address')
+            if not address:
+                rides.append([leg])  # Nothing to match a shared ride on
+                continue
+            by_dropoff.setdefault(' '.join(address.lower().split()), []).append(leg)
+        
+        window = timedelta(minutes=window_minutes)
+        for dropoff_legs in by_dropoff.values():
+            dropoff_legs.sort(key=lambda leg: (leg['scheduled_time'], leg['index']))
+            ride = []
+            for leg in dropoff_legs:
+                if ride and (len(ride) == max_riders or
+                             leg['scheduled_time'] - ride[0]['scheduled_time'] > window):
+                    rides.append(ride)
+                    ride = []
+                ride.append(leg)
+            rides.append(ride)
+        
+        return rides
+    
+    def _request_ride(self, appointment_id: int, pickup_location: Dict,
+                      dropoff_location: Dict, scheduled_time: datetime) -> Dict:
+        """Book a ride within the request"""
+        if self.enabled:
+            # In production, this would call the actual Uber Health API
+            return self._book_uber_health_ride(
+                pickup_location,
+                dropoff_location,
+                scheduled_time
+            )
+        
+        # Mock response for development
+        return {
+            'ride_id': f'mock-ride-{appointment_id}',
+            'status': 'confirmed',
+            'estimated_cost': 15.50,
+            'driver_name': 'Mock Driver',
+            'vehicle_info': 'Toyota Camry - ABC 123'
+        }
+    
+    def _format_ride(self, transportation: Transportation) -> Dict:
+        """Format a booked ride for API response"""
         return {
             'success': True,
             'rideId': transportation.ride_id,
             'status': transportation.status,
-            'scheduledTime': scheduled_time.isoformat(),
-            'pickupLocation': pickup_location.get('address'),
-            'dropoffLocation': dropoff_location.get('address'),
+            'scheduledTime': transportation.scheduled_time.isoformat(),
+            'pickupLocation': transportation.pickup_location,
+            'dropoffLocation': transportation.dropoff_location,
             'estimatedCost': transportation.cost,
             'driver': {
                 'name': transportation.driver_name,
@@ -103,23 +312,68 @@ class TransportationService:
             }
         }
     
+    def _format_pending(self, transportation: Transportation) -> Dict:
+        """Format a ride still being booked in the background"""
+        return {
+            'success': True,
+            'bookingId': transportation.id,
+            'status': 'pending',
+            'scheduledTime': transportation.scheduled_time.isoformat(),
+            'pickupLocation': transportation.pickup_location,
+            'dropoffLocation': transportation.dropoff_location
+        }
+    
+    def _book_in_background(self, appointment_id: int, pickup_location: Dict,
+                            dropoff_location: Dict, scheduled_time: datetime) -> Dict:
+        """Save a pending ride and hand it to the dispatcher"""
+        transportation = Transportation(
+            appointment_id=appointment_id,
+            pickup_location=pickup_location.get('address'),
+            dropoff_location=dropoff_location.get('address'),
+            scheduled_time=scheduled_time,
+            status='pending'
+        )
+        
+        self.db.add(transportation)
+        self.db.commit()
+        
+        # Submitted after the commit so the worker can see the row
+        self.dispatcher.submit(transportation.id)
+        
+        return self._format_pending(transportation)
+    
+    def get_booking(self, booking_id: int) -> Optional[Dict]:
+        """Get a booking by ID, including ones still pending"""
+        transportation = self.db.get(Transportation, booking_id)
+        
+        if not transportation:
+            return None
+        
+        return {
+            'bookingId': transportation.id,
+            'appointmentId': transportation.appointment_id,
+            'rideId': transportation.ride_id,
+            'status': transportation.status,
+            'error': transportation.booking_error,
+            'scheduledTime': transportation.scheduled_time.isoformat() if transportation.scheduled_time else None,
+            'pickupLocation': transportation.pickup_location,
+            'dropoffLocation': transportation.dropoff_location,
+            'estimatedCost': transportation.cost,
+            'driver': {
+                'name': transportation.driver_name,
+                'phone': transportation.driver_phone,
+                'vehicle': transportation.vehicle_info
+            }
+        }
+    
     def _book_uber_health_ride(self, pickup: Dict, dropoff: Dict,
                               scheduled_time: datetime) -> Dict:
         """
-        Call Uber Health API to book a ride
+        Book a ride within the request
         
-        In production, this would make actual API calls to Uber Health.
-        For now, returns mock data.
+        Returns mock data; real bookings go through UberHealthClient on a
+        RideDispatcher (see UBER_HEALTH_API_URL).
         """
-        # Mock implementation
-        # In production, use:
-        # import requests
-        # response = requests.post(
-        #     'https://api.uber.com/v1/health/requests',
-        #     headers={'Authorization': f'Bearer {self.api_key}'},
-        #     json={...}
-        # )
-        
         return {
             'ride_id': f'uber-{datetime.now().timestamp()}',
             'status': 'confirmed',
@@ -168,18 +422,143 @@ class TransportationService:
                           pickup_time: datetime = None,
                           dropoff_time: datetime = None) -> bool:
         """Update ride status (called by webhook or polling)"""
-        transportation = self.db.query(Transportation).filter(
-            Transportation.ride_id == ride_id
-        ).first()
+        result = self.apply_ride_events([{
+            'ride_id': ride_id,
+            'status': status,
+            'pickup_time': pickup_time,
+            'dropoff_time': dropoff_time
+        }])
+        return result['success'] and not result['unknown_rides']
+    
+    def apply_ride_events(self, events: List[Dict]) -> Dict:
+        """
+        Apply a batch of ride status events from the provider
         
-        if not transportation:
-            return False
+        Events are idempotent on event_id: ones already applied (or
+        repeated within the batch) are skipped. The rest are coalesced to
+        the latest state of each ride, ordered by their timestamp, so a
+        burst of pings for one ride becomes a single row update. Only
+        status events move a ride's last_event_at, and a status older than
+        it is ignored (counted as stale), so a location ping can never hold
+        back a status change. The whole batch costs two lookups, one insert
+        and one UPDATE executemany keyed by ride_id, in one transaction.
         
-        transportation.status = status
-        if pickup_time:
-            transportation.pickup_time = pickup_time
-        if dropoff_time:
-            transportation.dropoff_time = dropoff_time
+        Args:
+            events: Dicts with event_id (optional for internal updates),
+                ride_id, and optional timestamp, status, pickup_time and
+                dropoff_time; unknown statuses are ignored
+            
+        Returns:
+            Counts of received, duplicate, applied and stale events, the
+            number of rides they covered and the ride IDs we have no booking
+            for; success
+            is False if concurrent deliveries kept conflicting
+        """
+        now = datetime.utcnow()
+        for _ in range(self.MAX_EVENT_ATTEMPTS):
+            event_ids = {e['event_id'] for e in events if e.get('event_id')}
+            seen = {
+                event_id for (event_id,) in self.db.query(RideWebhookEvent.event_id).filter(
+                    RideWebhookEvent.event_id.in_(event_ids)
+                )
+            } if event_ids else set()
+            
+            fresh = []
+            for event in events:
+                event_id = event.get('event_id')
+                if event_id in seen:
+                    continue
+                if event_id:
+                    seen.add(event_id)
+                fresh.append(event)
+            
+            # Latest state per ride; the sort is stable, so events with the
+            # same timestamp keep their batch order and later ones win
+            states = {}
+            for event in sorted(fresh, key=lambda e: e.get('timestamp') or now):
+                state = states.setdefault(event['ride_id'], {
+                    'status': None, 'status_at': None, 'pickup_time': None, 'dropoff_time': None
+                })
+                if event.get('status') in self.RIDE_STATUSES:
+                    state['status'] = event['status']
+                    state['status_at'] = event.get('timestamp') or now
+                for field in ('pickup_time', 'dropoff_time'):
+                    if event.get(field):
+                        state[field] = event[field]
+            
+            # Rides sharing a booking share a ride_id and get the same events
+            last_status_at = dict(self.db.query(
+                Transportation.ride_id, func.max(Transportation.last_event_at)
+            ).filter(
+                Transportation.ride_id.in_(list(states))
+            ).group_by(Transportation.ride_id)) if states else {}
+            known = set(last_status_at)
+            
+            # Events for rides not booked yet (the provider may report a ride
+            # before its booking is saved) stay unrecorded so a redelivery
+            # can still apply them
+            processed = [e for e in fresh if e['ride_id'] in known]
+            stale = [
+                e for e in processed
+                if e.get('status') in self.RIDE_STATUSES and last_status_at[e['ride_id']]
+                and (e.get('timestamp') or now) < last_status_at[e['ride_id']]
+            ]
+            
+            try:
+                recorded = [
+                    {'event_id': e['event_id'], 'ride_id': e['ride_id'], 'received_at': now}
+                    for e in processed if e.get('event_id')
+                ]
+                if recorded:
+                    self.db.execute(insert(RideWebhookEvent), recorded)
+                
+                updates = [
+                    {'b_ride_id': ride_id, 'b_updated_at': now, **{f'b_{k}': v for k, v in state.items()}}
+                    for ride_id, state in states.items() if ride_id in known
+                ]
+                if updates:
+                    # Every known ride's row matches; the status (and its
+                    # time) only changes for a status no older than the last
+                    table = Transportation.__table__
+                    status_at = bindparam('b_status_at', type_=DateTime)
+                    newer_status = and_(
+                        bindparam('b_status', type_=String).isnot(None),
+                        or_(table.c.last_event_at.is_(None), table.c.last_event_at <= status_at)
+                    )
+                    self.db.execute(
+                        update(table).where(
+                            table.c.ride_id == bindparam('b_ride_id')
+                        ).values(
+                            status=case((newer_status, bindparam('b_status', type_=String)),
+                                        else_=table.c.status),
+                            last_event_at=case((newer_status, status_at), else_=table.c.last_event_at),
+                            pickup_time=func.coalesce(
+                                bindparam('b_pickup_time', type_=DateTime), table.c.pickup_time
+                            ),
+                            dropoff_time=func.coalesce(
+                                bindparam('b_dropoff_time', type_=DateTime), table.c.dropoff_time
+                            ),
+                            updated_at=bindparam('b_updated_at')
+                        ),
+                        updates
+                    )
+                self.db.commit()
+            except IntegrityError:
+                # A concurrent delivery recorded some of the same events
+                self.db.rollback()
+                continue
+            
+            return {
+                'success': True,
+                'received': len(events),
+                'duplicates': len(events) - len(fresh),
+                'applied': len(processed) - len(stale),
+                'stale': len(stale),
+                'rides': len(updates),
+                'unknown_rides': sorted(set(states) - known)
+            }
         
-        self.db.commit()
-        return True
+        return {
+            'success': False,
+            'error': 'Events are being applied concurrently, please retry'
+        }
@@ -0,0 +1,110 @@
+"""
+HTTP client for the Uber Health ride API
+"""
+from datetime import datetime
+from typing import Dict, List, Tuple, Union
+
+import requests
+
+from src.services.http_client import get_http_client
+
+
+class RideProviderError(Exception):
+    """
+    A ride request the provider did not accept
+
+    ``retryable`` is False when repeating the same request cannot succeed
+    (e.g. a rejected address), so callers should give up immediately.
+    """
+
+    def __init__(self, message: str, retryable: bool = True):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class UberHealthClient:
+    """
+    Books rides with the Uber Health API (or a compatible stand-in)
+
+    Each booking carries an Idempotency-Key, so retrying a request whose
+    response was lost does not book a second ride. Requests go through the
+    process-wide 'uber_health' HTTP client unless another session is given.
+    """
+
+    RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+    def __init__(self, base_url: str, api_key: str = None,
+                 timeout: Union[float, Tuple[float, float]] = (3.05, 10),
+                 session=None):
+        self.base_url = base_url.rstrip('/')
+        self.api_key = api_key
+        self.timeout = timeout
+        self.session = session or get_http_client('uber_health')
+
+    def request_ride(self, pickup: Dict, dropoff: Dict, scheduled_time: datetime,
+                     reference_id: str, additional_pickups: List[Dict] = None) -> Dict:
+        """
+        Request a ride
+
+        Args:
+            pickup: Pickup address and coordinates
+            dropoff: Dropoff address and coordinates
+            scheduled_time: Pickup time
+            reference_id: Our booking reference, also the idempotency key
+            additional_pickups: Further stops of a shared ride
+
+        Returns:
+            ride_id, status, estimated_cost, driver_name, driver_phone and
+            vehicle_info
+
+        Raises:
+            RideProviderError: On timeouts, connection errors, error responses
+                and responses that are not a ride
+        """
+        headers = {'Idempotency-Key': reference_id}
+        if self.api_key:
+            headers['Authorization'] = f'Bearer {self.api_key}'
+
+        try:
+            response = self.session.post(
+                f'{self.base_url}/v1/health/requests',
+                json={
+                    'pickup': pickup,
+                    'dropoff': dropoff,
+                    'scheduled_time': scheduled_time.isoformat(),
+                    'reference_id': reference_id,
+                    'additional_pickups': additional_pickups or []
+                },
+                headers=headers,
+                timeout=self.timeout
+            )
+        except requests.Timeout as e:
+            raise RideProviderError(f'Ride request timed out: {e}')
+        except requests.RequestException as e:
+            raise RideProviderError(f'Ride request failed: {e}')
+
+        if response.status_code >= 400:
+            raise RideProviderError(
+                f'Ride provider returned HTTP {response.status_code}',
+                retryable=response.status_code in self.RETRYABLE_STATUS
+            )
+
+        # Repeating a request the provider answered with garbage books
+        # nothing new, so a malformed response is not retried
+        try:
+            ride = response.json()
+            driver = ride.get('driver') or {}
+            vehicle = ride.get('vehicle') or {}
+            return {
+                'ride_id': ride['request_id'],
+                'status': ride.get('status', 'confirmed'),
+                'estimated_cost': (ride.get('fare') or {}).get('value'),
+                'driver_name': driver.get('name'),
+                'driver_phone': driver.get('phone_number'),
+                'vehicle_info': (
+                    f"{vehicle.get('make')} {vehicle.get('model')} - {vehicle.get('license_plate')}"
+                    if vehicle else None
+                )
+            }
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            raise RideProviderError(f'Malformed ride provider response: {e!r}', retryable=False)
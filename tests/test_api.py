@@ -0,0 +1,291 @@
+"""
+Tests for the Flask API endpoints
+"""
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pytest
+from datetime import datetime
+
+from src import main
+from src.database.models import Base, Patient, Provider, TriageSession
+from src.database.session import create_db_engine
+from src.services.provider_geo_index import ProviderGeoIndex
+
+
+@pytest.fixture
+def client(tmp_path):
+    """Create a test client bound to a fresh database"""
+    engine = create_db_engine(f'sqlite:///{tmp_path / "test.db"}')
+    Base.metadata.create_all(engine)
+    main.Session.remove()
+    main.Session.configure(bind=engine)
+    main.app.config['TESTING'] = True
+    if main.services.provider_cache.backend is not None:
+        main.services.provider_cache.backend.clear()
+    
+    with main.app.test_client() as client:
+        yield client
+    
+    engine.dispose()
+
+
+@pytest.fixture
+def patient_id(client):
+    """Create a test patient"""
+    db = main.get_db()
+    patient = Patient(
+        ohip_number='1234567890AB',
+        first_name='Test',
+        last_name='Patient',
+        date_of_birth=datetime(1980, 1, 1)
+    )
+    db.add(patient)
+    db.commit()
+    patient_id = patient.id
+    main.Session.remove()
+    return patient_id
+
+
+def test_triage_batch_preserves_order(client):
+    """Test that batch assessments come back in request order"""
+    response = client.post('/api/v1/triage/batch', json={
+        'requests': [
+            {'symptoms': ['cough']},
+            {'symptoms': ['chest pain']},
+            {'symptoms': ['high fever'], 'duration': '2 days'}
+        ]
+    })
+    
+    assert response.status_code == 200
+    urgencies = [a['urgency'] for a in response.get_json()['assessments']]
+    assert urgencies == ['routine', 'critical', 'urgent']
+
+
+def test_triage_batch_saves_sessions(client, patient_id):
+    """Test that batch triage stores one session per identified patient"""
+    response = client.post('/api/v1/triage/batch', json={
+        'requests': [
+            {'symptoms': ['cough'], 'patientId': patient_id},
+            {'symptoms': ['rash']},
+            {'symptoms': ['seizure'], 'patientId': patient_id}
+        ]
+    })
+    
+    assessments = response.get_json()['assessments']
+    assert 'sessionId' in assessments[0]
+    assert 'sessionId' not in assessments[1]
+    assert assessments[2]['sessionId'] != assessments[0]['sessionId']
+    
+    db = main.get_db()
+    assert db.query(TriageSession).count() == 2
+    main.Session.remove()
+
+
+def test_triage_batch_validation(client):
+    """Test that malformed batches are rejected"""
+    assert client.post('/api/v1/triage/batch', json={'requests': []}).status_code == 400
+    response = client.post('/api/v1/triage/batch', json={
+        'requests': [{'symptoms': ['cough']}, {'duration': '2 days'}]
+    })
+    assert response.status_code == 400
+    assert '1' in response.get_json()['error']
+
+
+def test_sessions_returned_to_pool(client, patient_id):
+    """Test that every request path returns its connection to the pool"""
+    client.get(f'/api/v1/patients/{patient_id}')
+    client.get('/api/v1/patients/999')
+    client.post('/api/v1/patients', json={
+        'ohipNumber': '1234567890AB', 'firstName': 'Dup',
+        'lastName': 'Patient', 'dateOfBirth': '1980-01-01'
+    })
+    
+    stats = client.get('/api/v1/health/db').get_json()['pool']
+    assert stats['pool_class'] == 'InstrumentedQueuePool'
+    assert stats['checked_out'] == 0
+    assert stats['total_checkouts'] >= 3
+
+
+def test_metrics_history_rejects_bad_limits(client):
+    """Test that limit must be a positive number"""
+    for limit in ('-1', '0', 'many'):
+        assert client.get(f'/api/v1/metrics/history?limit={limit}').status_code == 400
+    assert client.get('/api/v1/metrics/history?limit=5').get_json() == {'history': []}
+
+
+def test_providers_search_by_location(client, monkeypatch):
+    """Test that location searches filter by radius and sort nearest first"""
+    geo_index = ProviderGeoIndex()
+    monkeypatch.setattr(main.services.providers, 'geo_index', geo_index)
+    monkeypatch.setattr(main.services.appointments, 'geo_index', geo_index)
+    db = main.get_db()
+    db.add_all([
+        Provider(name='Dr. Midtown', license_number='L-1', rating=4.9, latitude=43.70, longitude=-79.40),
+        Provider(name='Dr. Downtown', license_number='L-2', rating=4.1, latitude=43.65, longitude=-79.38),
+        Provider(name='Dr. Ottawa', license_number='L-3', rating=5.0, latitude=45.42, longitude=-75.69),
+    ])
+    db.commit()
+    main.Session.remove()
+    
+    response = client.get('/api/v1/providers?location=43.6532,-79.3832&radius=20')
+    assert response.status_code == 200
+    providers = response.get_json()['providers']
+    assert [p['name'] for p in providers] == ['Dr. Downtown', 'Dr. Midtown']
+    assert providers[0]['distanceKm'] < providers[1]['distanceKm'] < 20
+    
+    response = client.get('/api/v1/providers')
+    assert [p['name'] for p in response.get_json()['providers']][0] == 'Dr. Ottawa'
+    assert client.get('/api/v1/providers?location=1,2&radius=far').status_code == 400
+    for radius in ('inf', 'nan', '0', '-5'):
+        assert client.get(f'/api/v1/providers?location=1,2&radius={radius}').status_code == 400
+    
+    response = client.get('/api/v1/providers?location=43.6532,-79.3832&radius=1e308')
+    assert response.status_code == 200
+    assert len(response.get_json()['providers']) == 3
+
+
+def test_providers_search_prefix_and_fuzzy(client):
+    """Test q= word-prefix search and typo-tolerant fuzzy search"""
+    db = main.get_db()
+    db.add_all([
+        Provider(name='Dr. Sarah Johnson', specialty='Family Medicine', license_number='L-1', rating=4.8),
+        Provider(name='Dr. James Chen', specialty='Cardiology', license_number='L-2', rating=4.9),
+        Provider(name='Dr. Amy Famularo', specialty='Pediatric Cardiology', license_number='L-3', rating=4.5),
+    ])
+    db.commit()
+    main.Session.remove()
+    
+    names = lambda response: [p['name'] for p in response.get_json()['providers']]
+    assert names(client.get('/api/v1/providers?q=fam')) == ['Dr. Sarah Johnson', 'Dr. Amy Famularo']
+    assert names(client.get('/api/v1/providers?q=cardiology')) == ['Dr. James Chen', 'Dr. Amy Famularo']
+    assert names(client.get('/api/v1/providers?q=ardio')) == []
+    assert names(client.get('/api/v1/providers?specialty=ardio')) == ['Dr. James Chen', 'Dr. Amy Famularo']
+    
+    response = client.get('/api/v1/providers?q=cardiolgy&fuzzy=true')
+    providers = response.get_json()['providers']
+    assert [p['name'] for p in providers] == ['Dr. James Chen', 'Dr. Amy Famularo']
+    assert providers[0]['matchScore'] > providers[1]['matchScore'] >= 0.3
+
+
+def test_provider_cache_read_through_and_invalidation(client):
+    """Test that provider reads are cached until the provider changes"""
+    db = main.get_db()
+    provider = Provider(name='Dr. Cached', specialty='Cardiology', license_number='L-1', rating=4.0)
+    db.add(provider)
+    db.commit()
+    provider_id = provider.id
+    main.Session.remove()
+    
+    before = main.services.provider_cache.stats()
+    assert client.get(f'/api/v1/providers/{provider_id}').get_json()['rating'] == 4.0
+    assert client.get(f'/api/v1/providers/{provider_id}').get_json()['rating'] == 4.0
+    assert client.get('/api/v1/providers?specialty=CARD').get_json()['providers'][0]['rating'] == 4.0
+    assert client.get('/api/v1/providers?specialty=card').get_json()['providers'][0]['rating'] == 4.0
+    after = main.services.provider_cache.stats()
+    assert after['detail']['hits'] - before['detail']['hits'] == 1
+    assert after['search']['hits'] - before['search']['hits'] == 1
+    
+    # A rolled-back change keeps the cache; a committed one clears it
+    db = main.get_db()
+    db.get(Provider, provider_id).rating = 1.0
+    db.flush()
+    db.rollback()
+    db.get(Provider, provider_id).rating = 4.8
+    db.commit()
+    main.Session.remove()
+    
+    assert client.get(f'/api/v1/providers/{provider_id}').get_json()['rating'] == 4.8
+    assert client.get('/api/v1/providers?specialty=card').get_json()['providers'][0]['rating'] == 4.8
+    
+    stats = client.get('/api/v1/health/cache').get_json()
+    assert stats['providers']['detail']['misses'] - before['detail']['misses'] == 2
+    assert 0 < stats['providers']['search']['hit_ratio'] < 1
+    assert stats['providers']['backend']['maxsize'] == main.config.provider_cache_size
+
+
+def test_transportation_booking_is_accepted_then_polled(client, patient_id, monkeypatch):
+    """Test that with a dispatcher bookings return 202 and are polled by ID"""
+    from src.database.models import Appointment
+    from src.services.fake_uber_health import FakeUberHealth
+    from src.services.ride_dispatcher import RideDispatcher
+    from src.services.uber_health_client import UberHealthClient
+    
+    db = main.get_db()
+    appointment = Appointment(patient_id=patient_id, provider_id=1, location='1 Clinic Rd',
+                              scheduled_datetime=datetime(2030, 3, 1, 9, 0))
+    db.add(appointment)
+    db.commit()
+    appointment_id = appointment.id
+    main.Session.remove()
+    
+    with FakeUberHealth(latency=0.1) as fake:
+        dispatcher = RideDispatcher(main.Session.session_factory, UberHealthClient(fake.url))
+        monkeypatch.setattr(main.services.transportation, 'dispatcher', dispatcher)
+        response = client.post('/api/v1/transportation', json={
+            'appointmentId': appointment_id, 'pickupLocation': {'address': '5 Home St'}
+        })
+        assert response.status_code == 202
+        booking_id = response.get_json()['bookingId']
+        dispatcher.shutdown()
+    
+    booking = client.get(f'/api/v1/transportation/bookings/{booking_id}').get_json()
+    assert booking['status'] == 'confirmed'
+    assert client.get(f"/api/v1/transportation/{booking['rideId']}").status_code == 200
+    assert client.get('/api/v1/transportation/bookings/999').status_code == 404
+    
+    hosts = client.get('/api/v1/health/http').get_json()['uber_health']
+    assert hosts[fake.url.split('//')[1]]['requests'] >= 1
+
+
+def test_ride_status_webhook(client, monkeypatch):
+    """Test webhook validation, signatures and idempotent redelivery"""
+    import hashlib
+    import hmac
+    import json
+    from src.database.models import Transportation
+    
+    db = main.get_db()
+    db.add(Transportation(appointment_id=1, ride_id='uber-77', status='confirmed'))
+    db.commit()
+    main.Session.remove()
+    
+    body = json.dumps({'events': [
+        {'eventId': 'evt-1', 'rideId': 'uber-77', 'status': 'in_progress',
+         'timestamp': '2030-01-15T14:00:00Z', 'pickupTime': '2030-01-15T09:00:00-05:00'},
+        {'eventId': 'evt-2', 'rideId': 'uber-77', 'status': 'driver_location',
+         'timestamp': '2030-01-15T14:01:00Z'}
+    ]})
+    monkeypatch.setattr(main.config, 'uber_health_webhook_secret', 'shh')
+    signature = hmac.new(b'shh', body.encode(), hashlib.sha256).hexdigest()
+    
+    def deliver(payload, signature):
+        return client.post('/api/v1/transportation/webhook', data=payload,
+                           headers={'Content-Type': 'application/json', 'X-Uber-Signature': signature})
+    
+    assert deliver(body, 'forged').status_code == 401
+    response = deliver(body, signature)
+    assert response.get_json() == {'received': 2, 'duplicates': 0, 'applied': 2, 'stale': 0,
+                                   'unknownRides': []}
+    assert deliver(body, signature).get_json()['duplicates'] == 2
+    
+    status = client.get('/api/v1/transportation/uber-77').get_json()
+    assert status['status'] == 'in_progress'
+    assert status['pickupTime'] == '2030-01-15T14:00:00'
+    
+    def deliver_signed(payload):
+        payload = json.dumps(payload)
+        return deliver(payload, hmac.new(b'shh', payload.encode(), hashlib.sha256).hexdigest())
+    
+    assert deliver_signed({'events': [{'rideId': 'x'}]}).status_code == 400
+    assert deliver_signed({
+        'events': [{'eventId': 'e', 'rideId': 'x', 'timestamp': 'yesterday'}]
+    }).status_code == 400
+    
+    # Without a secret nothing is accepted, signed or not
+    monkeypatch.setattr(main.config, 'uber_health_webhook_secret', None)
+    assert deliver(body, signature).status_code == 503
+    assert client.post('/api/v1/transportation/webhook', json={
+        'events': [{'eventId': 'evt-3', 'rideId': 'uber-77', 'status': 'cancelled'}]
+    }).status_code == 503
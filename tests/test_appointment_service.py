@@ -0,0 +1,515 @@
+"""
+Tests for the appointment scheduling service
+"""
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import random
+import pytest
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from src.database.models import (
+    Base, Patient, Provider, ProviderAvailability, Appointment
+)
+from src.services.appointment_service import AppointmentService
+from src.services.provider_geo_index import ProviderGeoIndex, haversine_km
+
+
+@pytest.fixture
+def db_session():
+    """Create a test database session"""
+    engine = create_engine('sqlite:///:memory:')
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine)
+    session = Session()
+    yield session
+    session.close()
+
+
+@pytest.fixture
+def roster(db_session):
+    """Seed providers with mixed availability and bookings"""
+    return _seed_roster(db_session, datetime.now())
+
+
+def _seed_roster(db_session, now):
+    """Seed a deterministic roster relative to now"""
+    rng = random.Random(7)
+    
+    patient = Patient(
+        ohip_number='1234567890AB', first_name='Test', last_name='Patient',
+        date_of_birth=datetime(1980, 1, 1)
+    )
+    db_session.add(patient)
+    
+    providers = []
+    for i in range(30):
+        provider = Provider(
+            name=f'Dr. {i}', specialty=rng.choice(['Family Medicine', 'Cardiology']),
+            license_number=f'LIC-{i}', address=f'{i} Main St',
+            rating=rng.choice([4.5, 4.7, 4.9]), average_wait_time_days=rng.choice([0.5, 2, 5]),
+            accepts_new_patients=True
+        )
+        providers.append(provider)
+    db_session.add_all(providers)
+    db_session.commit()
+    
+    for provider in providers:
+        # Some providers have no availability at all
+        if provider.id % 7 == 0:
+            continue
+        for day in rng.sample(range(7), rng.randint(1, 5)):
+            start = rng.choice([8, 9, 13])
+            db_session.add(ProviderAvailability(
+                provider_id=provider.id, day_of_week=day,
+                start_time=f'{start:02d}:00', end_time=f'{start + rng.randint(1, 4):02d}:00'
+            ))
+        booked = set()
+        for _ in range(rng.randint(0, 40)):
+            slot = (now + timedelta(hours=rng.randint(0, 24 * 14))).replace(
+                minute=rng.choice([0, 30]), second=0, microsecond=0)
+            status = rng.choice(['scheduled', 'confirmed', 'cancelled'])
+            # At most one active appointment per slot
+            if status != 'cancelled' and slot in booked:
+                continue
+            if status != 'cancelled':
+                booked.add(slot)
+            db_session.add(Appointment(
+                patient_id=patient.id, provider_id=provider.id,
+                scheduled_datetime=slot, status=status
+            ))
+    db_session.commit()
+    return providers
+
+
+def _reference_next_slot(db, provider_id, urgency, now):
+    """Reference implementation: the per-provider datetime walk"""
+    service = AppointmentService(db)
+    availability = db.query(ProviderAvailability).filter(
+        ProviderAvailability.provider_id == provider_id,
+        ProviderAvailability.is_available == True
+    ).all()
+    if not availability:
+        return None
+    
+    end_date = now + timedelta(days=service._get_search_window_days(urgency))
+    # Each appointment blocks the 30-minute slot it starts in
+    occupied = {
+        appt.scheduled_datetime.replace(
+            minute=appt.scheduled_datetime.minute // 30 * 30, second=0, microsecond=0)
+        for appt in db.query(Appointment).filter(
+            Appointment.provider_id == provider_id,
+            Appointment.scheduled_datetime >= now,
+            Appointment.scheduled_datetime <= end_date,
+            Appointment.status.in_(['scheduled', 'confirmed'])
+        )
+    }
+    
+    current = now
+    while current <= end_date:
+        day = [a for a in availability if a.day_of_week == current.weekday()]
+        if day:
+            for hour in range(int(day[0].start_time[:2]), int(day[0].end_time[:2])):
+                for minute in [0, 30]:
+                    slot = current.replace(hour=hour, minute=minute, second=0, microsecond=0)
+                    if slot > now and slot not in occupied:
+                        return slot
+        current += timedelta(days=1)
+    return None
+
+
+@pytest.mark.parametrize('urgency', ['critical', 'urgent', 'routine', 'non-urgent'])
+def test_calendar_slots_match_sequential_search(db_session, roster, urgency):
+    """Test that the bitmap slot finder equals the per-provider search"""
+    service = AppointmentService(db_session)
+    now = datetime.now()
+    provider_ids = [p.id for p in roster]
+    
+    slots = service._find_available_slots(provider_ids, urgency, now=now)
+    
+    for provider_id in provider_ids:
+        assert slots.get(provider_id) == _reference_next_slot(db_session, provider_id, urgency, now)
+
+
+def test_schedule_appointment_picks_best_ranked_provider(db_session, roster):
+    """Test that scheduling books the top-ranked provider with a free slot"""
+    service = AppointmentService(db_session)
+    ranked = [
+        p.id for p in service._find_suitable_providers(
+            'consultation', specialty='Cardiology', max_wait_time=7
+        )
+    ]
+    slots = service._find_available_slots(ranked, 'routine')
+    expected = next(pid for pid in ranked if pid in slots)
+    
+    result = service.schedule_appointment(
+        patient_id=1, service_type='consultation', urgency='routine',
+        preferences={'specialty': 'Cardiology'}
+    )
+    
+    assert result['success']
+    assert result['provider']['id'] == expected
+    assert result['dateTime'] == slots[expected].isoformat()
+
+
+def test_calendar_index_tracks_bookings_and_cancellations(db_session, roster):
+    """Test that a shared calendar index is updated incrementally"""
+    from src.services.provider_calendar import CalendarIndex
+    
+    index = CalendarIndex()
+    service = AppointmentService(db_session, calendar_index=index)
+    provider_id = roster[1].id
+    
+    first = service._find_next_available_slot(provider_id, 'routine')
+    booked = service._create_appointment(
+        patient_id=1, provider_id=provider_id, service_type='consultation',
+        scheduled_datetime=first, urgency='routine', location='1 Main St'
+    )
+    second = service._find_next_available_slot(provider_id, 'routine')
+    assert second > first
+    
+    service.cancel_appointment(booked.id)
+    assert service._find_next_available_slot(provider_id, 'routine') == first
+
+
+def test_half_hour_booking_blocks_its_own_slot(db_session, roster):
+    """Test that a :30 appointment occupies the :30 slot, not the hour"""
+    from src.services.provider_calendar import ProviderCalendar
+    
+    origin = datetime(2024, 1, 1)  # Monday
+    availability = [ProviderAvailability(day_of_week=0, start_time='09:00', end_time='10:00')]
+    calendar = ProviderCalendar(1, origin, 7, availability)
+    calendar.book(datetime(2024, 1, 1, 9, 30))
+    
+    assert calendar.next_free_slot(datetime(2024, 1, 1, 8, 0), 6) == datetime(2024, 1, 1, 9, 0)
+    calendar.book(datetime(2024, 1, 1, 9, 0))
+    assert calendar.next_free_slot(datetime(2024, 1, 1, 8, 0), 6) is None
+
+
+@pytest.mark.parametrize('shared_index', [False, True])
+def test_concurrent_booking_never_double_books(tmp_path, shared_index):
+    """Stress test: many threads booking the same providers at once"""
+    import threading
+    from sqlalchemy import func
+    from src.services.provider_calendar import CalendarIndex
+    
+    engine = create_engine(
+        f'sqlite:///{tmp_path / "stress.db"}', connect_args={'timeout': 30}
+    )
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine)
+    
+    setup = Session()
+    setup.add(Patient(ohip_number='1234567890AB', first_name='Test',
+                      last_name='Patient', date_of_birth=datetime(1980, 1, 1)))
+    for i in range(2):
+        provider = Provider(name=f'Dr. {i}', license_number=f'LIC-{i}', rating=4.5,
+                            average_wait_time_days=1, accepts_new_patients=True)
+        setup.add(provider)
+        setup.flush()
+        for day in range(7):
+            setup.add(ProviderAvailability(provider_id=provider.id, day_of_week=day,
+                                           start_time='09:00', end_time='17:00'))
+    setup.commit()
+    setup.close()
+    
+    calendar_index = CalendarIndex() if shared_index else None
+    threads_count, bookings_per_thread = 8, 12
+    barrier = threading.Barrier(threads_count)
+    results = []
+    errors = []
+    
+    def worker():
+        session = Session()
+        service = AppointmentService(session, calendar_index=calendar_index)
+        barrier.wait()
+        try:
+            for _ in range(bookings_per_thread):
+                results.append(service.schedule_appointment(
+                    patient_id=1, service_type='consultation', urgency='routine'
+                ))
+        except Exception as exc:  # pragma: no cover - surfaced below
+            errors.append(exc)
+        finally:
+            session.close()
+    
+    threads = [threading.Thread(target=worker) for _ in range(threads_count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    assert not errors
+    assert [r for r in results if not r["success"]] == []
+    
+    check = Session()
+    duplicates = check.query(
+        Appointment.provider_id, Appointment.scheduled_datetime
+    ).filter(
+        Appointment.status.in_(['scheduled', 'confirmed'])
+    ).group_by(
+        Appointment.provider_id, Appointment.scheduled_datetime
+    ).having(func.count() > 1).all()
+    total = check.query(Appointment).count()
+    check.close()
+    engine.dispose()
+    
+    assert duplicates == []
+    assert total == threads_count * bookings_per_thread
+
+
+def _priority_order(service, requests):
+    return sorted(range(len(requests)), key=lambda i: (
+        service._get_max_wait_time(requests[i]['urgency']),
+        service._get_search_window_days(requests[i]['urgency']), i
+    ))
+
+
+def test_bulk_scheduling_matches_sequential_in_priority_order():
+    """Test that bulk assignment equals one-by-one booking by priority"""
+    now = datetime.now()
+    rng = random.Random(3)
+    requests = [
+        {
+            'patient_id': 1,
+            'service_type': 'consultation',
+            'urgency': rng.choice(['critical', 'urgent', 'routine', 'non-urgent']),
+            'preferences': rng.choice([{}, {'specialty': 'Cardiology'}])
+        }
+        for _ in range(120)
+    ]
+    
+    sessions = []
+    for _ in range(2):
+        engine = create_engine('sqlite:///:memory:')
+        Base.metadata.create_all(engine)
+        session = sessionmaker(bind=engine)()
+        _seed_roster(session, now)
+        sessions.append(session)
+    bulk_db, sequential_db = sessions
+    
+    results = AppointmentService(bulk_db).schedule_appointments(requests, now=now)
+    
+    # Reference: the single-booking path applied in priority order
+    service = AppointmentService(sequential_db)
+    expected = [None] * len(requests)
+    for i in _priority_order(service, requests):
+        req = requests[i]
+        providers = service._find_suitable_providers(
+            req['service_type'], specialty=req['preferences'].get('specialty'),
+            max_wait_time=service._get_max_wait_time(req['urgency'])
+        )
+        slots = service._find_available_slots(
+            [p.id for p in providers], req['urgency'], now=now
+        )
+        provider = next((p for p in providers if p.id in slots), None)
+        if provider:
+            service._create_appointment(1, provider.id, req['service_type'],
+                                        slots[provider.id], req['urgency'], provider.address)
+            expected[i] = (provider.id, slots[provider.id].isoformat())
+    
+    actual = [
+        (r['provider']['id'], r['dateTime']) if r['success'] else None
+        for r in results
+    ]
+    assert actual == expected
+    assert bulk_db.query(Appointment).filter(Appointment.status == 'scheduled').count() == \
+        sequential_db.query(Appointment).filter(Appointment.status == 'scheduled').count()
+    
+    for session in sessions:
+        session.close()
+
+
+def test_bulk_scheduling_prioritizes_urgent_requests(db_session):
+    """Test that urgent requests get earlier slots than routine ones"""
+    db_session.add(Patient(ohip_number='1234567890AB', first_name='Test',
+                           last_name='Patient', date_of_birth=datetime(1980, 1, 1)))
+    provider = Provider(name='Dr. Solo', license_number='LIC-1', rating=4.5,
+                        average_wait_time_days=0.5, accepts_new_patients=True)
+    db_session.add(provider)
+    db_session.flush()
+    for day in range(7):
+        db_session.add(ProviderAvailability(provider_id=provider.id, day_of_week=day,
+                                            start_time='09:00', end_time='10:00'))
+    db_session.commit()
+    
+    requests = [
+        {'patient_id': 1, 'service_type': 'checkup', 'urgency': 'routine'},
+        {'patient_id': 1, 'service_type': 'checkup', 'urgency': 'critical'},
+    ]
+    results = AppointmentService(db_session).schedule_appointments(requests)
+    
+    assert all(r['success'] for r in results)
+    assert results[1]['dateTime'] < results[0]['dateTime']
+
+
+def test_bulk_scheduling_retries_only_slot_conflicts(db_session, roster, monkeypatch):
+    """Test that a lost slot is reassigned while other integrity errors surface"""
+    from sqlalchemy.exc import IntegrityError
+    
+    service = AppointmentService(db_session)
+    assign = service._assign_slots
+    stolen = []
+    
+    def assign_then_lose_a_slot(*args):
+        results, assignments = assign(*args)
+        if not stolen:
+            # A concurrent request books the first slot before we commit
+            _, provider, slot = assignments[0]
+            db_session.add(Appointment(patient_id=1, provider_id=provider.id,
+                                       scheduled_datetime=slot, status='scheduled'))
+            db_session.commit()
+            stolen.append((provider.id, slot))
+        return results, assignments
+    
+    monkeypatch.setattr(service, '_assign_slots', assign_then_lose_a_slot)
+    requests = [{'patient_id': 1, 'service_type': 'checkup', 'urgency': 'routine'}] * 3
+    results = service.schedule_appointments(requests)
+    assert all(r['success'] for r in results)
+    assert stolen[0] not in {(r['provider']['id'], datetime.fromisoformat(r['dateTime'])) for r in results}
+    
+    # A missing patient is not a slot conflict and is not retried
+    monkeypatch.setattr(service, '_assign_slots', assign)
+    with pytest.raises(IntegrityError):
+        service.schedule_appointments([{'patient_id': None, 'service_type': 'checkup', 'urgency': 'routine'}])
+
+
+def test_geo_index_matches_brute_force():
+    """Test radius and nearest queries against a full haversine scan"""
+    rng = random.Random(3)
+    points = {
+        i: (rng.uniform(-89, 89), rng.uniform(-180, 180) if i % 2 else rng.uniform(-79.8, -79.0))
+        for i in range(1, 2001)
+    }
+    index = ProviderGeoIndex(cell_degrees=0.25)
+    for provider_id, (lat, lon) in points.items():
+        index.upsert(provider_id, lat, lon)
+    
+    queries = [(43.65, -79.38), (89.5, 10.0), (0.0, 179.99), (-45.0, -179.9)]
+    for lat, lon in queries:
+        distances = sorted(
+            (haversine_km(lat, lon, plat, plon), provider_id)
+            for provider_id, (plat, plon) in points.items()
+        )
+        for radius in (5, 50, 500, 5000, 25000):
+            expected = [(pid, d) for d, pid in distances if d <= radius]
+            assert index.within_radius(lat, lon, radius) == expected
+        assert [pid for pid, _ in index.nearest(lat, lon, 10)] == [pid for _, pid in distances[:10]]
+
+
+def test_geo_index_syncs_incrementally(db_session):
+    """Test that sync picks up new and moved providers only"""
+    near = Provider(name='Dr. Near', license_number='LIC-1', latitude=43.65, longitude=-79.38)
+    far = Provider(name='Dr. Far', license_number='LIC-2', latitude=45.42, longitude=-75.69)
+    db_session.add_all([near, far])
+    db_session.commit()
+    
+    index = ProviderGeoIndex()
+    index.sync(db_session)
+    assert [pid for pid, _ in index.within_radius(43.65, -79.38, 10)] == [near.id]
+    
+    far.latitude, far.longitude = 43.66, -79.39
+    far.updated_at = datetime.utcnow() + timedelta(seconds=1)
+    db_session.commit()
+    index.sync(db_session, force=True)
+    assert [pid for pid, _ in index.within_radius(43.65, -79.38, 10)] == [near.id, far.id]
+    assert len(index) == 2
+
+
+def test_location_preference_ranks_by_distance(db_session):
+    """Test that schedulers pick the nearest provider within range"""
+    db_session.add(Patient(ohip_number='1234567890AB', first_name='Test',
+                           last_name='Patient', date_of_birth=datetime(1980, 1, 1)))
+    providers = [
+        Provider(name='Dr. Best', license_number='LIC-1', rating=5.0, latitude=43.75, longitude=-79.38),
+        Provider(name='Dr. Close', license_number='LIC-2', rating=4.0, latitude=43.66, longitude=-79.38),
+        Provider(name='Dr. Away', license_number='LIC-3', rating=5.0, latitude=45.42, longitude=-75.69),
+    ]
+    db_session.add_all(providers)
+    db_session.flush()
+    for provider in providers:
+        for day in range(7):
+            db_session.add(ProviderAvailability(provider_id=provider.id, day_of_week=day,
+                                                start_time='09:00', end_time='17:00'))
+    db_session.commit()
+    
+    service = AppointmentService(db_session, geo_index=ProviderGeoIndex())
+    preferences = {'location': '43.65,-79.38', 'max_distance_km': 50}
+    found = service._find_suitable_providers('checkup', location=preferences['location'],
+                                             max_distance_km=50)
+    assert [p.name for p in found] == ['Dr. Close', 'Dr. Best']
+    
+    result = service.schedule_appointment(1, 'checkup', 'routine', preferences)
+    assert result['provider']['name'] == 'Dr. Close'
+    
+    bulk = service.schedule_appointments([
+        {'patient_id': 1, 'service_type': 'checkup', 'urgency': 'routine',
+         'preferences': {'location': {'latitude': 45.4, 'longitude': -75.7}}}
+    ])
+    assert bulk[0]['provider']['name'] == 'Dr. Away'
+
+
+@pytest.mark.parametrize('actions', [
+    ['cancel'] * 4,
+    ['complete'] * 4,
+    ['complete', 'cancel'] * 2,
+])
+def test_concurrent_status_changes_count_once(tmp_path, actions):
+    """Test that racing cancels and completions update the counters once each"""
+    import threading
+    from src.database.models import AppointmentDailyStats
+    from sqlalchemy import func
+    from src.services.appointment_stats import COUNTERS, rebuild_appointment_stats
+    
+    engine = create_engine(f'sqlite:///{tmp_path / "race.db"}', connect_args={'timeout': 30})
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine)
+    setup = Session()
+    setup.add(Appointment(patient_id=1, provider_id=1, status='scheduled',
+                          created_at=datetime(2024, 5, 1, 9, 0),
+                          scheduled_datetime=datetime(2024, 5, 1, 15, 0)))
+    setup.commit()
+    rebuild_appointment_stats(setup)
+    setup.close()
+    
+    barrier = threading.Barrier(len(actions))
+    errors = []
+    
+    def worker(action):
+        session = Session()
+        service = AppointmentService(session)
+        barrier.wait()
+        try:
+            if action == 'cancel':
+                assert service.cancel_appointment(1)
+            else:
+                service.complete_appointment(1)
+        except Exception as exc:  # pragma: no cover - surfaced below
+            errors.append(exc)
+        finally:
+            session.close()
+    
+    threads = [threading.Thread(target=worker, args=(action,)) for action in actions]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    
+    check = Session()
+    status = check.query(Appointment.status).scalar()
+    totals = lambda: check.query(*(
+        func.sum(getattr(AppointmentDailyStats, name)) for name in COUNTERS
+    )).one()
+    counters = tuple(totals())
+    rebuild_appointment_stats(check)
+    rebuilt = tuple(totals())
+    check.close()
+    engine.dispose()
+    
+    assert status == ('completed' if set(actions) == {'complete'} else 'cancelled')
+    assert counters == pytest.approx(rebuilt)
+    assert counters[2] == (0 if status == 'completed' else 1)
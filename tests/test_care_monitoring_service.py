@@ -0,0 +1,385 @@
+"""
+Tests for the care monitoring service
+"""
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import random
+import statistics
+import pytest
+from datetime import date, datetime, timedelta
+from sqlalchemy import and_, create_engine, event, func
+from sqlalchemy.orm import sessionmaker
+
+from src.database.models import Base, Patient, Provider, Appointment, CareJourney, SystemMetrics
+from src.services.care_monitoring_service import CareMonitoringService, copy_legacy_milestones
+
+NOW = datetime(2024, 6, 1, 12, 0)
+
+
+@pytest.fixture
+def db_session():
+    """Create a test database session"""
+    engine = create_engine('sqlite:///:memory:')
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine)
+    session = Session()
+    yield session
+    session.close()
+
+
+def _seed_patients(db_session, count=12):
+    """Patients with a mix of journeys, milestones and appointment histories"""
+    rng = random.Random(4)
+    provider = Provider(name='Dr. Gap', license_number='LIC-1')
+    db_session.add(provider)
+    patients = [
+        Patient(ohip_number=f'{i:010d}AB', first_name='P', last_name=str(i),
+                date_of_birth=datetime(1970, 1, 1))
+        for i in range(count)
+    ]
+    db_session.add_all(patients)
+    db_session.flush()
+
+    for patient in patients:
+        for _ in range(rng.randint(0, 3)):
+            timestamps = sorted(
+                NOW - timedelta(days=rng.randint(0, 120), hours=rng.randint(0, 23))
+                for _ in range(rng.randint(0, 3))
+            )
+            milestones = [
+                {'timestamp': timestamp.isoformat(), 'type': 'checkup', 'description': 'Visit',
+                 'metadata': {'visit': i}}
+                for i, timestamp in enumerate(timestamps)
+            ]
+            db_session.add(CareJourney(
+                patient_id=patient.id, condition='Diabetes',
+                status=rng.choice(['active', 'active', 'completed']),
+                start_date=NOW - timedelta(days=200), milestones=milestones, care_gaps=[]
+            ))
+        for _ in range(rng.randint(0, 6)):
+            db_session.add(Appointment(
+                patient_id=patient.id, provider_id=provider.id, service_type='checkup',
+                scheduled_datetime=NOW + timedelta(days=rng.randint(-200, 30), minutes=rng.randint(0, 600)),
+                status=rng.choice(['scheduled', 'completed', 'completed', 'cancelled'])
+            ))
+    db_session.commit()
+    # Journeys keep the legacy JSON arrays for _legacy_identify_care_gaps
+    copy_legacy_milestones(db_session)
+    return [patient.id for patient in patients]
+
+
+def _legacy_identify_care_gaps(db, patient_id, now):
+    """The per-journey query loop identify_care_gaps used to run"""
+    gaps = []
+    active_journeys = db.query(CareJourney).filter(
+        and_(CareJourney.patient_id == patient_id, CareJourney.status == 'active')
+    ).all()
+
+    for journey in active_journeys:
+        # The original query had no ORDER BY and followed the
+        # (patient_id, status, scheduled_datetime) index; made explicit here
+        missed = db.query(Appointment).filter(
+            and_(
+                Appointment.patient_id == patient_id,
+                Appointment.status == 'scheduled',
+                Appointment.scheduled_datetime < now
+            )
+        ).order_by(Appointment.scheduled_datetime, Appointment.id).all()
+        missed_appointments = [
+            {'id': a.id, 'scheduled_datetime': a.scheduled_datetime.isoformat(),
+             'service_type': a.service_type}
+            for a in missed
+        ]
+        if missed_appointments:
+            gaps.append({
+                'journey_id': journey.id, 'type': 'missed_appointment', 'severity': 'high',
+                'description': f'{len(missed_appointments)} missed appointment(s)',
+                'appointments': missed_appointments
+            })
+
+        last_appointment = db.query(Appointment).filter(
+            and_(Appointment.patient_id == patient_id, Appointment.status == 'completed')
+        ).order_by(Appointment.scheduled_datetime.desc()).first()
+        if last_appointment:
+            days_since = (now - last_appointment.scheduled_datetime).days
+            if days_since > 90:
+                gaps.append({
+                    'journey_id': journey.id, 'type': 'overdue_followup', 'severity': 'medium',
+                    'description': f'No follow-up appointment in {days_since} days',
+                    'last_appointment_date': last_appointment.scheduled_datetime.isoformat()
+                })
+
+        if journey.milestones:
+            last_milestone_date = datetime.fromisoformat(journey.milestones[-1]['timestamp'])
+            days_since_milestone = (now - last_milestone_date).days
+            if days_since_milestone > 30:
+                gaps.append({
+                    'journey_id': journey.id, 'type': 'stalled_progress', 'severity': 'medium',
+                    'description': f'No progress in {days_since_milestone} days',
+                    'last_milestone': journey.milestones[-1]
+                })
+
+    return gaps
+
+
+def test_care_gaps_match_legacy_loop(db_session):
+    """Test that batched gap detection returns exactly the old per-journey results"""
+    patient_ids = _seed_patients(db_session)
+    service = CareMonitoringService(db_session)
+    found_gaps = 0
+
+    for patient_id in patient_ids:
+        expected = _legacy_identify_care_gaps(db_session, patient_id, NOW)
+        assert service.identify_care_gaps(patient_id, now=NOW) == expected
+        found_gaps += len(expected)
+
+        db_session.expire_all()
+        for journey in db_session.query(CareJourney).filter(CareJourney.patient_id == patient_id):
+            journey_gaps = [g for g in expected if g['journey_id'] == journey.id]
+            if journey.status == 'active':
+                assert journey.care_gaps == journey_gaps
+
+    assert found_gaps > 0
+
+
+def test_care_gaps_use_fixed_query_count(db_session):
+    """Test that query count does not grow with the number of journeys"""
+    patient_ids = _seed_patients(db_session, count=1)
+    for _ in range(20):
+        db_session.add(CareJourney(patient_id=patient_ids[0], condition='COPD', status='active',
+                                   milestones=[], care_gaps=[]))
+    db_session.commit()
+
+    statements = []
+    engine = db_session.get_bind()
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(engine, 'before_cursor_execute', listener)
+    try:
+        CareMonitoringService(db_session).identify_care_gaps(patient_ids[0], now=NOW)
+    finally:
+        event.remove(engine, 'before_cursor_execute', listener)
+
+    selects = [s for s in statements if s.lstrip().upper().startswith('SELECT')]
+    assert len(selects) == 3
+
+
+def test_sweep_matches_per_patient_gaps(db_session, tmp_path):
+    """Test that the chunked sweep writes the same gaps as per-patient detection"""
+    from src.jobs.care_gap_sweep import run_sweep
+
+    patient_ids = _seed_patients(db_session, count=30)
+    service = CareMonitoringService(db_session)
+    expected = {}
+    for patient_id in patient_ids:
+        for gap in service.identify_care_gaps(patient_id, now=NOW):
+            expected.setdefault(gap['journey_id'], []).append(gap)
+
+    db_session.query(CareJourney).update({CareJourney.care_gaps: []})
+    db_session.commit()
+
+    # Interrupt after two chunks, then resume from the checkpoint
+    checkpoint = tmp_path / 'sweep.json'
+    progress = []
+
+    def stop_early(state):
+        progress.append(dict(state))
+        if len(progress) == 2:
+            raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        run_sweep(db_session, chunk_size=5, checkpoint_path=str(checkpoint), now=NOW, progress=stop_early)
+    assert checkpoint.exists()
+
+    state = run_sweep(db_session, chunk_size=5, checkpoint_path=str(checkpoint),
+                      now=datetime(2030, 1, 1), progress=progress.append)
+    assert not checkpoint.exists()
+    assert state['now'] == NOW.isoformat()
+
+    db_session.expire_all()
+    active = db_session.query(CareJourney).filter(CareJourney.status == 'active').all()
+    assert state['journeys'] == len(active)
+    assert state['gaps'] == sum(len(gaps) for gaps in expected.values())
+    for journey in active:
+        assert journey.care_gaps == expected.get(journey.id, [])
+
+
+def test_incremental_metrics_match_full_scan(db_session):
+    """Test that running counters give the metrics the full scan computed"""
+    from src.database.models import AppointmentDailyStats, ProviderAvailability
+    from src.services.appointment_service import AppointmentService
+    from src.services.appointment_stats import COUNTERS, rebuild_appointment_stats
+
+    patient_ids = _seed_patients(db_session, count=3)
+    provider = db_session.query(Provider).first()
+    for day in range(7):
+        db_session.add(ProviderAvailability(provider_id=provider.id, day_of_week=day,
+                                            start_time='08:00', end_time='18:00'))
+    db_session.commit()
+    # Seeded rows bypass the service, so backfill their counters first
+    rebuild_appointment_stats(db_session)
+
+    appointment_service = AppointmentService(db_session)
+    booked = [
+        appointment_service.schedule_appointment(patient_ids[i % 3], 'checkup', 'routine')
+        for i in range(12)
+    ]
+    appointment_service.schedule_appointments([
+        {'patient_id': patient_ids[0], 'service_type': 'checkup', 'urgency': 'urgent'}
+        for _ in range(4)
+    ])
+    ids = [result['appointmentId'] for result in booked]
+    for appointment_id in ids[:6]:
+        assert appointment_service.complete_appointment(appointment_id)['success']
+    assert appointment_service.complete_appointment(ids[0])['success']
+    for appointment_id in ids[4:8]:
+        assert appointment_service.cancel_appointment(appointment_id)
+    assert not appointment_service.complete_appointment(ids[7])['success']
+
+    # Each day's counters are spread over slot rows
+    daily = lambda: {
+        stat_date: (created, completed, cancelled, round(wait_hours, 6))
+        for stat_date, created, completed, cancelled, wait_hours in db_session.query(
+            AppointmentDailyStats.stat_date,
+            *(func.sum(getattr(AppointmentDailyStats, name)) for name in COUNTERS)
+        ).group_by(AppointmentDailyStats.stat_date)
+    }
+    incremental = daily()
+    rebuild_appointment_stats(db_session)
+    assert incremental == daily()
+
+    # The metrics the endpoint used to compute by scanning appointments
+    now = datetime.utcnow()
+    window = [a for a in db_session.query(Appointment) if a.created_at >= now - timedelta(days=30)]
+    waits = [(a.scheduled_datetime - a.created_at).total_seconds() / 3600
+             for a in window if a.status == 'completed']
+
+    care_service = CareMonitoringService(db_session)
+    metrics = care_service.get_system_metrics()
+    assert metrics['recent_appointments'] == len(window)
+    assert metrics['average_wait_time_hours'] == round(sum(waits) / len(waits), 2)
+    assert metrics['completed_appointments'] == len(waits)
+    assert metrics['wait_time_p50_hours'] == pytest.approx(statistics.median(waits), abs=0.01)
+    assert metrics['total_patients'] == 3
+    assert metrics['active_care_journeys'] == db_session.query(CareJourney).filter(
+        CareJourney.status == 'active').count()
+
+    # Fresh snapshots are reused; history lists them in time order
+    assert care_service.get_system_metrics() == metrics
+    care_service.rollup_system_metrics(now=now + timedelta(hours=1))
+    history = care_service.get_metrics_history(since=now - timedelta(minutes=1))
+    assert [h['as_of'] for h in history] == sorted(h['as_of'] for h in history)
+    assert len(history) == 2
+
+
+def test_metrics_history_returns_latest_snapshots(db_session):
+    """Test that history without since is the newest snapshots, oldest first"""
+    start = datetime(2024, 1, 1)
+    db_session.add_all([
+        SystemMetrics(metric_date=start + timedelta(hours=hour), total_patients=hour)
+        for hour in range(10)
+    ])
+    db_session.commit()
+
+    care_service = CareMonitoringService(db_session)
+    latest = care_service.get_metrics_history(limit=3)
+    assert [h['total_patients'] for h in latest] == [7, 8, 9]
+
+    until = care_service.get_metrics_history(until=start + timedelta(hours=5), limit=2)
+    assert [h['total_patients'] for h in until] == [4, 5]
+
+    since = care_service.get_metrics_history(since=start + timedelta(hours=2), limit=2)
+    assert [h['total_patients'] for h in since] == [2, 3]
+
+
+@pytest.mark.parametrize('dialect', ['sqlite', 'other'])
+def test_daily_stats_spread_over_slots(db_session, monkeypatch, dialect):
+    """Test that a day's counters land on several slot rows that sum to the totals"""
+    from src.database.models import AppointmentDailyStats
+    from src.services.appointment_stats import STAT_SLOTS, record_appointment_stats
+
+    # Databases without ON CONFLICT take the update-then-insert path
+    monkeypatch.setattr(db_session.get_bind().dialect, 'name', dialect)
+    for _ in range(60):
+        record_appointment_stats(db_session, date(2024, 5, 1), created=1, completed=1,
+                                 completed_wait_hours=2.5)
+    db_session.commit()
+
+    rows = db_session.query(AppointmentDailyStats).all()
+    assert 1 < len(rows) <= STAT_SLOTS
+    assert sum(row.appointments_created for row in rows) == 60
+    assert sum(row.completed_wait_hours for row in rows) == pytest.approx(150)
+
+
+@pytest.mark.parametrize('dialect', ['sqlite', 'other'])
+@pytest.mark.parametrize('completed', [0, 1, 2, 7, 40])
+def test_wait_percentiles_aggregate_in_sql(db_session, monkeypatch, completed, dialect):
+    """Test SQL percentiles against numpy and that no appointment rows are loaded"""
+    import numpy as np
+    from src.services.appointment_stats import completed_wait_percentiles
+
+    # Databases without a known interval expression sort streamed waits
+    monkeypatch.setattr(db_session.get_bind().dialect, 'name', dialect)
+
+    rng = random.Random(completed)
+    since = datetime(2024, 5, 1)
+    waits = []
+    for i in range(completed + 10):
+        created_at = since + timedelta(days=rng.randint(-10, 20), minutes=rng.randint(0, 900))
+        wait = rng.uniform(0, 400)
+        status = 'completed' if i < completed else 'scheduled'
+        if status == 'completed' and created_at >= since:
+            waits.append(wait)
+        db_session.add(Appointment(patient_id=1, provider_id=1, status=status, created_at=created_at,
+                                   scheduled_datetime=created_at + timedelta(hours=wait)))
+    db_session.commit()
+
+    statements = []
+    engine = db_session.get_bind()
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(engine, 'before_cursor_execute', listener)
+    try:
+        result = completed_wait_percentiles(db_session, since, (0.5, 0.9))
+    finally:
+        event.remove(engine, 'before_cursor_execute', listener)
+
+    assert not any('appointments.service_type' in s for s in statements)
+    for p in (0.5, 0.9):
+        if waits:
+            assert result[p] == pytest.approx(np.percentile(waits, p * 100), abs=1e-4)
+        else:
+            assert result[p] is None
+
+
+def test_milestones_append_without_reading_history(db_session):
+    """Test that adding a milestone is one UPDATE and one INSERT however long the journey"""
+    patient_ids = _seed_patients(db_session, count=1)
+    service = CareMonitoringService(db_session)
+    journey = service.create_care_journey(patient_ids[0], 'COPD', initial_triage_id=7)
+    for i in range(200):
+        assert service.add_milestone(journey['id'], 'checkup', f'Visit {i}', {'visit': i})
+
+    statements = []
+    engine = db_session.get_bind()
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(engine, 'before_cursor_execute', listener)
+    try:
+        assert service.add_milestone(journey['id'], 'lab', 'Bloodwork', {'panel': 'A1C'})
+    finally:
+        event.remove(engine, 'before_cursor_execute', listener)
+    assert [s.split()[0] for s in statements] == ['UPDATE', 'INSERT']
+    assert not service.add_milestone(10 ** 6, 'lab', 'Missing journey')
+
+    journeys = {j['id']: j for j in service.get_patient_journey(patient_ids[0])}
+    milestones = journeys[journey['id']]['milestones']
+    assert len(milestones) == 202
+    assert set(milestones[0]) == {'timestamp', 'type', 'description', 'triage_id'}
+    assert milestones[0]['triage_id'] == 7
+    assert milestones[-1]['metadata'] == {'panel': 'A1C'}
+
+    # Gap detection sees the latest milestone
+    later = datetime.utcnow() + timedelta(days=45)
+    stalled = [g for g in service.identify_care_gaps(patient_ids[0], now=later)
+               if g['journey_id'] == journey['id'] and g['type'] == 'stalled_progress']
+    assert stalled[0]['last_milestone'] == milestones[-1]
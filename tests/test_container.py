@@ -0,0 +1,101 @@
+"""
+Tests for the application service container
+"""
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import threading
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import scoped_session, sessionmaker
+
+from src.container import AppConfig, ServiceContainer
+from src.database.models import Base, Provider
+
+
+@pytest.fixture
+def session(tmp_path):
+    """Scoped sessions on a file database"""
+    engine = create_engine(f'sqlite:///{tmp_path / "test.db"}')
+    Base.metadata.create_all(engine)
+    session = scoped_session(sessionmaker(bind=engine))
+    yield session
+    session.remove()
+    engine.dispose()
+
+
+def test_config_is_read_from_mapping():
+    """Test that settings come from the given environment with defaults"""
+    config = AppConfig({'PROVIDER_CACHE_SIZE': '0', 'ENABLE_UBER_HEALTH': 'False',
+                        'UBER_HEALTH_API_URL': 'http://127.0.0.1:1'})
+    assert config.provider_cache_size == 0
+    assert config.uber_health_enabled is False
+    assert config.max_triage_batch_size == 1000
+    assert config.uber_health_webhook_secret is None
+
+
+def test_services_are_shared_and_configured(session):
+    """Test that services are built once with the container's state"""
+    services = ServiceContainer(
+        AppConfig({'ENABLE_UBER_HEALTH': 'false', 'UBER_HEALTH_API_URL': 'http://127.0.0.1:1',
+                   'PROVIDER_CACHE_SIZE': '0'}),
+        session
+    )
+    assert services.ride_dispatcher is None
+    assert services.transportation.enabled is False
+    assert services.provider_cache.backend is None
+    assert services.appointments.geo_index is services.providers.geo_index is services.geo_index
+    assert services.appointments.calendar_index is services.calendar_index
+    services.shutdown()
+
+
+def test_services_use_the_current_threads_session(session):
+    """Test that one service object serves each thread on its own session"""
+    services = ServiceContainer(AppConfig({}), session)
+    seen = []
+
+    def handle():
+        seen.append(services.care.db())
+        session.remove()
+
+    threads = [threading.Thread(target=handle) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert seen[0] is not seen[1]
+    services.shutdown()
+
+
+def test_provider_changes_invalidate_container_caches(session):
+    """Test that committed provider changes reach the shared caches"""
+    services = ServiceContainer(AppConfig({}), session)
+    session.add(Provider(name='Dr. Before', license_number='L-1', rating=4.0))
+    session.commit()
+    provider_id = session.query(Provider.id).scalar()
+
+    assert services.providers.get_provider(provider_id)['name'] == 'Dr. Before'
+    services.provider_cache.get_provider(provider_id, lambda: services.providers.get_provider(provider_id))
+
+    session.get(Provider, provider_id).name = 'Dr. After'
+    session.commit()
+    provider = services.provider_cache.get_provider(
+        provider_id, lambda: services.providers.get_provider(provider_id))
+    assert provider['name'] == 'Dr. After'
+    services.shutdown()
+
+
+def test_deleted_providers_leave_the_location_index(session):
+    """Test that a committed delete drops the provider from the shared geo index"""
+    services = ServiceContainer(AppConfig({}), session)
+    session.add(Provider(name='Dr. Gone', license_number='L-1', latitude=43.65, longitude=-79.38))
+    session.commit()
+    provider_id = session.query(Provider.id).scalar()
+    services.geo_index.sync(session)
+    assert [pid for pid, _ in services.geo_index.within_radius(43.65, -79.38, 1)] == [provider_id]
+
+    session.delete(session.get(Provider, provider_id))
+    session.commit()
+    assert services.geo_index.within_radius(43.65, -79.38, 1) == []
+    services.shutdown()
@@ -0,0 +1,105 @@
+"""
+Tests for the shared outbound HTTP clients
+"""
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import time
+import pytest
+import requests
+from concurrent.futures import ThreadPoolExecutor
+
+from src.services.fake_uber_health import FakeUberHealth
+from src.services.http_client import (
+    CircuitBreaker, CircuitOpenError, HostBusyError, HttpClient,
+    close_http_clients, get_http_client, http_client_stats
+)
+
+RIDE = {'pickup': {'address': '1 Home St'}, 'dropoff': {'address': '2 Clinic Rd'}}
+
+
+def test_connections_are_kept_alive():
+    """Test that sequential requests reuse one pooled connection"""
+    with FakeUberHealth() as fake:
+        client = HttpClient()
+        for _ in range(20):
+            assert client.post(f'{fake.url}/v1/health/requests', json=RIDE).status_code == 200
+        assert fake.connections == 1
+
+        stats = client.stats()[fake.url.split('//')[1]]
+        assert stats['requests'] == 20 and stats['failures'] == 0
+        assert stats['latency_ms']['p50'] <= stats['latency_ms']['max']
+        client.close()
+
+
+def test_per_host_concurrency_limit():
+    """Test that callers beyond max_concurrency wait for a slot, or give up"""
+    with FakeUberHealth(latency=0.1) as fake:
+        client = HttpClient(pool_size=2, max_concurrency=2)
+        url = f'{fake.url}/v1/health/requests'
+        with ThreadPoolExecutor(max_workers=6) as pool:
+            responses = list(pool.map(lambda _: client.post(url, json=RIDE), range(6)))
+        assert [r.status_code for r in responses] == [200] * 6
+        assert fake.max_in_flight == 2
+
+        impatient = HttpClient(max_concurrency=1, acquire_timeout=0.01)
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            futures = [pool.submit(impatient.post, url, json=RIDE) for _ in range(2)]
+            errors = [f.exception() for f in futures]
+        assert sum(isinstance(e, HostBusyError) for e in errors) == 1
+        assert list(impatient.stats().values())[0]['rejected'] == 1
+
+
+def test_circuit_opens_and_recovers():
+    """Test that repeated failures stop requests until a trial call succeeds"""
+    with FakeUberHealth(fail_first=3) as fake:
+        client = HttpClient(failure_threshold=3, reset_timeout=0.2)
+        url = f'{fake.url}/v1/health/requests'
+        assert [client.post(url, json=RIDE).status_code for _ in range(3)] == [503] * 3
+
+        with pytest.raises(CircuitOpenError):
+            client.post(url, json=RIDE)
+        assert fake.requests == 3
+        assert isinstance(CircuitOpenError(), requests.RequestException)
+
+        time.sleep(0.25)
+        assert client.post(url, json=RIDE).status_code == 200
+        stats = list(client.stats().values())[0]
+        assert stats['circuit'] == 'closed' and stats['circuit_opens'] == 1
+        assert stats['failures'] == 3 and stats['rejected'] == 1
+
+
+def test_timeouts_count_as_failures():
+    """Test that the default timeout applies and feeds the breaker"""
+    with FakeUberHealth(latency=0.3) as fake:
+        client = HttpClient(timeout=0.05, failure_threshold=2, reset_timeout=60)
+        url = f'{fake.url}/v1/health/requests'
+        for _ in range(2):
+            with pytest.raises(requests.Timeout):
+                client.post(url, json=RIDE)
+        assert list(client.stats().values())[0]['circuit'] == 'open'
+
+
+def test_half_open_allows_a_single_trial():
+    """Test that only one caller probes a recovering host"""
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.allow() and not breaker.allow()
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED and breaker.allow() and breaker.allow()
+
+
+def test_registry_shares_clients():
+    """Test that named clients are created once per process"""
+    close_http_clients()
+    first = get_http_client('test', max_concurrency=3)
+    assert get_http_client('test', max_concurrency=99) is first
+    assert first.max_concurrency == 3
+    assert 'test' in http_client_stats()
+    close_http_clients()
+    assert get_http_client('test') is not first
+    close_http_clients()
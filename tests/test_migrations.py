@@ -0,0 +1,228 @@
+"""
+Tests for schema migrations
+"""
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from sqlalchemy import create_engine, inspect
+
+from src.database.models import Base
+from src.database.migrations import apply_migrations
+
+
+def test_migration_adds_missing_indexes(tmp_path):
+    """Test that indexes are added to a database created before they existed"""
+    engine = create_engine(f'sqlite:///{tmp_path / "legacy.db"}')
+    Base.metadata.create_all(engine)
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.drop(engine)
+    
+    created = apply_migrations(engine)
+    
+    assert 'ix_appointments_provider_schedule' in created
+    assert 'ix_transportation_ride_id' in created
+    index_names = {i['name'] for i in inspect(engine).get_indexes('appointments')}
+    assert 'ix_appointments_patient_status' in index_names
+    
+    # Re-running is a no-op
+    assert apply_migrations(engine) == []
+
+
+def test_migration_adds_columns_and_backfills_stats(tmp_path):
+    """Test upgrading a database from before the metrics columns and counters"""
+    from datetime import datetime, timedelta
+    from sqlalchemy import text
+    from sqlalchemy.orm import sessionmaker
+    from src.database.models import (
+        Appointment, AppointmentDailyStats, CareJourney, CareJourneyMilestone, SystemMetrics
+    )
+    from src.services.care_monitoring_service import CareMonitoringService
+    
+    engine = create_engine(f'sqlite:///{tmp_path / "legacy.db"}')
+    Base.metadata.create_all(engine)
+    AppointmentDailyStats.__table__.drop(engine)
+    CareJourneyMilestone.__table__.drop(engine)
+    with engine.begin() as conn:
+        conn.execute(text('DROP TABLE system_metrics'))
+        conn.execute(text(
+            'CREATE TABLE system_metrics (id INTEGER PRIMARY KEY, metric_date DATETIME, '
+            'total_patients INTEGER, total_appointments INTEGER)'
+        ))
+    
+    session = sessionmaker(bind=engine)()
+    created = datetime(2024, 5, 1, 9, 0)
+    session.add_all([
+        Appointment(patient_id=1, provider_id=1, scheduled_datetime=created + timedelta(hours=i),
+                    status=status, created_at=created)
+        for i, status in enumerate(['completed', 'completed', 'cancelled', 'scheduled'])
+    ])
+    legacy_milestones = [
+        {'timestamp': '2024-05-01T09:00:00', 'type': 'triage',
+         'description': 'Initial symptom assessment', 'triage_id': 3},
+        {'timestamp': '2024-05-02T10:30:00.250000', 'type': 'checkup',
+         'description': 'Visit', 'metadata': {'bp': '120/80'}}
+    ]
+    session.add(CareJourney(patient_id=1, condition='Asthma', status='active',
+                            start_date=created, milestones=legacy_milestones))
+    session.add(CareJourney(patient_id=1, condition='None', status='active', start_date=created))
+    session.commit()
+    
+    created_items = apply_migrations(engine)
+    
+    assert 'system_metrics.active_care_journeys' in created_items
+    assert session.query(CareJourneyMilestone).count() == 2
+    journeys = CareMonitoringService(session).get_patient_journey(1)
+    assert [j['milestones'] for j in journeys if j['condition'] == 'Asthma'] == [legacy_milestones]
+    assert 'ix_system_metrics_metric_date' in created_items
+    stats = session.query(AppointmentDailyStats).one()
+    assert (stats.appointments_created, stats.appointments_completed,
+            stats.appointments_cancelled, stats.completed_wait_hours) == (4, 2, 1, 1.0)
+    session.add(SystemMetrics(recent_appointments=4, active_care_journeys=0))
+    session.commit()
+    session.close()
+    
+    assert apply_migrations(engine) == []
+
+
+def test_migration_adds_provider_text_search(tmp_path):
+    """Test that an existing providers table gets its FTS index, filled and kept current"""
+    from sqlalchemy.orm import sessionmaker
+    from src.database.models import Provider
+    from src.database.text_search import FTS_TABLE, drop_text_search
+    from src.services.provider_service import ProviderService
+    
+    engine = create_engine(f'sqlite:///{tmp_path / "legacy.db"}')
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        drop_text_search(conn)
+    session = sessionmaker(bind=engine)()
+    session.add(Provider(name='Dr. Chen', specialty='Cardiology', license_number='L-1'))
+    session.commit()
+    
+    assert FTS_TABLE in apply_migrations(engine)
+    session.add(Provider(name='Dr. Amy', specialty='Pediatric Cardiology', license_number='L-2'))
+    session.commit()
+    page = ProviderService(session).search_providers(specialty='cardio')
+    assert [p['name'] for p in page['providers']] == ['Dr. Chen', 'Dr. Amy']
+    session.close()
+    
+    assert apply_migrations(engine) == []
+
+
+def test_migration_stops_on_double_bookings(tmp_path):
+    """Test that duplicate active slots are reported before any change, then resolved"""
+    from datetime import datetime
+    import pytest
+    from sqlalchemy.orm import sessionmaker
+    from src.database.models import Appointment
+    from src.database.migrations import DuplicateSlotError, SLOT_INDEX, cancel_duplicate_slots
+    
+    engine = create_engine(f'sqlite:///{tmp_path / "legacy.db"}')
+    Base.metadata.create_all(engine)
+    for index in Appointment.__table__.indexes:
+        if index.name == SLOT_INDEX:
+            index.drop(engine)
+    
+    slot = datetime(2024, 5, 1, 9, 0)
+    session = sessionmaker(bind=engine)()
+    session.add_all([
+        Appointment(patient_id=1, provider_id=1, scheduled_datetime=slot, status='scheduled'),
+        Appointment(patient_id=2, provider_id=1, scheduled_datetime=slot, status='confirmed'),
+        Appointment(patient_id=3, provider_id=1, scheduled_datetime=slot, status='cancelled'),
+        Appointment(patient_id=4, provider_id=2, scheduled_datetime=slot, status='scheduled'),
+    ])
+    session.commit()
+    
+    with pytest.raises(DuplicateSlotError) as error:
+        apply_migrations(engine)
+    assert error.value.duplicates == [(1, slot, [1, 2])]
+    assert 'provider 1 at 2024-05-01 09:00: appointments 1, 2' in str(error.value)
+    assert SLOT_INDEX not in {i['name'] for i in inspect(engine).get_indexes('appointments')}
+    
+    assert cancel_duplicate_slots(engine) == [2]
+    assert SLOT_INDEX in apply_migrations(engine)
+    assert [a.status for a in session.query(Appointment).order_by(Appointment.id)] == [
+        'scheduled', 'cancelled', 'cancelled', 'scheduled'
+    ]
+    session.close()
+
+
+def test_backfill_runs_until_recorded(tmp_path):
+    """Test that a counters table left empty by an earlier failed run is still backfilled"""
+    from datetime import datetime
+    from sqlalchemy.orm import sessionmaker
+    from src.database.models import Appointment, AppointmentDailyStats, SchemaBackfill
+    
+    # Tables created by an earlier run that stopped before its backfills
+    engine = create_engine(f'sqlite:///{tmp_path / "legacy.db"}')
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    session.add_all([
+        Appointment(patient_id=1, provider_id=i, scheduled_datetime=datetime(2024, 5, 2, 9, 0),
+                    status='scheduled', created_at=datetime(2024, 5, 1, 9, 0))
+        for i in range(3)
+    ])
+    session.commit()
+    
+    apply_migrations(engine)
+    assert session.query(AppointmentDailyStats.appointments_created).scalar() == 3
+    assert session.get(SchemaBackfill, 'appointment_daily_stats') is not None
+    
+    # Completed backfills are not repeated
+    session.query(AppointmentDailyStats).delete()
+    session.commit()
+    apply_migrations(engine)
+    assert session.query(AppointmentDailyStats).count() == 0
+    session.close()
+
+
+def test_milestone_copy_resumes_without_duplicates(tmp_path):
+    """Test that the legacy milestone copy runs until recorded and skips copied entries"""
+    from datetime import datetime
+    from sqlalchemy.orm import sessionmaker
+    from src.database.models import CareJourney, CareJourneyMilestone, SchemaBackfill
+    from src.services.care_monitoring_service import copy_legacy_milestones
+    
+    engine = create_engine(f'sqlite:///{tmp_path / "legacy.db"}')
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    session.add(CareJourney(patient_id=1, condition='Asthma', status='active', start_date=datetime(2024, 5, 1),
+                            milestones=[
+                                {'timestamp': '2024-05-01T09:00:00', 'type': 'triage', 'description': 'A'},
+                                {'timestamp': '2024-05-02T09:00:00.500000', 'type': 'visit', 'description': 'B'}
+                            ]))
+    session.commit()
+    
+    # An earlier run copied part of the history before stopping
+    assert copy_legacy_milestones(session) == 2
+    session.query(CareJourneyMilestone).filter(CareJourneyMilestone.description == 'B').delete()
+    session.commit()
+    
+    apply_migrations(engine)
+    assert sorted(m.description for m in session.query(CareJourneyMilestone)) == ['A', 'B']
+    assert session.get(SchemaBackfill, 'care_journey_milestones') is not None
+    assert copy_legacy_milestones(session) == 0
+    session.close()
+
+
+def test_schema_compiles_for_postgresql():
+    """Test that every table and index renders as valid PostgreSQL DDL"""
+    import re
+    from sqlalchemy.dialects import postgresql
+    from sqlalchemy.schema import CreateIndex, CreateTable
+    from sqlalchemy.sql.elements import TextClause
+
+    dialect = postgresql.dialect()
+    for table in Base.metadata.sorted_tables:
+        str(CreateTable(table).compile(dialect=dialect))
+        for index in table.indexes:
+            str(CreateIndex(index).compile(dialect=dialect))
+            # PostgreSQL only accepts a bare column (with a direction) or a
+            # parenthesized expression as an index element
+            for element in index.expressions:
+                if isinstance(element, TextClause):
+                    assert (re.fullmatch(r'\w+( (ASC|DESC))?', element.text)
+                            or (element.text.startswith('(') and element.text.endswith(')'))), \
+                        (index.name, element.text)
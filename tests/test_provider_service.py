@@ -0,0 +1,305 @@
+"""
+Tests for the provider directory service
+"""
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import random
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from src.cache import RedisCache
+from src.database.events import track_provider_changes
+from src.database.models import Base, Provider, ProviderAvailability
+from src.services.provider_cache import ProviderCache
+from src.services.provider_service import ProviderService, encode_cursor
+
+
+@pytest.fixture
+def db_session():
+    """Create a test database session"""
+    engine = create_engine('sqlite:///:memory:')
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine)
+    session = Session()
+    yield session
+    session.close()
+
+
+@pytest.fixture
+def directory(db_session):
+    """Seed providers with tied and missing ratings and wait times"""
+    rng = random.Random(11)
+    providers = [
+        Provider(
+            name=f'Dr. {i}', license_number=f'LIC-{i}',
+            specialty=rng.choice(['Family Medicine', 'Cardiology']),
+            rating=rng.choice([None, 3.5, 4.5, 4.5, 5.0]),
+            average_wait_time_days=rng.choice([None, 0.5, 2.0, 2.0]),
+            latitude=43.6 + rng.random() / 10, longitude=-79.4 + rng.random() / 10,
+            accepts_new_patients=rng.random() < 0.8
+        )
+        for i in range(137)
+    ]
+    db_session.add_all(providers)
+    db_session.commit()
+    return providers
+
+
+def _walk(service, **kwargs):
+    """Collect every page of a search"""
+    pages, cursor = [], None
+    while True:
+        page = service.search_providers(cursor=cursor, **kwargs)
+        pages.append(page['providers'])
+        cursor = page['nextCursor']
+        if cursor is None:
+            return pages
+
+
+def test_keyset_pages_cover_sorted_directory(db_session, directory):
+    """Test that paging returns every provider once, in sort order"""
+    service = ProviderService(db_session)
+    pages = _walk(service, limit=10, available=False)
+
+    expected = sorted(directory, key=lambda p: (
+        p.rating is None, -(p.rating or 0.0),
+        p.average_wait_time_days is None, p.average_wait_time_days or 0.0,
+        p.id
+    ))
+    assert [p['id'] for page in pages for p in page] == [p.id for p in expected]
+    assert [len(page) for page in pages] == [10] * 13 + [7]
+
+
+def test_keyset_pages_with_filters_and_distance(db_session, directory):
+    """Test paging of filtered and distance-ranked searches"""
+    service = ProviderService(db_session)
+
+    everything = service.search_providers(specialty='card', limit=100)['providers']
+    pages = _walk(service, specialty='card', limit=7)
+    assert [p['id'] for page in pages for p in page] == [p['id'] for p in everything]
+
+    nearby = service.search_providers(location='43.65,-79.35', radius_km=4, limit=100)['providers']
+    pages = _walk(service, location='43.65,-79.35', radius_km=4, limit=6)
+    assert [p['id'] for page in pages for p in page] == [p['id'] for p in nearby]
+    distances = [p['distanceKm'] for p in nearby]
+    assert distances == sorted(distances) and distances[-1] <= 4
+
+
+def test_rating_order_reads_the_directory_index(db_session, directory):
+    """Test that the rating order pages through ix_providers_rating_wait_id"""
+    statements = []
+    engine = db_session.get_bind()
+    listener = lambda conn, cursor, statement, parameters, *args: statements.append((statement, parameters))
+    event.listen(engine, 'before_cursor_execute', listener)
+    try:
+        first = ProviderService(db_session).search_providers(available=False, limit=10)
+        ProviderService(db_session).search_providers(available=False, limit=10, cursor=first['nextCursor'])
+    finally:
+        event.remove(engine, 'before_cursor_execute', listener)
+
+    for statement, parameters in statements[-2:]:
+        plan = db_session.connection().exec_driver_sql(f'EXPLAIN QUERY PLAN {statement}', parameters).all()
+        details = ' '.join(row[-1] for row in plan)
+        assert 'ix_providers_rating_wait_id' in details and 'TEMP B-TREE' not in details
+
+
+def test_geo_index_drops_providers_reported_deleted(db_session, directory):
+    """Test that committed deletes reach the index without a table scan on sync"""
+    service = ProviderService(db_session)
+    service.geo_index.sync(db_session)
+    assert len(service.geo_index) == len(directory)
+
+    def drop(deleted):
+        for provider_id in deleted:
+            service.geo_index.remove(provider_id)
+
+    track_provider_changes(db_session, lambda changed: None, on_deleted=drop)
+    deleted_id = directory[0].id
+    db_session.delete(directory[0])
+    db_session.rollback()
+    assert deleted_id in dict(service.geo_index.within_radius(43.65, -79.35, 1e308))
+    db_session.delete(directory[0])
+    db_session.commit()
+
+    statements = []
+    engine = db_session.get_bind()
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(engine, 'before_cursor_execute', listener)
+    try:
+        service.geo_index.sync(db_session, force=True)
+    finally:
+        event.remove(engine, 'before_cursor_execute', listener)
+    assert len(statements) == 1 and 'WHERE providers.updated_at >=' in statements[0]
+
+    everywhere = dict(service.geo_index.within_radius(43.65, -79.35, 1e308))
+    assert len(everywhere) == len(directory) - 1
+    assert deleted_id not in everywhere
+
+
+def test_text_filters_read_the_database_text_index(db_session, directory):
+    """Test that specialty= and q= use providers_fts, which triggers keep current"""
+    service = ProviderService(db_session)
+
+    # Bulk SQL and deletes bypass the ORM but not the triggers
+    updated_id = directory[1].id
+    db_session.query(Provider).filter(Provider.id == updated_id).update(
+        {'specialty': 'Dermatology'}, synchronize_session=False)
+    deleted_id = directory[0].id
+    db_session.delete(directory[0])
+    db_session.commit()
+
+    statements = []
+    engine = db_session.get_bind()
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(engine, 'before_cursor_execute', listener)
+    try:
+        for params in ({'specialty': 'DERMAT'}, {'search': 'derm'}):
+            page = service.search_providers(available=False, limit=100, **params)
+            assert [p['id'] for p in page['providers']] == [updated_id]
+    finally:
+        event.remove(engine, 'before_cursor_execute', listener)
+    assert all('providers_fts' in statement for statement in statements)
+
+    cardiology = _walk(service, specialty='cardio', available=False, limit=100)
+    ids = [p['id'] for page in cardiology for p in page]
+    assert deleted_id not in ids and updated_id not in ids
+    assert sorted(ids) == sorted(p.id for p in directory[2:] if p.specialty == 'Cardiology')
+
+
+def test_fuzzy_candidates_are_cut_after_other_filters(db_session, directory):
+    """Test that the fuzzy candidate limit counts only providers passing the filters"""
+    service = ProviderService(db_session)
+    service.FUZZY_SEARCH_CANDIDATES = 3
+    cardiology = sorted(p.id for p in directory if p.specialty == 'Cardiology')
+    db_session.query(Provider).filter(Provider.id.in_(cardiology[:3])).update(
+        {'accepts_new_patients': False}, synchronize_session=False)
+    db_session.commit()
+
+    page = service.search_providers(search='cardiolgy', fuzzy=True, limit=10)
+    found = [p['id'] for p in page['providers']]
+    assert len(found) == 3 and not set(found) & set(cardiology[:3])
+    assert all(p['acceptsNewPatients'] for p in page['providers'])
+
+
+def test_field_projection_selects_only_requested_columns(db_session, directory):
+    """Test that fields= limits both the response and the SELECT list"""
+    statements = []
+    engine = db_session.get_bind()
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(engine, 'before_cursor_execute', listener)
+    try:
+        page = ProviderService(db_session).search_providers(fields=['name', 'waitTime'], limit=3)
+    finally:
+        event.remove(engine, 'before_cursor_execute', listener)
+
+    assert set(page['providers'][0]) == {'name', 'waitTime'}
+    assert page['providers'][0]['waitTime'].endswith(' days')
+    select = statements[-1].split('FROM')[0]
+    assert 'providers.name' in select and 'phone' not in select and 'address' not in select
+
+
+def test_invalid_pagination_arguments(db_session, directory):
+    """Test that bad cursors, fields and limits are rejected"""
+    service = ProviderService(db_session)
+    with pytest.raises(ValueError):
+        service.search_providers(cursor='not-a-cursor')
+    with pytest.raises(ValueError):
+        service.search_providers(cursor=encode_cursor('distance', [1.0, -4.5, 2.0, 3]))
+    with pytest.raises(ValueError):
+        service.search_providers(fields=['name', 'ssn'])
+    with pytest.raises(ValueError):
+        service.search_providers(limit=0)
+
+
+class LocalRedis:
+    """In-memory stand-in for the subset of the redis client RedisCache uses"""
+
+    def __init__(self):
+        self.data = {}
+        self.down = False
+
+    def _check(self):
+        if self.down:
+            raise ConnectionError('redis unavailable')
+
+    def get(self, key):
+        self._check()
+        return self.data.get(key)
+
+    def set(self, key, value, ex=None):
+        self._check()
+        self.data[key] = value.encode()
+
+    def delete(self, key):
+        self._check()
+        self.data.pop(key, None)
+
+    def scan_iter(self, match):
+        self._check()
+        return [key for key in list(self.data) if key.startswith(match.rstrip('*'))]
+
+
+def test_shared_cache_invalidation_across_processes(db_session, directory):
+    """Test that a change seen by one process invalidates another's entries"""
+    redis = LocalRedis()
+    first = ProviderCache(RedisCache(redis, ttl=60))
+    second = ProviderCache(RedisCache(redis, ttl=60))
+    service = ProviderService(db_session)
+    params = {'specialty': 'card', 'limit': 5}
+    calls = []
+
+    def search():
+        calls.append(1)
+        return service.search_providers(**params)
+
+    page = first.search(params, search)
+    assert second.search(params, search) == page
+    assert len(calls) == 1
+
+    changed = []
+    track_provider_changes(db_session, changed.append)
+    provider_id = page['providers'][0]['id']
+    db_session.add(ProviderAvailability(provider_id=provider_id, day_of_week=0,
+                                        start_time='09:00', end_time='12:00'))
+    db_session.commit()
+    assert changed == [{provider_id}]
+
+    first.invalidate(changed[0])
+    second.search(params, search)
+    assert len(calls) == 2
+    assert second.stats()['search'] == {'hits': 1, 'misses': 1, 'hit_ratio': 0.5}
+
+
+def test_new_generation_refreshes_other_process_indexes(db_session, directory):
+    """Test that a page cached after another process's change uses fresh indexes"""
+    redis = LocalRedis()
+    first_service, second_service = ProviderService(db_session), ProviderService(db_session)
+    first = ProviderCache(RedisCache(redis, ttl=60), on_new_generation=first_service.geo_index.expire)
+    second = ProviderCache(RedisCache(redis, ttl=60), on_new_generation=second_service.geo_index.expire)
+    params = {'location': '45.42,-75.69', 'radius_km': 5, 'available': False, 'limit': 5}
+    assert second.search(params, lambda: second_service.search_providers(**params))['providers'] == []
+
+    # The first process moves a provider to Ottawa and bumps the generation
+    moved = directory[0]
+    moved.latitude, moved.longitude = 45.42, -75.69
+    db_session.commit()
+    first.invalidate({moved.id})
+
+    page = second.search(params, lambda: second_service.search_providers(**params))
+    assert [p['id'] for p in page['providers']] == [moved.id]
+
+
+def test_cache_outage_falls_back_to_loader(db_session, directory):
+    """Test that backend errors degrade to uncached reads"""
+    redis = LocalRedis()
+    backend = RedisCache(redis)
+    cache = ProviderCache(backend)
+    service = ProviderService(db_session)
+
+    redis.down = True
+    detail = cache.get_provider(directory[0].id, lambda: service.get_provider(directory[0].id))
+    assert detail['name'] == directory[0].name
+    assert backend.stats()['errors'] > 0
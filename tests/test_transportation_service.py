@@ -0,0 +1,410 @@
+"""
+Tests for the transportation service
+"""
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import time
+import pytest
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from src.database.models import Base, Appointment, Transportation
+from src.services.fake_uber_health import FakeUberHealth
+from src.services.ride_dispatcher import RideDispatcher
+from src.services.transportation_service import TransportationService
+from src.services.uber_health_client import UberHealthClient
+
+PICKUP = {'address': '100 Queen St W, Toronto'}
+
+
+@pytest.fixture
+def session_factory(tmp_path):
+    """Sessions on a file database shared with the booking workers"""
+    engine = create_engine(f'sqlite:///{tmp_path / "test.db"}')
+    Base.metadata.create_all(engine)
+    yield sessionmaker(bind=engine)
+    engine.dispose()
+
+
+@pytest.fixture
+def db_session(session_factory):
+    """Create a test database session"""
+    session = session_factory()
+    yield session
+    session.close()
+
+
+@pytest.fixture
+def appointment_id(db_session):
+    """An appointment to travel to"""
+    appointment = Appointment(patient_id=1, provider_id=1, service_type='checkup',
+                              scheduled_datetime=datetime(2030, 1, 15, 10, 0),
+                              location='200 Elizabeth St, Toronto')
+    db_session.add(appointment)
+    db_session.commit()
+    return appointment.id
+
+
+def _dispatcher(session_factory, fake, timeout=2.0, max_attempts=3):
+    return RideDispatcher(session_factory, UberHealthClient(fake.url, timeout=timeout),
+                          max_workers=2, max_attempts=max_attempts,
+                          backoff_seconds=0.01, max_backoff_seconds=0.05)
+
+
+def test_booking_returns_before_provider_responds(session_factory, db_session, appointment_id):
+    """Test that book_ride saves a pending row and the worker confirms it"""
+    with FakeUberHealth(latency=0.3) as fake:
+        dispatcher = _dispatcher(session_factory, fake)
+        service = TransportationService(db_session, dispatcher=dispatcher)
+
+        start = time.perf_counter()
+        result = service.book_ride(appointment_id, PICKUP)
+        assert time.perf_counter() - start < 0.3
+        assert result['status'] == 'pending'
+        assert service.get_booking(result['bookingId'])['status'] == 'pending'
+
+        dispatcher.shutdown()
+
+    db_session.expire_all()
+    booking = service.get_booking(result['bookingId'])
+    assert booking['status'] == 'confirmed'
+    assert booking['rideId'] == 'fake-ride-1'
+    assert booking['dropoffLocation'] == '200 Elizabeth St, Toronto'
+    assert booking['driver']['vehicle'] == 'Toyota Camry - FAKE 123'
+    assert service.get_ride_status('fake-ride-1')['status'] == 'confirmed'
+
+
+def test_booking_retries_transient_failures(session_factory, db_session, appointment_id):
+    """Test that 5xx responses are retried with the same idempotency key"""
+    with FakeUberHealth(fail_first=2) as fake:
+        dispatcher = _dispatcher(session_factory, fake)
+        result = TransportationService(db_session, dispatcher=dispatcher).book_ride(appointment_id, PICKUP)
+        dispatcher.shutdown()
+        assert fake.requests == 3
+
+        # A duplicate submission reuses the ride booked under the same key
+        fake.fail_first = 0
+        db_session.get(Transportation, result['bookingId']).status = 'pending'
+        db_session.commit()
+        dispatcher = _dispatcher(session_factory, fake)
+        assert dispatcher.submit(result['bookingId']).result() == 'confirmed'
+        dispatcher.shutdown()
+        assert len(fake.rides) == 1
+
+
+@pytest.mark.parametrize('fake_options, attempts, error', [
+    ({'latency': 0.5}, 2, 'timed out'),
+    ({'failure_rate': 1.0, 'failure_status': 422}, 1, 'HTTP 422'),
+])
+def test_booking_gives_up(session_factory, db_session, appointment_id, fake_options, attempts, error):
+    """Test that timeouts are retried up to the limit and rejections are not"""
+    with FakeUberHealth(**fake_options) as fake:
+        dispatcher = _dispatcher(session_factory, fake, timeout=0.1, max_attempts=2)
+        service = TransportationService(db_session, dispatcher=dispatcher)
+        result = service.book_ride(appointment_id, PICKUP)
+        dispatcher.shutdown()
+        assert fake.requests == attempts
+
+    db_session.expire_all()
+    booking = service.get_booking(result['bookingId'])
+    assert booking['status'] == 'failed'
+    assert error in booking['error']
+    assert booking['rideId'] is None
+
+
+class _ProviderResponse:
+    """HTTP 200 answer with a given JSON body, or raising while decoding"""
+
+    status_code = 200
+
+    def __init__(self, body):
+        self.body = body
+
+    def json(self):
+        if isinstance(self.body, Exception):
+            raise self.body
+        return self.body
+
+
+class _ProviderSession:
+    """Stand-in HTTP session returning one canned response"""
+
+    def __init__(self, body):
+        self.body = body
+        self.calls = 0
+
+    def post(self, *args, **kwargs):
+        self.calls += 1
+        return _ProviderResponse(self.body)
+
+
+@pytest.mark.parametrize('body', [
+    ValueError('Expecting value: line 1 column 1 (char 0)'),
+    {'status': 'confirmed'},
+    ['not', 'a', 'ride'],
+])
+def test_malformed_provider_response_fails_booking(session_factory, db_session, appointment_id, body):
+    """Test that a response that is not a ride fails the booking without retries"""
+    provider = _ProviderSession(body)
+    dispatcher = RideDispatcher(session_factory, UberHealthClient('http://provider.test', session=provider),
+                                max_workers=1, max_attempts=3, backoff_seconds=0.01)
+    service = TransportationService(db_session, dispatcher=dispatcher)
+    result = service.book_ride(appointment_id, PICKUP)
+    dispatcher.shutdown()
+    assert provider.calls == 1
+
+    db_session.expire_all()
+    booking = service.get_booking(result['bookingId'])
+    assert booking['status'] == 'failed'
+    assert 'Malformed ride provider response' in booking['error']
+
+
+def test_cancelled_booking_is_not_overwritten(session_factory, db_session, appointment_id):
+    """Test that a booking cancelled while in flight stays cancelled"""
+    with FakeUberHealth(latency=0.2) as fake:
+        dispatcher = _dispatcher(session_factory, fake)
+        result = TransportationService(db_session, dispatcher=dispatcher).book_ride(appointment_id, PICKUP)
+        db_session.get(Transportation, result['bookingId']).status = 'cancelled'
+        db_session.commit()
+        dispatcher.shutdown()
+
+    db_session.expire_all()
+    assert db_session.get(Transportation, result['bookingId']).status == 'cancelled'
+
+
+def test_booking_without_dispatcher_is_synchronous(db_session, appointment_id):
+    """Test that rides are still booked within the request without a dispatcher"""
+    result = TransportationService(db_session).book_ride(
+        appointment_id, PICKUP, scheduled_time=datetime(2030, 1, 15, 9, 30)
+    )
+    assert result['status'] == 'confirmed'
+    assert 'bookingId' not in result
+    assert result['rideId']
+
+
+def _clinic_day(db_session):
+    """Appointments at two clinics through one morning"""
+    start = datetime(2030, 1, 15, 9, 0)
+    clinics = ['200 Elizabeth St, Toronto', '  200 ELIZABETH St,  Toronto', '1 Other Ave']
+    appointments = [
+        Appointment(patient_id=i, provider_id=i, service_type='checkup',
+                    scheduled_datetime=start + timedelta(minutes=offset), location=clinics[clinic])
+        for i, (offset, clinic) in enumerate([
+            (0, 0), (5, 1), (10, 0), (12, 0), (14, 1),  # six riders, capacity four
+            (20, 0), (60, 0),                            # the later one rides alone
+            (0, 2), (5, 2)
+        ])
+    ]
+    db_session.add_all(appointments)
+    db_session.commit()
+    return [a.id for a in appointments]
+
+
+def test_proposed_shared_rides(db_session):
+    """Test grouping by dropoff, pickup window and capacity"""
+    ids = _clinic_day(db_session)
+    requests = [{'appointment_id': i, 'pickup_location': {'address': f'{i} Home St'}} for i in ids]
+    requests.append({'appointment_id': 10 ** 6, 'pickup_location': PICKUP})
+
+    rides = TransportationService(db_session).propose_shared_rides(requests)
+    assert sorted(ride['appointmentIds'] for ride in rides) == sorted([
+        ids[0:4], [ids[4], ids[5]], [ids[6]], [ids[7], ids[8]]
+    ])
+    first = next(ride for ride in rides if ride['appointmentIds'][0] == ids[0])
+    assert first['scheduledTime'] == '2030-01-15T08:30:00'
+
+
+def test_bulk_booking_shares_rides_in_one_transaction(db_session):
+    """Test that shared riders get one ride ID, split cost and one commit"""
+    from sqlalchemy import event
+
+    ids = _clinic_day(db_session)
+    requests = [{'appointment_id': i, 'pickup_location': {'address': f'{i} Home St'}} for i in ids]
+    requests.insert(3, {'appointment_id': 10 ** 6, 'pickup_location': PICKUP})
+
+    service = TransportationService(db_session)
+    service.enabled = False
+    commits = []
+    listener = commits.append
+    event.listen(db_session, 'after_commit', listener)
+    results = service.book_rides(requests)
+    event.remove(db_session, 'after_commit', listener)
+
+    assert len(commits) == 1
+    assert results[3] == {'success': False, 'error': 'Appointment not found'}
+    booked = [r for r in results if r['success']]
+    assert len(booked) == len(ids)
+    assert len({r['rideId'] for r in booked}) == 4
+    assert results[0]['estimatedCost'] == round(15.50 / 4, 2)
+    assert results[0]['sharedWith'] == ids[1:4]
+    assert 'sharedWith' not in results[7]
+    assert db_session.query(Transportation).count() == len(ids)
+
+    unshared = service.book_rides(requests[:3], share_rides=False)
+    assert len({r['rideId'] for r in unshared}) == 3
+
+
+def test_bulk_booking_in_background(session_factory, db_session):
+    """Test that each shared ride is one provider request"""
+    ids = _clinic_day(db_session)
+    requests = [{'appointment_id': i, 'pickup_location': {'address': f'{i} Home St'}} for i in ids]
+
+    with FakeUberHealth() as fake:
+        dispatcher = _dispatcher(session_factory, fake)
+        results = TransportationService(db_session, dispatcher=dispatcher).book_rides(requests)
+        assert {r['status'] for r in results} == {'pending'}
+        dispatcher.shutdown()
+        assert fake.requests == 4
+        assert sorted(len(ride['additional_pickups']) for ride in fake.rides.values()) == [0, 1, 1, 3]
+
+    db_session.expire_all()
+    rows = db_session.query(Transportation).order_by(Transportation.appointment_id).all()
+    assert {row.status for row in rows} == {'confirmed'}
+    assert rows[0].ride_id == rows[1].ride_id and rows[0].cost == round(15.50 / 4, 2)
+
+
+class _LostQueue:
+    """A dispatcher whose process dies before booking anything"""
+
+    def submit(self, transportation_id):
+        pass
+
+    def submit_shared(self, transportation_ids):
+        pass
+
+
+def test_pending_rides_are_recovered_after_restart(session_factory, db_session):
+    """Test that rides left pending by a dead process are booked, shared rides as one"""
+    ids = _clinic_day(db_session)
+    requests = [{'appointment_id': i, 'pickup_location': {'address': f'{i} Home St'}} for i in ids]
+    TransportationService(db_session, dispatcher=_LostQueue()).book_rides(requests)
+    db_session.query(Transportation).update({'created_at': datetime.utcnow() - timedelta(minutes=10)})
+    db_session.commit()
+    fresh = TransportationService(db_session, dispatcher=_LostQueue()).book_ride(ids[0], PICKUP)
+
+    with FakeUberHealth(latency=0.1) as fake:
+        dispatcher = _dispatcher(session_factory, fake)
+        futures = dispatcher.resubmit_pending(grace_seconds=60)
+        assert len(futures) == 4
+        # Bookings still queued in this process are not queued twice
+        assert dispatcher.resubmit_pending(grace_seconds=60) == []
+        assert {future.result() for future in futures} == {'confirmed'}
+        dispatcher.shutdown()
+        assert sorted(len(ride['additional_pickups']) for ride in fake.rides.values()) == [0, 1, 1, 3]
+
+    db_session.expire_all()
+    assert db_session.get(Transportation, fresh['bookingId']).status == 'pending'
+    assert db_session.query(Transportation).filter(Transportation.status == 'confirmed').count() == len(ids)
+
+
+def _booked_rides(db_session, appointment_id):
+    """A shared ride with two riders and a ride of its own"""
+    db_session.add_all([
+        Transportation(appointment_id=appointment_id, ride_id=ride_id, status='confirmed')
+        for ride_id in ['ride-a', 'ride-a', 'ride-b']
+    ])
+    db_session.commit()
+
+
+def test_ride_events_coalesce_into_one_update(db_session, appointment_id):
+    """Test that a burst of events is one executemany UPDATE keyed by ride"""
+    from sqlalchemy import event
+
+    _booked_rides(db_session, appointment_id)
+    t0 = datetime(2030, 1, 15, 9, 0)
+    events = [
+        {'event_id': 'e3', 'ride_id': 'ride-a', 'status': 'completed', 'timestamp': t0 + timedelta(minutes=30),
+         'dropoff_time': t0 + timedelta(minutes=30)},
+        {'event_id': 'e1', 'ride_id': 'ride-a', 'status': 'in_progress', 'timestamp': t0,
+         'pickup_time': t0},
+    ] + [
+        {'event_id': f'ping-{i}', 'ride_id': 'ride-b', 'status': 'driver_location',
+         'timestamp': t0 + timedelta(seconds=i)}
+        for i in range(50)
+    ] + [
+        {'event_id': 'e1', 'ride_id': 'ride-a', 'status': 'in_progress', 'timestamp': t0},
+        {'event_id': 'e9', 'ride_id': 'ride-unknown', 'status': 'completed', 'timestamp': t0},
+    ]
+
+    statements = []
+    engine = db_session.get_bind()
+    listener = lambda conn, cursor, statement, parameters, context, executemany: \
+        statements.append((statement.split()[0], executemany))
+    event.listen(engine, 'before_cursor_execute', listener)
+    try:
+        result = TransportationService(db_session).apply_ride_events(events)
+    finally:
+        event.remove(engine, 'before_cursor_execute', listener)
+
+    assert result == {'success': True, 'received': 54, 'duplicates': 1, 'applied': 52,
+                      'stale': 0, 'rides': 2, 'unknown_rides': ['ride-unknown']}
+    assert statements == [('SELECT', False), ('SELECT', False), ('INSERT', True), ('UPDATE', True)]
+
+    db_session.expire_all()
+    rides = db_session.query(Transportation).order_by(Transportation.id).all()
+    assert [r.status for r in rides] == ['completed', 'completed', 'confirmed']
+    assert rides[0].pickup_time == t0 and rides[1].dropoff_time == t0 + timedelta(minutes=30)
+    assert rides[0].last_event_at == t0 + timedelta(minutes=30)
+    # Location pings do not move the status clock
+    assert rides[2].last_event_at is None
+
+    # Redelivery changes nothing; the unknown ride's event was not recorded
+    again = TransportationService(db_session).apply_ride_events(events)
+    assert again['duplicates'] == 53 and again['applied'] == 0
+
+
+def test_stale_ride_events_are_ignored(db_session, appointment_id):
+    """Test that an event older than the last applied one leaves the ride alone"""
+    _booked_rides(db_session, appointment_id)
+    service = TransportationService(db_session)
+    t0 = datetime(2030, 1, 15, 9, 0)
+
+    service.apply_ride_events([{'event_id': 'late', 'ride_id': 'ride-b', 'status': 'completed',
+                                'timestamp': t0 + timedelta(hours=1)}])
+    result = service.apply_ride_events([{'event_id': 'early', 'ride_id': 'ride-b', 'status': 'in_progress',
+                                         'timestamp': t0}])
+    assert (result['applied'], result['stale']) == (0, 1)
+    db_session.expire_all()
+    assert service.get_ride_status('ride-b')['status'] == 'completed'
+
+    assert service.update_ride_status('ride-a', 'in_progress', pickup_time=t0)
+    assert not service.update_ride_status('ride-missing', 'completed')
+    db_session.expire_all()
+    assert service.get_ride_status('ride-a')['pickupTime'] == t0.isoformat()
+
+
+def test_location_pings_do_not_hold_back_status_events(db_session, appointment_id):
+    """Test that a status event older than a newer ping is still applied"""
+    _booked_rides(db_session, appointment_id)
+    service = TransportationService(db_session)
+    t0 = datetime(2030, 1, 15, 9, 0)
+
+    service.apply_ride_events([{'event_id': 'ping', 'ride_id': 'ride-b', 'status': 'driver_location',
+                                'timestamp': t0 + timedelta(seconds=2)}])
+    result = service.apply_ride_events([{'event_id': 'start', 'ride_id': 'ride-b', 'status': 'in_progress',
+                                         'timestamp': t0 + timedelta(seconds=1), 'pickup_time': t0}])
+    assert (result['applied'], result['stale']) == (1, 0)
+    db_session.expire_all()
+    ride = service.get_ride_status('ride-b')
+    assert ride['status'] == 'in_progress' and ride['pickupTime'] == t0.isoformat()
+
+
+def test_recovery_sweep_runs_in_background(session_factory, db_session, appointment_id):
+    """Test that start_recovery books stale pending rides until shutdown"""
+    result = TransportationService(db_session, dispatcher=_LostQueue()).book_ride(appointment_id, PICKUP)
+    db_session.get(Transportation, result['bookingId']).created_at = datetime.utcnow() - timedelta(hours=1)
+    db_session.commit()
+
+    with FakeUberHealth() as fake:
+        dispatcher = _dispatcher(session_factory, fake)
+        dispatcher.start_recovery(interval_seconds=0.05, grace_seconds=60)
+        deadline = time.monotonic() + 5
+        while not fake.rides and time.monotonic() < deadline:
+            time.sleep(0.02)
+        dispatcher.shutdown()
+
+    db_session.expire_all()
+    assert db_session.get(Transportation, result['bookingId']).status == 'confirmed'
@@ -88,3 +88,241 @@ def test_next_steps_included():
     assert 'nextSteps' in result
     assert len(result['nextSteps']) > 0
     assert all('action' in step for step in result['nextSteps'])
+
+
+def _legacy_tier(symptom):
+    """Reference nested substring scan the matcher replaced"""
+    engine = SymptomTriageEngine
+    if any(critical in symptom for critical in engine.CRITICAL_SYMPTOMS):
+        return 0
+    if any(urgent in symptom for urgent in engine.URGENT_SYMPTOMS):
+        return 1
+    if any(routine in symptom for routine in engine.ROUTINE_SYMPTOMS):
+        return 2
+    return None
+
+
+def test_matcher_matches_legacy_substring_scan():
+    """Test that the automaton gives the same tier as the substring scan"""
+    import random
+    
+    engine = SymptomTriageEngine()
+    rng = random.Random(1234)
+    vocabulary = sorted(
+        engine.CRITICAL_SYMPTOMS | engine.URGENT_SYMPTOMS | engine.ROUTINE_SYMPTOMS
+    )
+    filler = ['mild', 'severe', 'sharp', 'and', 'some', 'pain', 'a', ' ', 'chest']
+    
+    for _ in range(2000):
+        words = [rng.choice(vocabulary + filler) for _ in range(rng.randint(0, 5))]
+        symptom = ' '.join(words)
+        # Randomly glue or truncate phrases to exercise partial matches
+        if symptom and rng.random() < 0.3:
+            symptom = symptom[rng.randint(0, len(symptom) - 1):]
+        assert engine._matcher.match(symptom) == _legacy_tier(symptom), symptom
+
+
+def test_matcher_large_vocabulary():
+    """Test that the matcher handles vocabularies of tens of thousands of phrases"""
+    from src.ai.symptom_matcher import SymptomMatcher
+    
+    routine = {f'symptom variant {i}' for i in range(30000)}
+    matcher = SymptomMatcher(({'chest pain'}, {'high fever'}, routine))
+    
+    assert matcher.match('reports symptom variant 29999 today') == 2
+    assert matcher.match('high fever with symptom variant 12') == 1
+    assert matcher.match('symptom variant 5 and chest pain') == 0
+    assert matcher.match('nothing relevant') is None
+
+
+def test_assess_many_matches_single_assessments():
+    """Test that batch assessment returns the same results in order"""
+    engine = SymptomTriageEngine()
+    requests = [
+        {'symptoms': ['cough'], 'duration': '2 months'},
+        {'symptoms': ['chest pain'], 'severity': 'severe'},
+        {'symptoms': ['mild fever'], 'patient_age': 80},
+    ]
+    
+    results = engine.assess_many(requests)
+    
+    assert results == [engine.assess_symptoms(**req) for req in requests]
+
+
+def test_cache_returns_identical_assessments():
+    """Test that cached assessments match uncached ones and count hits"""
+    from src.cache import LRUCache
+    
+    cache = LRUCache(maxsize=100)
+    cached_engine = SymptomTriageEngine(cache=cache)
+    engine = SymptomTriageEngine()
+    
+    first = cached_engine.assess_symptoms(['Cough', 'sore throat'], duration='3 days')
+    # Same canonical input: reordered, re-cased, different day count
+    second = cached_engine.assess_symptoms(['sore throat ', 'cough'], duration='5 days')
+    
+    assert cache.hits == 1 and cache.misses == 1
+    assert first == engine.assess_symptoms(['Cough', 'sore throat'], duration='3 days')
+    assert second == engine.assess_symptoms(['sore throat ', 'cough'], duration='5 days')
+    assert second['assessment']['symptoms'] == ['sore throat ', 'cough']
+
+
+def test_cache_key_distinguishes_rule_inputs():
+    """Test that inputs the rules treat differently get different keys"""
+    engine = SymptomTriageEngine()
+    key = engine._cache_key
+    
+    assert key(['cough'], '2 days', None, 30) == key(['cough'], '4 days', None, 45)
+    assert key(['cough'], None, None, 30) != key(['cough', 'cough'], None, None, 30)
+    assert key(['cough'], '2 days', None, None) != key(['cough'], '2 months', None, None)
+    assert key(['cough'], None, 'very severe', None) == key(['cough'], None, 'severe', None)
+    assert key(['cough'], None, None, 30) != key(['cough'], None, None, 70)
+
+
+def test_cache_lru_eviction_and_ttl():
+    """Test that the cache is bounded and entries expire"""
+    import time
+    from src.cache import LRUCache
+    
+    cache = LRUCache(maxsize=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+    
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.stats()['evictions'] == 1
+    
+    expiring = LRUCache(maxsize=2, ttl=0.01)
+    expiring.set('a', 1)
+    time.sleep(0.02)
+    assert expiring.get('a') is None
+
+
+def test_numpy_backend_matches_rules_on_random_inputs():
+    """Test that the vectorized backend reproduces the rule path exactly"""
+    import random
+    
+    rules = SymptomTriageEngine()
+    vectorized = SymptomTriageEngine(backend='numpy')
+    rng = random.Random(42)
+    vocabulary = sorted(
+        rules.CRITICAL_SYMPTOMS | rules.URGENT_SYMPTOMS | rules.ROUTINE_SYMPTOMS
+    ) + ['itchy elbow', 'mild cough', 'Severe Pain', '']
+    durations = [None, '', '3 hours', '1 day', '2 days', 'a week', '3 weeks',
+                 '1 month', '6 months', 'a while', 'days or months']
+    severities = [None, '', 'mild', 'moderate', 'severe', 'unbearable', 'so-so']
+    ages = [None, 0, 1, 2, 30, 64, 65, 90]
+    
+    requests = [
+        {
+            'symptoms': rng.sample(vocabulary, rng.randint(0, 4)),
+            'duration': rng.choice(durations),
+            'severity': rng.choice(severities),
+            'patient_age': rng.choice(ages)
+        }
+        for _ in range(3000)
+    ]
+    
+    assert vectorized.assess_many(requests) == rules.assess_many(requests)
+    assert vectorized.assess_many(requests[:1]) == rules.assess_many(requests[:1])
+
+
+def test_unknown_backend_rejected():
+    """Test that an unknown backend name fails at construction"""
+    with pytest.raises(ValueError):
+        SymptomTriageEngine(backend='quantum')
+
+
+def _train_model(tmp_path):
+    """Train and save a small model on rule-labelled examples"""
+    from src.ai.triage_model import (
+        LazyTriageModel, model_features, save_triage_model, train_triage_model
+    )
+    
+    engine = SymptomTriageEngine()
+    examples = [
+        (['chest pain'], None, None), (['seizure'], None, 'severe'),
+        (['high fever'], '2 days', None), (['broken bone'], None, 'moderate'),
+        (['cough'], '3 days', 'mild'), (['runny nose'], None, None),
+    ] * 20
+    texts = [model_features(engine, s, d, sev) for s, d, sev in examples]
+    labels = [engine.assess_symptoms(s, d, sev)['urgency'] for s, d, sev in examples]
+    
+    path = str(tmp_path / 'triage_model.joblib')
+    save_triage_model(train_triage_model(texts, labels), path)
+    return LazyTriageModel(path)
+
+
+def test_model_backend_loads_lazily(tmp_path):
+    """Test that the model is read from disk only on first assessment"""
+    pytest.importorskip('sklearn')
+    model = _train_model(tmp_path)
+    engine = SymptomTriageEngine(backend='model', model=model, confidence_threshold=0.0)
+    
+    assert not model.loaded
+    result = engine.assess_symptoms(['chest pain'])
+    assert model.loaded
+    assert result['urgency'] == 'critical'
+
+
+def test_model_backend_falls_back_below_threshold(tmp_path):
+    """Test that low-confidence predictions use the rule tiers"""
+    pytest.importorskip('sklearn')
+    model = _train_model(tmp_path)
+    engine = SymptomTriageEngine(backend='model', model=model, confidence_threshold=1.01)
+    requests = [
+        {'symptoms': ['cough'], 'duration': '2 months'},
+        {'symptoms': ['mild fever'], 'patient_age': 80},
+    ]
+    
+    assert engine.assess_many(requests) == SymptomTriageEngine().assess_many(requests)
+
+
+class _ConstantModel:
+    """Stand-in classifier predicting one label with full confidence"""
+    
+    def __init__(self, label):
+        self.label = label
+    
+    def predict(self, texts):
+        return [self.label] * len(texts), [0.99] * len(texts)
+
+
+def test_model_backend_never_lowers_rule_critical_symptoms():
+    """Test that a confident low-urgency prediction keeps chest pain critical"""
+    engine = SymptomTriageEngine(backend='model', model=_ConstantModel('routine'))
+    
+    results = engine.assess_many([
+        {'symptoms': ['chest pain']},
+        {'symptoms': ['cough', 'Severe chest pain since this morning']},
+        {'symptoms': ['cough']},
+    ])
+    assert [r['urgency'] for r in results] == ['critical', 'critical', 'routine']
+    assert results[0]['confidence'] == 0.95
+
+
+def test_model_training_data_from_sessions():
+    """Test that training pairs are read from stored triage sessions"""
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from src.ai.triage_model import load_training_data
+    from src.database.models import Base, TriageSession
+    
+    db_engine = create_engine('sqlite:///:memory:')
+    Base.metadata.create_all(db_engine)
+    session = sessionmaker(bind=db_engine)()
+    session.add_all([
+        TriageSession(patient_id=1, symptoms=['Cough'], duration='2 days',
+                      severity='mild', urgency_level='routine'),
+        TriageSession(patient_id=1, symptoms=['chest pain'], urgency_level='critical'),
+        TriageSession(patient_id=1, symptoms=['rash'], urgency_level=None),
+    ])
+    session.commit()
+    
+    texts, labels = load_training_data(session, SymptomTriageEngine())
+    session.close()
+    
+    assert labels == ['routine', 'critical']
+    assert texts[0] == 'cough duration_day severity_mild'